@@ -5,25 +5,31 @@ Migrated from Flask to FastAPI for improved performance.
 """
 import asyncio
 import datetime
+import functools
 import json
 import logging
 import os
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Optional, List, Any
+from typing import Optional, List, Any, AsyncIterator, Awaitable, Callable
 
 from fastapi import FastAPI, Depends, HTTPException, Cookie, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 from constants import END_MARKER, TITLE_ELEMENT
 from entities.place import Place
+from generate import generation_stats, output_lengths
 from storyGenerator import StoryGenerator
-from modelcalls.geminiAPI import client as sync_client, config
+from model.circuit import CircuitOpenError
+from modelcalls.circuitAPI import circuit_breakers
+from modelcalls.geminiAPI import config
+from modelcalls.stack import build_client
 from prefixes.medea import medea_prefixes
 from prefixes.scifi import scifi_prefixes
 from prefixes.custom import custom_prefixes
@@ -34,7 +40,8 @@ from image_gen.script_to_prompts import generate_prompts_from_script
 from image_gen.parse_prompt import extract_image_prompts, extract_scene_details
 
 from schemas.requests import (
-    GenerateStoryRequest, GenerateTitleRequest, RewriteTitleRequest,
+    GenerateStoryRequest, GenerateTitleRequest, GenerateFullStoryRequest, RewriteTitleRequest,
+    GenerateDialogueRequest,
     GeneratePromptsRequest, GenerateImagesRequest, GenerateStoryboardRequest,
     SaveTitleRequest, SaveCharactersRequest, SavePlotsRequest,
     SavePlaceRequest, SaveDialogueRequest
@@ -44,10 +51,13 @@ from schemas.responses import (
     CharactersResponse, PlotResponse, PlaceResponse, DialogueResponse,
     ScriptResponse
 )
-from services.session_store import session_store, SessionState
-from services.async_groq import AsyncGroqAPI
-from services.async_generate import generate_place_descriptions_parallel
+from services.session_store import (
+    session_store_from_env, SessionConflictError, SessionState, EMPTY_SESSION
+)
 from services.async_image_gen import generate_images_parallel
+from services.model_limiter import model_limiter, estimate_tokens
+from services.command_queue import command_stats
+from services.prefetch import SessionPrefetcher, prefetch_stats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -59,6 +69,10 @@ limiter = Limiter(key_func=get_remote_address)
 # Maximum iterations for retry loops (prevents infinite loops)
 MAX_GENERATION_RETRIES = 10
 
+# Worker threads for blocking generator steps. Model calls inside them are
+# throttled by the global model limiter, so this only bounds idle waiters.
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "32"))
+
 # Prefix whitelist mapping (security: prevents code injection)
 ALLOWED_PREFIXES = {
     'medea_prefixes': medea_prefixes,
@@ -66,8 +80,23 @@ ALLOWED_PREFIXES = {
     'custom_prefixes': custom_prefixes,
 }
 
-# Create async client wrapper for Groq
-async_client = AsyncGroqAPI(sync_client)
+# Route between the configured providers behind the caching/resilience layers
+sync_client = build_client()
+
+# Register the genre prefixes so the client can cache them provider-side
+for genre_name, genre_prefixes in ALLOWED_PREFIXES.items():
+    sync_client.register_prefixes(genre_name, genre_prefixes)
+
+
+def restore_generator(state: dict) -> StoryGenerator:
+    """Rebuild the StoryGenerator of a session loaded from the session store."""
+    return StoryGenerator.from_state(
+        state, prefixes=ALLOWED_PREFIXES[state['genre']], client=sync_client)
+
+
+# Sessions, in memory or shared between workers (see SESSION_BACKEND)
+session_store = session_store_from_env(restore_generator)
+
 
 
 async def periodic_cleanup():
@@ -82,6 +111,9 @@ async def periodic_cleanup():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager for startup and shutdown tasks."""
+    # Replace the CPU-sized default executor used by run_in_executor(None, ...)
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+    asyncio.get_running_loop().set_default_executor(executor)
     # Start background cleanup task
     cleanup_task = asyncio.create_task(periodic_cleanup())
     logger.info("NarrativeNest FastAPI server started")
@@ -92,6 +124,7 @@ async def lifespan(app: FastAPI):
         await cleanup_task
     except asyncio.CancelledError:
         pass
+    executor.shutdown(wait=False)
     logger.info("NarrativeNest FastAPI server stopped")
 
 
@@ -107,6 +140,22 @@ app = FastAPI(
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    """Report a model provider whose circuit is open as temporarily unavailable."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after) + 1)}
+    )
+
+
+@app.exception_handler(SessionConflictError)
+async def session_conflict_handler(request: Request, exc: SessionConflictError):
+    """Report a mutation lost to a concurrent one of another worker as a conflict."""
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
 # CORS configuration - configurable via environment variable
 # Default to development ports, override with CORS_ORIGINS env var (comma-separated)
 cors_origins_env = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:3001")
@@ -121,28 +170,103 @@ app.add_middleware(
 )
 
 
+def session_cookie(response: Response, session_id: Optional[str]) -> str:
+    """Return the session ID of the request, issuing a cookie if it has none."""
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+        response.set_cookie(
+            key="session_id",
+            value=session_id,
+            httponly=True,
+            samesite="lax"
+        )
+    return session_id
+
+
 async def get_session(
+    session_id: Optional[str] = Cookie(default=None)
+) -> AsyncIterator[SessionState]:
+    """Dependency to get user session, without creating it.
+
+    Requests of visitors without a stored session, such as crawlers, are
+    served the shared EMPTY_SESSION: only /api/generate-story creates
+    sessions, and every other endpoint needs the story it creates.
+
+    Args:
+        session_id: Session ID from cookie
+
+    Returns:
+        SessionState for the user, saved back to the store once the
+        endpoint returns if it changed, or EMPTY_SESSION
+    """
+    session = await session_store.get(session_id) if session_id else None
+    if session is None:
+        yield EMPTY_SESSION
+        return
+    try:
+        yield session
+    finally:
+        # Read-only requests leave the session unchanged, and save skips it.
+        async with session_store.session_lock(session.session_id):
+            await session_store.save(session)
+
+
+async def get_locked_session(
+    session_id: Optional[str] = Cookie(default=None)
+) -> AsyncIterator[SessionState]:
+    """Dependency to get user session, holding its lock meanwhile.
+
+    Endpoints mutating the session use it, so that concurrent requests of
+    a session run one after the other instead of racing on its generator.
+    Streaming endpoints use get_session, and stream_step_events takes the
+    lock for the generation, which runs after the endpoint returned. As in
+    get_session, unknown sessions get EMPTY_SESSION.
+
+    Args:
+        session_id: Session ID from cookie
+
+    Returns:
+        SessionState for the user, saved back to the store before the lock
+        is released, or EMPTY_SESSION
+    """
+    if not session_id:
+        yield EMPTY_SESSION
+        return
+    async with session_store.session_lock(session_id):
+        session = await session_store.get(session_id)
+        if session is None:
+            yield EMPTY_SESSION
+            return
+        try:
+            yield session
+        finally:
+            await session_store.save(session)
+
+
+async def create_locked_session(
     response: Response,
     session_id: Optional[str] = Cookie(default=None)
-) -> SessionState:
-    """Dependency to get or create user session.
+) -> AsyncIterator[SessionState]:
+    """Dependency to get or create user session, holding its lock meanwhile.
+
+    Used by /api/generate-story, the endpoint that starts a story and so
+    materializes the session, issuing its cookie if the request has none.
 
     Args:
         response: FastAPI response object for setting cookies
         session_id: Session ID from cookie
 
     Returns:
-        SessionState for the user
+        SessionState for the user, saved back to the store before the lock
+        is released
     """
-    if session_id is None:
-        session_id = str(uuid.uuid4())
-        response.set_cookie(
-            key="session_id",
-            value=session_id,
-            httponly=True,
-            samesite="lax"
-        )
-    return await session_store.get_or_create(session_id)
+    session_id = session_cookie(response, session_id)
+    async with session_store.session_lock(session_id):
+        session = await session_store.get_or_create(session_id)
+        try:
+            yield session
+        finally:
+            await session_store.save(session)
 
 
 def update_session_data_properties(session: SessionState):
@@ -152,22 +276,126 @@ def update_session_data_properties(session: SessionState):
         session: The user's session state
     """
     if session.generator and hasattr(session.generator, 'seed'):
-        session.data_title["seed"] = session.generator.seed - 1
-        session.data_chars["seed"] = session.generator.seed - 1
-        session.data_scenes["seed"] = session.generator.seed - 1
-        session.place_names = list(set([
-            scene.place for scene in session.generator.scenes[0]
-        ]))
-        session.place_descriptions = {
-            place_name: Place(place_name, '') for place_name in session.place_names
+        session.data_title.seed = session.generator.seed - 1
+        session.data_chars.seed = session.generator.seed - 1
+        session.data_scenes.seed = session.generator.seed - 1
+        place_names = set(scene.place for scene in session.generator.scenes[0])
+        session.data_places.descriptions = {
+            place_name: Place(place_name, '') for place_name in place_names
         }
-        session.data_places["descriptions"] = session.place_descriptions
-        session.data_places["seed"] = session.generator.seed - 1
-        session.data_dialogs["seed"] = session.generator.seed - 1
+        session.data_places.seed = session.generator.seed - 1
+        session.data_dialogs.seed = session.generator.seed - 1
     else:
         raise ValueError("Generator has not been initialized")
 
 
+def _prefetch_key(generator: StoryGenerator, level: int, seed: int, idx: Optional[int] = None):
+    return (level, idx, seed, generator.state_hash())
+
+
+def cancel_stale_prefetches(session: SessionState):
+    """Cancel the prefetches generated from a story that has since changed."""
+    if session.prefetcher is not None and session.generator:
+        state_hash = session.generator.state_hash()
+        session.prefetcher.cancel(keep=lambda key: key[-1] == state_hash)
+
+
+def schedule_prefetch(session: SessionState, level: int, idx: Optional[int] = None):
+    """Start generating in the background the step that usually follows.
+
+    `level` is the step just accepted, numbered as in StoryGenerator.step
+    (-1 for a new story). The next step is generated with the seed its
+    endpoint will use: the title with the default seed, each other level
+    with the next seed of its session data. After the places, and after the
+    dialog of a scene, the dialogs of the next two scenes are generated.
+    """
+    if session.prefetcher is None or not session.generator:
+        return
+    cancel_stale_prefetches(session)
+    generator = session.generator
+    if level == -1:
+        steps = [(0, GenerateTitleRequest().seed, None)]
+    elif level == 0:
+        steps = [(1, session.data_chars.seed + 1, None)]
+    elif level == 1:
+        steps = [(2, session.data_scenes.seed + 1, None)]
+    elif level == 2:
+        steps = [(3, session.data_places.seed + 1, None)]
+    else:
+        first = 0 if level == 3 else idx + 1
+        steps = [(4, session.data_dialogs.seed + n, k)
+                 for n, k in enumerate(range(first, first + 2), start=1)
+                 if k < generator.num_scenes()]
+    for step_level, seed, step_idx in steps:
+        session.prefetcher.start(
+            _prefetch_key(generator, step_level, seed, step_idx),
+            functools.partial(generator.speculate_async, step_level, seed=seed, idx=step_idx)
+        )
+
+
+def command_slot(request: Request, scope: Any = None) -> tuple:
+    """Return what a generation request regenerates: its endpoint and scope."""
+    return (request.url.path, scope)
+
+
+async def run_command(
+    session: SessionState,
+    request: Request,
+    run: Callable[[], Awaitable[Any]],
+    body: Optional[Any] = None,
+    scope: Any = None,
+    supersede: bool = True
+) -> Any:
+    """Run a generation through the command queue of the session.
+
+    The command is identified by the endpoint, `body` and `scope`: an
+    identical request already queued or running is awaited instead of
+    generating again. Unless `supersede` is False, the command cancels the
+    one queued or running for the same endpoint and `scope` (such as the
+    scene of a dialog), whose callers then get the result of this one.
+
+    Args:
+        session: The user's session state
+        request: The generation request
+        run: Coroutine function performing the generation
+        body: Request body, if any
+        scope: Part of the story the endpoint regenerates, if not all
+
+    Returns:
+        The result of `run`, or of the command superseding it
+    """
+    key = (request.url.path, scope, body.model_dump_json() if body is not None else None)
+
+    async def run_and_save():
+        # Another worker may have changed the session before the lock was taken.
+        await session_store.reload(session)
+        try:
+            return await run()
+        finally:
+            await session_store.save(session)
+
+    return await session_store.session_commands(session.session_id).submit(
+        key, run_and_save, slot=command_slot(request, scope) if supersede else None)
+
+
+async def step_or_prefetched(
+    session: SessionState,
+    level: int,
+    seed: int,
+    idx: Optional[int] = None
+):
+    """Step the generator, using the prefetched result of the step if any."""
+    generator = session.generator
+    if session.prefetcher is not None:
+        key = _prefetch_key(generator, level, seed, idx)
+        result = await session.prefetcher.take(key)
+        # The story may have been edited while the prefetch finished.
+        if result is not None and key[-1] == generator.state_hash():
+            generator.accept(level, result, idx=idx)
+            return
+    await generator.step_async(level, seed=seed, idx=idx)
+
+
 # ============================================================================
 # Story Generation Endpoints
 # ============================================================================
@@ -177,7 +405,7 @@ def update_session_data_properties(session: SessionState):
 async def generate_story(
     request: Request,
     body: GenerateStoryRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(create_locked_session)
 ):
     """Initialize story generation with logline and genre.
 
@@ -205,13 +433,19 @@ async def generate_story(
                 prefixes=prefixes,
                 max_paragraph_length=config['max_paragraph_length'],
                 client=sync_client,
-                filter=None
+                filter=None,
+                genre=body.genre_prefix.value
             )
         )
 
         logger.info("New StoryGenerator created")
         update_session_data_properties(session)
 
+        if session.prefetcher is not None:
+            session.prefetcher.cancel()
+        session.prefetcher = SessionPrefetcher() if body.prefetch else None
+        schedule_prefetch(session, -1)
+
         return SuccessResponse(success=True)
 
     except ValueError as e:
@@ -233,15 +467,14 @@ async def generate_title(
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    # Run sync generator.step() in thread pool
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(0, seed=body.seed)
-    )
+    async def run():
+        await step_or_prefetched(session, 0, body.seed)
+        schedule_prefetch(session, 0)
 
-    generated_title = session.generator.title_str().strip()
-    return TitleResponse(title=generated_title)
+        generated_title = session.generator.title_str().strip()
+        return TitleResponse(title=generated_title)
+
+    return await run_command(session, request, run, body=body)
 
 
 @app.post("/api/rewrite-title", response_model=RewriteTitleResponse)
@@ -249,7 +482,7 @@ async def generate_title(
 async def rewrite_title(
     request: Request,
     body: RewriteTitleRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Rewrite an existing title."""
     if not session.generator:
@@ -277,40 +510,37 @@ async def generate_characters(
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_chars["seed"] += 1
-    seed = session.data_chars["seed"]
-    session.data_chars["lock"] = True
-
-    loop = asyncio.get_event_loop()
-
-    # Retry loop for empty character generation with max attempts to prevent infinite loop
-    retry_count = 0
-    generated_characters = ""
-    while retry_count < MAX_GENERATION_RETRIES:
-        await loop.run_in_executor(
-            None,
-            lambda s=seed: session.generator.step(1, seed=s)
-        )
-        generated_characters = strip_remove_end(session.generator.characters.to_string())
-        if len(generated_characters) == 0:
-            seed += 1
-            retry_count += 1
-            logger.warning(f"Empty character generation, retry {retry_count}/{MAX_GENERATION_RETRIES}")
-        else:
-            break
+    async def run():
+        # The seed is only consumed once the generation succeeded, so that a
+        # cancelled or superseded command leaves the session unchanged.
+        seed = session.data_chars.seed + 1
+
+        # Retry loop for empty character generation with max attempts to prevent infinite loop
+        retry_count = 0
+        generated_characters = ""
+        while retry_count < MAX_GENERATION_RETRIES:
+            await step_or_prefetched(session, 1, seed)
+            generated_characters = strip_remove_end(session.generator.characters.to_string())
+            if len(generated_characters) == 0:
+                seed += 1
+                retry_count += 1
+                logger.warning(f"Empty character generation, retry {retry_count}/{MAX_GENERATION_RETRIES}")
+            else:
+                break
+
+        if retry_count >= MAX_GENERATION_RETRIES and len(generated_characters) == 0:
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to generate characters after maximum retries"
+            )
 
-    if retry_count >= MAX_GENERATION_RETRIES and len(generated_characters) == 0:
-        session.data_chars["lock"] = False
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to generate characters after maximum retries"
-        )
+        session.data_chars.seed = seed
+        session.data_chars.history.add(generated_characters, GenerationAction.NEW)
+        schedule_prefetch(session, 1)
 
-    session.data_chars["seed"] = seed
-    session.data_chars["history"].add(generated_characters, GenerationAction.NEW)
-    session.data_chars["lock"] = False
+        return CharactersResponse(characters=generated_characters)
 
-    return CharactersResponse(characters=generated_characters)
+    return await run_command(session, request, run)
 
 
 @app.post("/api/continue-characters")
@@ -323,22 +553,21 @@ async def continue_characters(
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_chars["seed"] += 1
-    seed = session.data_chars["seed"]
-    session.data_chars["lock"] = True
+    async def run():
+        seed = session.data_chars.seed + 1
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.complete(level=2, seed=seed, sample_length=256)
-    )
+        await session.generator.complete_async(level=2, seed=seed, sample_length=256)
+
+        session.data_chars.seed = seed
+        session.data_chars.text = strip_remove_end(session.generator.characters.to_string())
+        session.data_chars.history.add(session.data_chars.text, GenerationAction.CONTINUE)
+        schedule_prefetch(session, 1)
 
-    session.data_chars["text"] = strip_remove_end(session.generator.characters.to_string())
-    session.data_chars["history"].add(session.data_chars["text"], GenerationAction.CONTINUE)
-    session.data_chars["lock"] = False
+        # Note: Original returned history object, keeping compatible format
+        return {"continue_characters": str(session.data_chars.history)}
 
-    # Note: Original returned history object, keeping compatible format
-    return {"continue_characters": str(session.data_chars["history"])}
+    # Continuing extends the characters rather than replacing them
+    return await run_command(session, request, run, supersede=False)
 
 
 @app.post("/api/generate-plots", response_model=PlotResponse)
@@ -351,22 +580,20 @@ async def generate_plots(
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_scenes["seed"] += 1
-    seed = session.data_scenes["seed"]
-    session.data_scenes["lock"] = True
+    async def run():
+        seed = session.data_scenes.seed + 1
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(2, seed=seed)
-    )
+        await step_or_prefetched(session, 2, seed)
+
+        text = strip_remove_end(session.generator.scenes.to_string())
+        session.data_scenes.seed = seed
+        session.data_scenes.text = text
+        session.data_scenes.history.add(text, GenerationAction.NEW)
+        schedule_prefetch(session, 2)
 
-    text = strip_remove_end(session.generator.scenes.to_string())
-    session.data_scenes["text"] = text
-    session.data_scenes["history"].add(text, GenerationAction.NEW)
-    session.data_scenes["lock"] = False
+        return PlotResponse(plot=text)
 
-    return PlotResponse(plot=text)
+    return await run_command(session, request, run)
 
 
 @app.post("/api/generate-place", response_model=PlaceResponse)
@@ -383,63 +610,67 @@ async def generate_place(
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_places["seed"] += 1
-    seed = session.data_places["seed"]
+    async def run():
+        seed = session.data_places.seed + 1
 
-    loop = asyncio.get_event_loop()
+        # Places are generated concurrently
+        await step_or_prefetched(session, 3, seed)
 
-    # Use the original sync step for now (parallel version available in services)
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(3, seed=seed)
-    )
+        session.data_places.seed = seed
+        session.data_places.descriptions = session.generator.places
+        schedule_prefetch(session, 3)
 
-    session.data_places["descriptions"] = session.generator.places
+        # Get last place for response (matches original behavior)
+        text_place = ""
+        place_name = ""
+        for pn, place_description in session.data_places.descriptions.items():
+            text_place = place_description.description
+            place_name = pn
 
-    # Get last place for response (matches original behavior)
-    text_place = ""
-    place_name = ""
-    for pn, place_description in session.data_places["descriptions"].items():
-        text_place = place_description.description
-        place_name = pn
+        return PlaceResponse(place=text_place, place_name=place_name)
 
-    return PlaceResponse(place=text_place, place_name=place_name)
+    return await run_command(session, request, run)
 
 
 @app.post("/api/generate-dialogue", response_model=DialogueResponse)
 @limiter.limit("10/minute")
 async def generate_dialogue(
     request: Request,
+    body: Optional[GenerateDialogueRequest] = None,
     session: SessionState = Depends(get_session)
 ):
-    """Generate dialogue for current scene."""
+    """Generate dialogue for the given scene, by default the current scene."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    idx_dialog = session.data_dialogs["scene"] - 1
-    session.data_dialogs["seed"] += 1
-    seed = session.data_dialogs["seed"]
-    session.data_dialogs["lock"] = True
+    idx_dialog = session.data_dialogs.scene - 1
+    if body is not None and body.scene_index is not None:
+        if body.scene_index >= session.generator.num_scenes():
+            raise HTTPException(status_code=400, detail=f"Invalid scene index: {body.scene_index}")
+        idx_dialog = body.scene_index
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(4, seed=seed, idx=idx_dialog)
-    )
+    async def run():
+        seed = session.data_dialogs.seed + 1
 
-    session.data_dialogs["history"][idx_dialog].add(
-        session.generator.dialogs[idx_dialog], GenerationAction.NEW
-    )
-    session.data_dialogs["lock"] = False
+        await step_or_prefetched(session, 4, seed, idx=idx_dialog)
+
+        session.data_dialogs.scene = idx_dialog + 1
+        session.data_dialogs.seed = seed
+        session.data_dialogs.history[idx_dialog].add(
+            session.generator.dialogs[idx_dialog], GenerationAction.NEW
+        )
+        schedule_prefetch(session, 4, idx=idx_dialog)
 
-    value = strip_remove_end(session.generator.dialogs[idx_dialog])
-    num_scenes = session.generator.num_scenes()
+        value = strip_remove_end(session.generator.dialogs[idx_dialog])
+        num_scenes = session.generator.num_scenes()
 
-    return DialogueResponse(dialogue=value, numScenes=num_scenes)
+        return DialogueResponse(dialogue=value, numScenes=num_scenes)
+
+    return await run_command(session, request, run, scope=idx_dialog)
 
 
 @app.post("/api/renderstory", response_model=ScriptResponse)
-async def render_story_endpoint(session: SessionState = Depends(get_session)):
+async def render_story_endpoint(session: SessionState = Depends(get_locked_session)):
     """Render complete story script."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
@@ -460,6 +691,17 @@ async def get_rendered_story(session: SessionState = Depends(get_session)):
 # Streaming Generation Endpoints
 # ============================================================================
 
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+
+def sse_event(payload: Any) -> str:
+    """Format a payload as a server-sent event."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
 async def stream_text_generator(text: str, chunk_size: int = 5):
     """Stream text in small chunks for real-time display.
 
@@ -469,11 +711,86 @@ async def stream_text_generator(text: str, chunk_size: int = 5):
     """
     for i in range(0, len(text), chunk_size):
         chunk = text[i:i + chunk_size]
-        yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+        yield sse_event({'chunk': chunk})
         await asyncio.sleep(0.02)  # Small delay for visual effect
     yield "data: [DONE]\n\n"
 
 
+async def stream_step_events(
+    run: Callable[[Callable[[dict], None]], Awaitable[Any]],
+    session: SessionState,
+    slot: Optional[tuple] = None
+):
+    """Run a generation as a task and forward the events it emits.
+
+    `run` receives an `emit` callback, whose payloads are sent as events as
+    soon as they are emitted, and returns the final result of the
+    generation. It is sent as a `result` event (or an `error` event),
+    followed by the `[DONE]` sentinel. If the client disconnects, the
+    generation and its model calls are cancelled.
+
+    The response streams after the endpoint returned, so the generation
+    runs as a command of the session, and saves the session once done. A
+    newer generation for the same `slot` cancels it; the final result is
+    then the one of the newer generation.
+
+    Args:
+        run: Coroutine function performing the generation
+        session: The session the generation changes
+        slot: What the generation regenerates (see command_slot)
+    """
+    async def run_and_save():
+        await session_store.reload(session)
+        try:
+            return await run(queue.put_nowait)
+        finally:
+            await session_store.save(session)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    # Token streams cannot be shared, so streamed commands are never coalesced.
+    task = asyncio.create_task(
+        session_store.session_commands(session.session_id).submit(object(), run_and_save, slot))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while True:
+            payload = await queue.get()
+            if payload is None:
+                break
+            yield sse_event(payload)
+
+        try:
+            result = task.result()
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}")
+            yield sse_event({'error': str(e)})
+        else:
+            yield sse_event({'result': result})
+        yield "data: [DONE]\n\n"
+    finally:
+        task.cancel()
+
+
+def stream_step_tokens(
+    run: Callable[[Callable[[str], None]], Awaitable[str]],
+    session: SessionState,
+    slot: Optional[tuple] = None
+):
+    """Run a generator step as a task and forward its model tokens.
+
+    `run` receives an `on_chunk` callback, invoked for every model token,
+    and returns the final text of the level. Tokens are sent as `chunk`
+    events as they arrive, followed by a `result` event with the parsed
+    text (or an `error` event) and the `[DONE]` sentinel.
+
+    Args:
+        run: Coroutine function performing the generation step
+        session: The session the generation step changes
+        slot: What the generation step regenerates (see command_slot)
+    """
+    return stream_step_events(
+        lambda emit: run(lambda chunk: emit({'chunk': chunk})), session, slot)
+
+
 @app.post("/api/generate-title/stream")
 @limiter.limit("10/minute")
 async def generate_title_stream(
@@ -481,26 +798,18 @@ async def generate_title_stream(
     body: GenerateTitleRequest,
     session: SessionState = Depends(get_session)
 ):
-    """Generate story title with streaming response."""
+    """Generate story title, streaming model tokens as they arrive."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    # Run sync generator.step() in thread pool
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(0, seed=body.seed)
-    )
-
-    generated_title = session.generator.title_str().strip()
+    async def run(on_chunk):
+        await session.generator.step_async(0, seed=body.seed, on_chunk=on_chunk)
+        return session.generator.title_str().strip()
 
     return StreamingResponse(
-        stream_text_generator(generated_title),
+        stream_step_tokens(run, session, command_slot(request)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=SSE_HEADERS
     )
 
 
@@ -510,46 +819,31 @@ async def generate_characters_stream(
     request: Request,
     session: SessionState = Depends(get_session)
 ):
-    """Generate story characters with streaming response."""
+    """Generate story characters, streaming model tokens as they arrive."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_chars["seed"] += 1
-    seed = session.data_chars["seed"]
-    session.data_chars["lock"] = True
-
-    loop = asyncio.get_event_loop()
-
-    # Retry loop for empty character generation
-    retry_count = 0
-    generated_characters = ""
-    while retry_count < MAX_GENERATION_RETRIES:
-        await loop.run_in_executor(
-            None,
-            lambda s=seed: session.generator.step(1, seed=s)
-        )
-        generated_characters = strip_remove_end(session.generator.characters.to_string())
-        if len(generated_characters) == 0:
+    async def run(on_chunk):
+        seed = session.data_chars.seed + 1
+        # Retry loop for empty character generation
+        for _ in range(MAX_GENERATION_RETRIES):
+            await session.generator.step_async(1, seed=seed, on_chunk=on_chunk)
+            generated_characters = strip_remove_end(session.generator.characters.to_string())
+            if len(generated_characters) > 0:
+                break
             seed += 1
-            retry_count += 1
         else:
-            break
+            raise RuntimeError("Failed to generate characters after maximum retries")
 
-    if retry_count >= MAX_GENERATION_RETRIES and len(generated_characters) == 0:
-        session.data_chars["lock"] = False
-        raise HTTPException(status_code=500, detail="Failed to generate characters after maximum retries")
-
-    session.data_chars["seed"] = seed
-    session.data_chars["history"].add(generated_characters, GenerationAction.NEW)
-    session.data_chars["lock"] = False
+        session.data_chars.seed = seed
+        session.data_chars.history.add(generated_characters, GenerationAction.NEW)
+        cancel_stale_prefetches(session)
+        return generated_characters
 
     return StreamingResponse(
-        stream_text_generator(generated_characters, chunk_size=10),
+        stream_step_tokens(run, session, command_slot(request)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=SSE_HEADERS
     )
 
 
@@ -559,131 +853,263 @@ async def generate_plots_stream(
     request: Request,
     session: SessionState = Depends(get_session)
 ):
-    """Generate plot/scene breakdown with streaming response."""
+    """Generate plot/scene breakdown, streaming model tokens as they arrive."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_scenes["seed"] += 1
-    seed = session.data_scenes["seed"]
-    session.data_scenes["lock"] = True
+    async def run(on_chunk):
+        seed = session.data_scenes.seed + 1
+        await session.generator.step_async(2, seed=seed, on_chunk=on_chunk)
+        text = strip_remove_end(session.generator.scenes.to_string())
+        session.data_scenes.seed = seed
+        session.data_scenes.text = text
+        session.data_scenes.history.add(text, GenerationAction.NEW)
+        cancel_stale_prefetches(session)
+        return text
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(2, seed=seed)
+    return StreamingResponse(
+        stream_step_tokens(run, session, command_slot(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
-    text = strip_remove_end(session.generator.scenes.to_string())
-    session.data_scenes["text"] = text
-    session.data_scenes["history"].add(text, GenerationAction.NEW)
-    session.data_scenes["lock"] = False
+
+@app.post("/api/generate-place/stream")
+@limiter.limit("10/minute")
+async def generate_place_stream(
+    request: Request,
+    session: SessionState = Depends(get_session)
+):
+    """Generate place descriptions, streaming model tokens as they arrive."""
+    if not session.generator:
+        raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
+
+    async def run(on_chunk):
+        seed = session.data_places.seed + 1
+        await session.generator.step_async(3, seed=seed, on_chunk=on_chunk)
+        session.data_places.seed = seed
+        session.data_places.descriptions = session.generator.places
+        cancel_stale_prefetches(session)
+
+        text_parts = []
+        for pn, place_description in session.data_places.descriptions.items():
+            if place_description and place_description.description:
+                text_parts.append(f"**{pn}**\n{place_description.description}\n")
+        return "\n".join(text_parts)
 
     return StreamingResponse(
-        stream_text_generator(text, chunk_size=10),
+        stream_step_tokens(run, session, command_slot(request)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=SSE_HEADERS
     )
 
 
-@app.post("/api/generate-place/stream")
+@app.post("/api/generate-dialogue/stream")
 @limiter.limit("10/minute")
-async def generate_place_stream(
+async def generate_dialogue_stream(
     request: Request,
     session: SessionState = Depends(get_session)
 ):
-    """Generate place descriptions with streaming response."""
+    """Generate dialogue, streaming model tokens as they arrive."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    session.data_places["seed"] += 1
-    seed = session.data_places["seed"]
+    idx_dialog = session.data_dialogs.scene - 1
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(3, seed=seed)
+    async def run(on_chunk):
+        seed = session.data_dialogs.seed + 1
+        await session.generator.step_async(4, seed=seed, idx=idx_dialog, on_chunk=on_chunk)
+        session.data_dialogs.seed = seed
+        session.data_dialogs.history[idx_dialog].add(
+            session.generator.dialogs[idx_dialog], GenerationAction.NEW
+        )
+        return strip_remove_end(session.generator.dialogs[idx_dialog])
+
+    return StreamingResponse(
+        stream_step_tokens(run, session, command_slot(request, idx_dialog)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
-    session.data_places["descriptions"] = session.generator.places
 
-    # Get all place descriptions for streaming
-    text_parts = []
-    for pn, place_description in session.data_places["descriptions"].items():
-        if place_description and place_description.description:
-            text_parts.append(f"**{pn}**\n{place_description.description}\n")
+@app.post("/api/generate-places/stream")
+@limiter.limit("10/minute")
+async def generate_places_stream(
+    request: Request,
+    session: SessionState = Depends(get_session)
+):
+    """Generate all place descriptions concurrently, streaming each place.
+
+    Each place is sent as an event with `node` "place", the place name as
+    `key` and its description as `text`, in the order they complete.
+    """
+    if not session.generator:
+        raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    combined_text = "\n".join(text_parts)
+    async def run(emit):
+        seed = session.data_places.seed + 1
+        await session.generator.step_async(
+            3,
+            seed=seed,
+            on_result=lambda name, place: emit(
+                {'node': 'place', 'key': name, 'text': place.description})
+        )
+        session.data_places.seed = seed
+        session.data_places.descriptions = session.generator.places
+        cancel_stale_prefetches(session)
+        return {name: place.description for name, place in session.generator.places.items()}
 
     return StreamingResponse(
-        stream_text_generator(combined_text, chunk_size=10),
+        stream_step_events(run, session, command_slot(request)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=SSE_HEADERS
     )
 
 
-@app.post("/api/generate-dialogue/stream")
+@app.post("/api/generate-dialogues/stream")
 @limiter.limit("10/minute")
-async def generate_dialogue_stream(
+async def generate_dialogues_stream(
     request: Request,
     session: SessionState = Depends(get_session)
 ):
-    """Generate dialogue with streaming response."""
+    """Generate the dialogs of all scenes concurrently, streaming each scene.
+
+    Each dialog is sent as an event with `node` "dialog", the scene index as
+    `key` and the dialog as `text`, in the order they complete.
+    """
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
-    idx_dialog = session.data_dialogs["scene"] - 1
-    session.data_dialogs["seed"] += 1
-    seed = session.data_dialogs["seed"]
-    session.data_dialogs["lock"] = True
+    async def run(emit):
+        seed = session.data_dialogs.seed + 1
+        # Recorded once all dialogs are generated, as superseded or cancelled
+        # generations must leave the session unchanged.
+        dialogs = {}
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
-        lambda: session.generator.step(4, seed=seed, idx=idx_dialog)
+        def on_result(k, dialog):
+            dialogs[k] = dialog
+            emit({'node': 'dialog', 'key': k, 'text': strip_remove_end(dialog)})
+
+        await session.generator.step_async(4, seed=seed, on_result=on_result)
+        session.data_dialogs.seed = seed
+        for k, dialog in dialogs.items():
+            session.data_dialogs.history[k].add(dialog, GenerationAction.NEW)
+        return [strip_remove_end(dialog) for dialog in session.generator.dialogs]
+
+    return StreamingResponse(
+        stream_step_events(run, session, command_slot(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
 
-    session.data_dialogs["history"][idx_dialog].add(
-        session.generator.dialogs[idx_dialog], GenerationAction.NEW
+
+@app.post("/api/generate-full-story/stream")
+@limiter.limit("5/minute")
+async def generate_full_story_stream(
+    request: Request,
+    body: GenerateFullStoryRequest,
+    session: SessionState = Depends(get_session)
+):
+    """Generate the whole story, streaming each result as it is generated.
+
+    Title and characters are generated concurrently, then the scenes, then
+    every place and dialog as soon as its inputs exist. Each result is sent
+    as an event with the level (`node`), the place name or scene index
+    (`key`) and the `text`; the rendered script is sent as the `result`.
+    """
+    if not session.generator:
+        raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
+
+    async def run(emit):
+        # Recorded once the story is generated, as superseded or cancelled
+        # generations must leave the session unchanged.
+        results = []
+
+        def on_result(level, key, text):
+            results.append((level, key, text))
+            emit({'node': level, 'key': key, 'text': text})
+
+        await session.generator.generate_story_async(seed=body.seed, on_result=on_result)
+        for level, key, text in results:
+            if level == 'characters':
+                session.data_chars.text = text
+                session.data_chars.history.add(text, GenerationAction.NEW)
+            elif level == 'scenes':
+                session.data_scenes.text = text
+                session.data_scenes.history.add(text, GenerationAction.NEW)
+            elif level == 'dialog':
+                session.data_dialogs.history[key].add(text, GenerationAction.NEW)
+        session.data_places.descriptions = session.generator.places
+        cancel_stale_prefetches(session)
+        session.script_text = render_story(session.generator.get_story())
+        return session.script_text
+
+    return StreamingResponse(
+        stream_step_events(run, session, command_slot(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
     )
-    session.data_dialogs["lock"] = False
 
-    value = strip_remove_end(session.generator.dialogs[idx_dialog])
+
+@app.post("/api/refresh-story/stream")
+@limiter.limit("10/minute")
+async def refresh_story_stream(
+    request: Request,
+    session: SessionState = Depends(get_session)
+):
+    """Regenerate only the places and dialogs whose inputs were edited.
+
+    Meant to follow /api/save-characters, /api/save-plots or other edits.
+    Each regenerated place or dialog is sent as an event with `node`, `key`
+    and `text` as it completes; the final `result` lists the regenerated
+    place names and scene indices.
+    """
+    if not session.generator:
+        raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
+
+    async def run(emit):
+        seed = session.data_dialogs.seed + 1
+        # Recorded once the refresh completed, as superseded or cancelled
+        # generations must leave the session unchanged.
+        refreshed = {}
+
+        def on_result(level, key, text):
+            if level == 'dialog':
+                refreshed[key] = text
+            emit({'node': level, 'key': key, 'text': text})
+
+        places, dialogs = await session.generator.refresh_async(seed=seed, on_result=on_result)
+        session.data_dialogs.seed = seed
+        for k, text in refreshed.items():
+            session.data_dialogs.history[k].add(text, GenerationAction.NEW)
+        session.data_places.descriptions = session.generator.places
+        cancel_stale_prefetches(session)
+        return {'places': places, 'dialogs': dialogs}
 
     return StreamingResponse(
-        stream_text_generator(value, chunk_size=10),
+        stream_step_events(run, session, command_slot(request)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=SSE_HEADERS
     )
 
 
 @app.post("/api/renderstory/stream")
 async def render_story_stream(
     request: Request,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Render complete story script with streaming response."""
     if not session.generator:
         raise HTTPException(status_code=400, detail="Story not initialized. Call /api/generate-story first.")
 
     story = session.generator.get_story()
-    session.script_text = render_story(story)
+    script = session.script_text = render_story(story)
 
+    # The text is sent after the session was saved and its lock released.
     return StreamingResponse(
-        stream_text_generator(session.script_text, chunk_size=15),
+        stream_text_generator(script, chunk_size=15),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=SSE_HEADERS
     )
 
 
@@ -696,7 +1122,7 @@ async def render_story_stream(
 async def save_title(
     request: Request,
     body: SaveTitleRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Save edited title content back to the story generator.
 
@@ -724,7 +1150,7 @@ async def save_title(
 async def save_characters(
     request: Request,
     body: SaveCharactersRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Save edited characters content back to the story generator."""
     if not session.generator:
@@ -736,8 +1162,9 @@ async def save_characters(
             None,
             lambda: session.generator.rewrite(body.content, level=2)
         )
+        cancel_stale_prefetches(session)
         # Update session history
-        session.data_chars["history"].add(body.content, GenerationAction.EDIT)
+        session.data_chars.history.add(body.content, GenerationAction.EDIT)
         logger.info("Characters saved")
         return SuccessResponse(success=True)
     except Exception as e:
@@ -750,7 +1177,7 @@ async def save_characters(
 async def save_plots(
     request: Request,
     body: SavePlotsRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Save edited plot/scenes content back to the story generator."""
     if not session.generator:
@@ -762,9 +1189,10 @@ async def save_plots(
             None,
             lambda: session.generator.rewrite(body.content, level=3)
         )
+        cancel_stale_prefetches(session)
         # Update session data
-        session.data_scenes["text"] = body.content
-        session.data_scenes["history"].add(body.content, GenerationAction.EDIT)
+        session.data_scenes.text = body.content
+        session.data_scenes.history.add(body.content, GenerationAction.EDIT)
         logger.info("Plots saved")
         return SuccessResponse(success=True)
     except Exception as e:
@@ -777,7 +1205,7 @@ async def save_plots(
 async def save_place(
     request: Request,
     body: SavePlaceRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Save edited place description back to the story generator."""
     if not session.generator:
@@ -789,6 +1217,7 @@ async def save_place(
             None,
             lambda: session.generator.rewrite(body.content, level=4, entity=body.place_name)
         )
+        cancel_stale_prefetches(session)
         logger.info(f"Place '{body.place_name}' saved")
         return SuccessResponse(success=True)
     except Exception as e:
@@ -801,7 +1230,7 @@ async def save_place(
 async def save_dialogue(
     request: Request,
     body: SaveDialogueRequest,
-    session: SessionState = Depends(get_session)
+    session: SessionState = Depends(get_locked_session)
 ):
     """Save edited dialogue content back to the story generator."""
     if not session.generator:
@@ -818,7 +1247,7 @@ async def save_dialogue(
             lambda: session.generator.rewrite(body.content, level=5, entity=body.scene_index)
         )
         # Update session history
-        session.data_dialogs["history"][body.scene_index].add(body.content, GenerationAction.EDIT)
+        session.data_dialogs.history[body.scene_index].add(body.content, GenerationAction.EDIT)
         logger.info(f"Dialogue for scene {body.scene_index} saved")
         return SuccessResponse(success=True)
     except HTTPException:
@@ -840,10 +1269,11 @@ async def generate_prompts(
 ):
     """Generate image prompts from script using GPT-4."""
     loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(
-        None,
-        lambda: generate_prompts_from_script(body.script)
-    )
+    async with model_limiter.slot_async(estimate_tokens(body.script, 1024)):
+        result = await loop.run_in_executor(
+            None,
+            lambda: generate_prompts_from_script(body.script)
+        )
     return result
 
 
@@ -876,10 +1306,11 @@ async def generate_storyboard(
 
     # Step 1: Generate prompts from script (sync Gemini call)
     try:
-        prompts = await loop.run_in_executor(
-            None,
-            lambda: generate_prompts_from_script(body.script)
-        )
+        async with model_limiter.slot_async(estimate_tokens(body.script, 1024)):
+            prompts = await loop.run_in_executor(
+                None,
+                lambda: generate_prompts_from_script(body.script)
+            )
         logger.info("Successfully generated prompts from script")
     except Exception as e:
         logger.error(f"Failed to generate prompts from script: {e}")
@@ -940,13 +1371,27 @@ async def root():
 @app.get("/healthz")
 async def healthz():
     """Health check endpoint."""
-    return {"status": "healthy", "sessions": session_store.session_count}
+    return {"status": "healthy", "sessions": await session_store.count()}
 
 
 @app.get("/api/healthz")
 async def api_healthz():
     """API health check endpoint (alternative path)."""
-    return {"status": "healthy", "sessions": session_store.session_count}
+    return {"status": "healthy", "sessions": await session_store.count()}
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """Counters reported by the model client stack."""
+    return {
+        "sessions": await session_store.count(),
+        "client": sync_client.stats,
+        "circuits": circuit_breakers.stats,
+        "generation": generation_stats(),
+        "output_lengths": output_lengths.stats,
+        "prefetch": prefetch_stats(),
+        "commands": command_stats(),
+    }
 
 
 # ============================================================================
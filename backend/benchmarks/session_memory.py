@@ -0,0 +1,53 @@
+"""Benchmark of the memory held per session by the in-memory session store.
+
+Creates sessions the way the API does and reports the bytes allocated per
+session, measured with tracemalloc, for visitors who never generate
+anything and for sessions with a history on every level.
+
+Run from the backend directory:
+
+    python -m benchmarks.session_memory [--sessions 10000]
+"""
+import argparse
+import asyncio
+import gc
+import tracemalloc
+
+from operations.uicontrol import GenerationAction
+from services.session_store import InMemorySessionStore
+
+
+def _add_history(session, num_scenes: int):
+    session.data_chars.history.add("characters", GenerationAction.NEW)
+    session.data_scenes.history.add("scenes", GenerationAction.NEW)
+    for k in range(num_scenes):
+        session.data_dialogs.history[k].add("dialog", GenerationAction.NEW)
+
+
+async def _bytes_per_session(num_sessions: int, num_scenes: int) -> float:
+    store = InMemorySessionStore()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(num_sessions):
+        session = await store.get_or_create(f"session-{i:08d}")
+        if num_scenes:
+            _add_history(session, num_scenes)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / num_sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10000)
+    args = parser.parse_args()
+    for label, num_scenes in (("empty", 0), ("history, 8 scenes", 8)):
+        per_session = asyncio.run(_bytes_per_session(args.sessions, num_scenes))
+        print(f"{label:>20}: {per_session:8.0f} bytes/session "
+              f"({per_session * args.sessions / 2**20:.1f} MiB for {args.sessions} sessions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,13 @@ MAX_PARAGRAPH_LENGTH = 1024
 MAX_RETRIES = 10
 MAX_NUM_REPETITIONS = 3
 MAX_NUM_ATTEMPTS_GET_OUT_OF_LOOP = 3
+# Approximate characters per model token, to convert character limits to token budgets
+CHARS_PER_TOKEN = 4
 
 
 END_MARKER = "**END**"
+# Model stops generating at the end marker or at the start of a new few-shot example
+STOP_SEQUENCES = (END_MARKER, "Example ")
 STOP_MARKER = "\n"
 CHARACTER_MARKER = "**Character:** "
 DESCRIPTION_MARKER = "**Description:** "
@@ -58,5 +58,9 @@ class Scenes(NamedTuple):
   def num_places(self):
     return len(set([scene.place for scene in self.scenes]))
 
+  def place_names(self) -> List[str]:
+    """Return the names of the places, in order of first appearance."""
+    return list(dict.fromkeys(scene.place for scene in self.scenes))
+
   def num_scenes(self) -> int:
     return len(self.scenes)
@@ -1,8 +1,13 @@
+import asyncio
 import collections
-from typing import Dict, List, NamedTuple, Optional, Union
-from constants import (BEAT_ELEMENT, CHARACTERS_ELEMENT, DESCRIPTION_ELEMENT,
+import logging
+import math
+import os
+import threading
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+from constants import (BEAT_ELEMENT, CHARACTERS_ELEMENT, CHARS_PER_TOKEN, DEFAULT_SEED, DESCRIPTION_ELEMENT,
                        DIALOG_MARKER, END_MARKER, MAX_NUM_ATTEMPTS_GET_OUT_OF_LOOP, MAX_NUM_REPETITIONS, MAX_PARAGRAPH_LENGTH, PLOT_ELEMENT, PLACE_ELEMENT,
-                       SCENES_MARKER, TITLE_ELEMENT, SAMPLE_LENGTH_TITLE, SAMPLE_LENGTH_PLACE, 
+                       SCENES_MARKER, STOP_SEQUENCES, TITLE_ELEMENT, SAMPLE_LENGTH_TITLE, SAMPLE_LENGTH_PLACE, 
                        MAX_PARAGRAPH_LENGTH_CHARACTERS, MAX_PARAGRAPH_LENGTH_SCENES,
                        )
 from entities.character import Characters
@@ -11,54 +16,154 @@ from entities.scene import Scene, Scenes
 from entities.title import Title
 from model.FilterAPI import FilterAPI
 from model.LanguageAPI import LanguageAPI
+from model.lengths import OutputLengthModel
+from model.levels import (CHARACTERS, DIALOG, PLACE, SCENES, TITLE, current_genre,
+                          current_level, generation_level)
 from utils.prefix_summary import prefix_summary
-
-import time
-
-
-def generate_text(generation_prompt: str,
-                  client: LanguageAPI,
-                  model_filter: Optional[FilterAPI] = None,
-                  sample_length: Optional[int] = None,
-                  max_paragraph_length: int = MAX_PARAGRAPH_LENGTH,
-                  seed: Optional[int] = None,
-                  num_samples: int = 1,
-                  max_num_repetitions: Optional[int] = None) -> str:
-  """Generate text using the generation prompt."""
+from utils.run_sync import iterate_sync, sync_shim
+
+logger = logging.getLogger(__name__)
+
+# Escape generation loops by sampling the alternative seeds concurrently
+SPECULATIVE_SEEDS = os.getenv("SPECULATIVE_SEEDS", "1") == "1"
+
+# Choose the sample length of each level from the output lengths observed
+LEARNED_LENGTHS = os.getenv("LEARNED_LENGTHS", "1") == "1"
+output_lengths = OutputLengthModel()
+
+# Model calls made by generate_text and the size of their inputs.
+_round_counters = collections.Counter()
+_round_counters_lock = threading.Lock()
+
+
+def generation_stats() -> Dict[str, int]:
+  """Return the counters of the generation rounds made so far."""
+  with _round_counters_lock:
+    return dict(_round_counters)
+
+
+def _report_round(num_call: int, prompt: str, sample_length: int):
+  """Log and count the input sent by one generation round."""
+  with _round_counters_lock:
+    _round_counters['rounds'] += 1
+    _round_counters['input_chars'] += len(prompt)
+    if num_call > 0:
+      _round_counters['continuation_rounds'] += 1
+  logger.info(f'Generation round {num_call + 1}: {len(prompt)} input chars '
+              f'(~{len(prompt) // CHARS_PER_TOKEN} tokens), up to {sample_length} output tokens')
+
+
+def _count(**increments: int):
+  """Add to the generation counters."""
+  with _round_counters_lock:
+    _round_counters.update(increments)
+
+
+def _learned_sample_length(max_paragraph_length: Optional[int]) -> Optional[int]:
+  """Return the token budget learned for the current genre and level, if any."""
+  level = current_level()
+  if not LEARNED_LENGTHS or level is None:
+    return None
+  return output_lengths.sample_length(current_genre(), level, max_paragraph_length)
+
+
+def _record_length(text: str):
+  """Record the length of a finished generation of the current level."""
+  level = current_level()
+  if level is not None:
+    output_lengths.record(current_genre(), level, len(text))
+
+
+def _max_num_calls(sample_length: int, max_paragraph_length: int) -> int:
+  """Return the cap on the calls needed for `max_paragraph_length` characters.
+
+  `sample_length` is in tokens, so it is converted to characters first.
+  """
+  return math.ceil(max_paragraph_length / (sample_length * CHARS_PER_TOKEN)) + 1
+
+
+def _round_sample_length(sample_length: int,
+                         max_paragraph_length: Optional[int],
+                         num_generated: int,
+                         learned_length: Optional[int] = None) -> int:
+  """Return the output tokens to request in a generation round.
+
+  The first round asks for the `learned_length` of the level when there is
+  one, which most generations fit in. Otherwise, rather than resending the
+  prompt and everything generated so far for each `sample_length`
+  continuation, a round asks for enough tokens to reach
+  `max_paragraph_length` in a single call.
+  """
+  if learned_length is not None and num_generated == 0:
+    return learned_length
+  if max_paragraph_length is None:
+    return sample_length
+  remaining = max_paragraph_length - num_generated
+  return max(sample_length, math.ceil(remaining / CHARS_PER_TOKEN) + 1)
+
+
+async def generate_text_async(generation_prompt: str,
+                              client: LanguageAPI,
+                              model_filter: Optional[FilterAPI] = None,
+                              sample_length: Optional[int] = None,
+                              max_paragraph_length: int = MAX_PARAGRAPH_LENGTH,
+                              seed: Optional[int] = None,
+                              num_samples: int = 1,
+                              max_num_repetitions: Optional[int] = None,
+                              on_chunk: Optional[Callable[[str], None]] = None,
+                              stop: Optional[Sequence[str]] = None) -> str:
+  """Generate text using the generation prompt.
+
+  `stop` sequences are passed to the model so that it stops generating at
+  the terminators instead of producing the full sample length. Each round
+  asks for the tokens needed to reach `max_paragraph_length` (at least
+  `sample_length`), so continuation rounds, which resend the growing
+  prompt, are only needed when the model stops short.
+  With loop detection (`max_num_repetitions`) or `on_chunk`, the text is
+  streamed through `generate_text_stream_async`, which aborts a looping stream
+  as soon as the loop appears; each chunk is passed to `on_chunk` as soon
+  as it is released.
+  """
+
+  if on_chunk is not None or max_num_repetitions:
+    result = ''
+    async for chunk in generate_text_stream_async(
+        generation_prompt=generation_prompt,
+        client=client,
+        model_filter=model_filter,
+        sample_length=sample_length,
+        max_paragraph_length=max_paragraph_length,
+        seed=seed,
+        max_num_repetitions=max_num_repetitions,
+        stop=stop):
+      if on_chunk is not None:
+        on_chunk(chunk)
+      result += chunk
+    return result + END_MARKER
 
   # To prevent lengthy generation loops, we cap the number of calls to the API.
   if sample_length is None:
     sample_length = client.default_sample_length
-  max_num_calls = int(max_paragraph_length / sample_length) + 1
+  max_num_calls = _max_num_calls(sample_length, max_paragraph_length)
+  learned_length = _learned_sample_length(max_paragraph_length)
   num_calls = 0
 
   result = ''
   while True:
     prompt = generation_prompt + result
-    success, current_seed = False, seed
-    while success is False:
-      t0 = time.time()
-      responses = client.sample(
-          prompt=prompt,
-          sample_length=sample_length,
-          seed=current_seed,
-          num_samples=num_samples)
-      t1 = time.time()
-      # Get the first result from the list of responses
-      response = responses[0]
-      if model_filter is not None and not model_filter.validateText(response.text):
-        return 'Content was filtered out.' + END_MARKER
-      if max_num_repetitions:
-        success = not detect_loop(
-            response.text, max_num_repetitions=max_num_repetitions)
-        if not success:
-          current_seed += 1
-          if current_seed > (seed + MAX_NUM_ATTEMPTS_GET_OUT_OF_LOOP):
-            success = True
-          else:
-            continue
-      else:
-        success = True
+    round_sample_length = _round_sample_length(
+        sample_length, max_paragraph_length, len(result), learned_length)
+    _report_round(num_calls, prompt, round_sample_length)
+    responses = await client.sample_async(
+        prompt=prompt,
+        sample_length=round_sample_length,
+        seed=seed,
+        num_samples=num_samples,
+        stop=stop)
+    # Get the first result from the list of responses
+    response = responses[0]
+    if model_filter is not None and not model_filter.validateText(response.text):
+      return 'Content was filtered out.' + END_MARKER
 
     result = result + response.text
     num_calls += 1
@@ -66,30 +171,255 @@ def generate_text(generation_prompt: str,
     # Attempt to find the END_MARKER
     index = result.find(END_MARKER)
     if index != -1:
-      return result[:index] + END_MARKER
+      result = result[:index]
+      break
 
     # Attempt to find the start of a new example
     index = result.find('Example ')
     if index != -1:
-      return result[:index] + END_MARKER
+      result = result[:index]
+      break
 
     if max_paragraph_length is not None and len(result) > max_paragraph_length:
-      return result + END_MARKER
+      break
     if num_calls >= max_num_calls:
-      return result + END_MARKER
+      break
+
+  _record_length(result)
+  return result + END_MARKER
+
+
+def _find_terminator(text: str, start: int = 0) -> int:
+  """Return the index of the earliest terminator in text[start:], or -1."""
+  indices = [text.find(marker, start) for marker in STOP_SEQUENCES]
+  indices = [index for index in indices if index != -1]
+  return min(indices) if indices else -1
+
 
-  return result
+def repetition_score(text: str) -> float:
+  """Return the fraction of the paragraphs of `text` repeating an earlier one."""
+  blocks = text.split('\n\n')
+  counts = collections.Counter(blocks)
+  return sum(count - 1 for count in counts.values()) / len(blocks)
+
+
+def escape_seeds(seed: Optional[int]) -> List[int]:
+  """Return the seeds tried to get out of a loop generated with `seed`."""
+  if seed is None:
+    seed = DEFAULT_SEED
+  return [seed + k for k in range(1, MAX_NUM_ATTEMPTS_GET_OUT_OF_LOOP + 1)]
+
+
+async def _escape_loop_async(client: LanguageAPI,
+                             prompt: str,
+                             text: str,
+                             sample_length: int,
+                             seed: Optional[int],
+                             max_num_repetitions: int,
+                             stop: Optional[Sequence[str]] = None) -> str:
+  """Continue `text`, which ended in a loop, with all escape seeds at once.
+
+  Returns the first continuation that does not loop, or else the one with
+  the lowest repetition score, and cancels the remaining calls.
+  Continuations stop at the first terminator.
+  """
+  seeds = escape_seeds(seed)
+  _count(loop_escapes=1, escape_calls=len(seeds))
+  logger.info(f'Escaping a generation loop with seeds {seeds}')
+  tasks = [
+      asyncio.ensure_future(client.sample_async(
+          prompt=prompt, sample_length=sample_length, seed=current_seed, stop=stop))
+      for current_seed in seeds]
+  candidates = []
+  try:
+    for next_done in asyncio.as_completed(tasks):
+      try:
+        candidate = (await next_done)[0].text
+      except Exception as e:
+        logger.warning(f'Loop escape sample failed: {e}')
+        continue
+      index = _find_terminator(candidate)
+      if index != -1:
+        candidate = candidate[:index]
+      if not detect_loop(text + candidate, max_num_repetitions=max_num_repetitions):
+        return candidate
+      candidates.append(candidate)
+  finally:
+    for task in tasks:
+      task.cancel()
+  _count(loop_escape_misses=1)
+  if not candidates:
+    return ''
+  return min(candidates, key=lambda candidate: repetition_score(text + candidate))
+
+
+class LoopDetector:
+  """Incremental counterpart of detect_loop for text growing chunk by chunk.
+
+  Paragraphs (blocks separated by blank lines) are counted as soon as they
+  are complete. A loop is found when a paragraph occurs more than
+  `max_num_repetitions` times; the text before that occurrence is kept.
+  """
+
+  def __init__(self, max_num_repetitions: int = MAX_NUM_REPETITIONS):
+    self._max_num_repetitions = max_num_repetitions
+    self._counts = collections.Counter()
+    # Start of the paragraph that is not complete yet.
+    self._start = 0
+
+  def feed(self, text: str, final: bool = False) -> int:
+    """Count the paragraphs completed in `text`, which extends earlier text.
+
+    Args:
+      text: The whole text generated so far.
+      final: Whether the text is complete, so that its last paragraph counts.
+
+    Returns:
+      The index at which the looping paragraph starts, or -1.
+    """
+    while True:
+      end = text.find('\n\n', self._start)
+      if end == -1:
+        if not final or self._start >= len(text):
+          return -1
+        end = len(text)
+      block = text[self._start:end]
+      self._counts[block] += 1
+      if self._counts[block] > self._max_num_repetitions:
+        logger.info(f'Detected {self._counts[block]} repetitions of a '
+                    f'{len(block)}-char block')
+        logger.debug(f'Repeated block:\n{block}')
+        return self._start
+      self._start = end + 2
+
+  def safe_length(self, text: str) -> int:
+    """Return how much of `text` cannot turn out to be part of a loop.
+
+    The current paragraph is held back while it could still complete a
+    paragraph that was already seen the maximum number of times.
+    """
+    tail = text[self._start:]
+    if tail and any(count >= self._max_num_repetitions and block.startswith(tail)
+                    for block, count in self._counts.items()):
+      return self._start
+    return len(text)
+
+
+async def generate_text_stream_async(generation_prompt: str,
+                                    client: LanguageAPI,
+                                    model_filter: Optional[FilterAPI] = None,
+                                    sample_length: Optional[int] = None,
+                                    max_paragraph_length: int = MAX_PARAGRAPH_LENGTH,
+                                    seed: Optional[int] = None,
+                                    max_num_repetitions: Optional[int] = None,
+                                    stop: Optional[Sequence[str]] = None
+                                    ) -> AsyncIterator[str]:
+  """Generate text using the generation prompt, yielding model tokens.
+
+  Follows the same continuation rounds and stopping rules as generate_text,
+  but yields text as the model produces it, and closes the model stream as
+  soon as a terminator or a loop appears. Terminators are never yielded:
+  the tail of the text that could be the start of a marker split across
+  chunks is held back until the next chunk settles it. Likewise, a
+  paragraph that may become one repetition too many is held back, and a
+  loop ends the generation with the text before it, continued by the first
+  non-looping alternative seed when SPECULATIVE_SEEDS is set (see
+  _escape_loop_async). Streamed text cannot
+  be retracted, so with a model filter each round is only released once it
+  has been validated. The END_MARKER is not appended.
+  """
 
+  if sample_length is None:
+    sample_length = client.default_sample_length
+  max_num_calls = _max_num_calls(sample_length, max_paragraph_length)
+  learned_length = _learned_sample_length(max_paragraph_length)
+  num_calls = 0
+  holdback = max(len(marker) for marker in STOP_SEQUENCES) - 1
+  loop_detector = LoopDetector(max_num_repetitions) if max_num_repetitions else None
 
-def generate_text_no_loop(generation_prompt: str,
-                          client: LanguageAPI,
-                          model_filter: Optional[FilterAPI] = None,
-                          sample_length: Optional[int] = None,
-                          max_paragraph_length: int = MAX_PARAGRAPH_LENGTH,
-                          seed: Optional[int] = None,
-                          num_samples: int = 1) -> str:
+  result = ''
+  num_sent = 0
+  while True:
+    prompt = generation_prompt + result
+    round_start = len(result)
+    terminated = looped = False
+    round_sample_length = _round_sample_length(
+        sample_length, max_paragraph_length, len(result), learned_length)
+    _report_round(num_calls, prompt, round_sample_length)
+    stream = client.sample_stream_async(
+        prompt=prompt, sample_length=round_sample_length, seed=seed, stop=stop)
+    try:
+      async for chunk in stream:
+        # Markers lying entirely in earlier text have already been searched.
+        search_start = max(0, len(result) - holdback)
+        result += chunk
+        index = _find_terminator(result, search_start)
+        if index != -1:
+          result = result[:index]
+          terminated = True
+          break
+        releasable = len(result) - holdback
+        if loop_detector is not None:
+          index = loop_detector.feed(result)
+          if index != -1:
+            result = result[:index]
+            terminated = looped = True
+            break
+          releasable = min(releasable, loop_detector.safe_length(result))
+        if model_filter is None and releasable > num_sent:
+          yield result[num_sent:releasable]
+          num_sent = releasable
+    finally:
+      await stream.aclose()
+    num_calls += 1
+    if looped and SPECULATIVE_SEEDS:
+      result += await _escape_loop_async(
+          client, generation_prompt + result, result,
+          sample_length=_round_sample_length(
+              sample_length, max_paragraph_length, len(result)),
+          seed=seed, max_num_repetitions=max_num_repetitions, stop=stop)
+      # The escaped text is checked for loops from scratch.
+      loop_detector = LoopDetector(max_num_repetitions)
+
+    text = result[round_start:]
+    if model_filter is not None and not model_filter.validateText(text):
+      yield 'Content was filtered out.'
+      return
+    if terminated:
+      break
+    if max_paragraph_length is not None and len(result) > max_paragraph_length:
+      break
+    if num_calls >= max_num_calls:
+      break
+    if model_filter is not None:
+      releasable = len(result)
+      if loop_detector is not None:
+        releasable = loop_detector.safe_length(result)
+      if releasable > num_sent:
+        yield result[num_sent:releasable]
+        num_sent = releasable
+
+  if loop_detector is not None:
+    index = loop_detector.feed(result, final=True)
+    if index != -1:
+      result = result[:index]
+  _record_length(result)
+  if len(result) > num_sent:
+    yield result[num_sent:]
+
+
+async def generate_text_no_loop_async(generation_prompt: str,
+                                     client: LanguageAPI,
+                                     model_filter: Optional[FilterAPI] = None,
+                                     sample_length: Optional[int] = None,
+                                     max_paragraph_length: int = MAX_PARAGRAPH_LENGTH,
+                                     seed: Optional[int] = None,
+                                     num_samples: int = 1,
+                                     on_chunk: Optional[Callable[[str], None]] = None,
+                                     stop: Optional[Sequence[str]] = None
+                                     ) -> str:
   """Generate text using the generation prompt, without any loop."""
-  return generate_text(
+  return await generate_text_async(
       generation_prompt=generation_prompt,
       client=client,
       model_filter=model_filter,
@@ -97,114 +427,176 @@ def generate_text_no_loop(generation_prompt: str,
       max_paragraph_length=sample_length,
       seed=seed,
       max_num_repetitions=None,
-      num_samples=num_samples)
-
-
-def generate_title(storyline: str,
-                   prefixes: Dict[str, str],
-                   client: LanguageAPI,
-                   model_filter: Optional[FilterAPI] = None,
-                   seed: Optional[int] = None,
-                   num_samples: int = 1):
+      num_samples=num_samples,
+      on_chunk=on_chunk,
+      stop=stop)
+
+
+async def generate_title_async(storyline: str,
+                               prefixes: Dict[str, str],
+                               client: LanguageAPI,
+                               model_filter: Optional[FilterAPI] = None,
+                               seed: Optional[int] = None,
+                               num_samples: int = 1,
+                               on_chunk: Optional[Callable[[str], None]] = None):
   """Generate a title given a storyline, and client."""
 
   # Combine the prompt and storyline as a helpful generation prefix
   titles_prefix = prefixes['TITLES_PROMPT'] + storyline + ' ' + TITLE_ELEMENT
-  title_text = generate_text_no_loop(
-      generation_prompt=titles_prefix,
-      client=client,
-      model_filter=model_filter,
-      sample_length=SAMPLE_LENGTH_TITLE,
-      seed=seed,
-      num_samples=num_samples)
+  with generation_level(TITLE):
+    title_text = await generate_text_no_loop_async(
+        generation_prompt=titles_prefix,
+        client=client,
+        model_filter=model_filter,
+        sample_length=SAMPLE_LENGTH_TITLE,
+        seed=seed,
+        num_samples=num_samples,
+        on_chunk=on_chunk,
+        stop=STOP_SEQUENCES)
   title = Title.from_string(TITLE_ELEMENT + title_text)
   return (title, titles_prefix)
 
 
-def generate_characters(
+async def generate_characters_async(
     storyline: str,
     prefixes: Dict[str, str],
     client: LanguageAPI,
     model_filter: Optional[FilterAPI] = None,
     seed: Optional[int] = None,
     max_paragraph_length: int = (MAX_PARAGRAPH_LENGTH_CHARACTERS),
-    num_samples: int = 1):
+    num_samples: int = 1,
+    on_chunk: Optional[Callable[[str], None]] = None):
   """Generate characters given a storyline, prompt, and client."""
 
   # Combine the prompt and storyline as a helpful generation prefix
   characters_prefix = prefixes['CHARACTERS_PROMPT'] + storyline
-  characters_text = generate_text(
-      generation_prompt=characters_prefix,
-      client=client,
-      model_filter=model_filter,
-      seed=seed,
-      max_paragraph_length=max_paragraph_length,
-      num_samples=num_samples)
+  with generation_level(CHARACTERS):
+    characters_text = await generate_text_async(
+        generation_prompt=characters_prefix,
+        client=client,
+        model_filter=model_filter,
+        seed=seed,
+        max_paragraph_length=max_paragraph_length,
+        num_samples=num_samples,
+        on_chunk=on_chunk,
+        stop=STOP_SEQUENCES)
   characters = Characters.from_string(characters_text)
 
   return (characters, characters_prefix)
 
 
-def generate_scenes(storyline: str,
-                    character_descriptions: Dict[str, str],
-                    prefixes: Dict[str, str],
-                    client: LanguageAPI,
-                    model_filter: Optional[FilterAPI] = None,
-                    seed: Optional[int] = None,
-                    max_paragraph_length: int = (MAX_PARAGRAPH_LENGTH_SCENES),
-                    num_samples: int = 1):
+async def generate_scenes_async(storyline: str,
+                                character_descriptions: Dict[str, str],
+                                prefixes: Dict[str, str],
+                                client: LanguageAPI,
+                                model_filter: Optional[FilterAPI] = None,
+                                seed: Optional[int] = None,
+                                max_paragraph_length: int = (MAX_PARAGRAPH_LENGTH_SCENES),
+                                num_samples: int = 1,
+                                on_chunk: Optional[Callable[[str], None]] = None):
   """Generate scenes given storyline, prompt, main characters, and client."""
 
   scenes_prefix = prefixes['SCENE_PROMPT'] + storyline + '\n'
   for name in character_descriptions:
     scenes_prefix += character_descriptions[name] + '\n'
   scenes_prefix += '\n' + SCENES_MARKER
-  scenes_text = generate_text(
-      generation_prompt=scenes_prefix,
-      client=client,
-      model_filter=model_filter,
-      seed=seed,
-      max_paragraph_length=max_paragraph_length,
-      num_samples=num_samples)
+  with generation_level(SCENES):
+    scenes_text = await generate_text_async(
+        generation_prompt=scenes_prefix,
+        client=client,
+        model_filter=model_filter,
+        seed=seed,
+        max_paragraph_length=max_paragraph_length,
+        num_samples=num_samples,
+        on_chunk=on_chunk,
+        stop=STOP_SEQUENCES)
   scenes = Scenes.from_string(scenes_text)
 
   return (scenes, scenes_prefix)
 
 
-def generate_place_descriptions(storyline: str,
-                                scenes: Scenes,
-                                prefixes: Dict[str, str],
-                                client: LanguageAPI,
-                                model_filter: Optional[FilterAPI] = None,
-                                seed: Optional[int] = None,
-                                num_samples: int = 1):
-  """Generate a place description given a scene object and a client."""
+def build_place_prompt(storyline: str, place_name: str, prefixes: Dict[str, str]) -> str:
+  """Return the prompt of the description of a place."""
+  return prefixes['SETTING_PROMPT'] + storyline + '\n' + Place.format_prefix(place_name)
 
-  place_descriptions = {}
 
-  # Get unique place names from the scenes.
-  unique_place_names = set([scene.place for scene in scenes.scenes])
-
-  # Build a unique place prefix prompt.
-  place_prefix = prefixes['SETTING_PROMPT'] + storyline + '\n'
-
-  # Build a list of place descriptions for each place
-  place_prefixes = []
-  for place_name in unique_place_names:
-    place_suffix = Place.format_prefix(place_name)
-    place_text = generate_text(
-        generation_prompt=place_prefix + place_suffix,
+async def generate_place_description_async(
+    storyline: str,
+    place_name: str,
+    prefixes: Dict[str, str],
+    client: LanguageAPI,
+    model_filter: Optional[FilterAPI] = None,
+    seed: Optional[int] = None,
+    num_samples: int = 1,
+    on_chunk: Optional[Callable[[str], None]] = None) -> Tuple[Place, str]:
+  """Generate the description of one place, returning it and its prompt.
+
+  When streaming through `on_chunk`, the place is introduced by its
+  formatted prefix and followed by a blank line, as in Place.to_string.
+  """
+
+  place_suffix = Place.format_prefix(place_name)
+  place_prompt = build_place_prompt(storyline, place_name, prefixes)
+  if on_chunk is not None:
+    on_chunk(place_suffix)
+  with generation_level(PLACE):
+    place_text = await generate_text_async(
+        generation_prompt=place_prompt,
         client=client,
         model_filter=model_filter,
         sample_length=SAMPLE_LENGTH_PLACE,
         seed=seed,
-        num_samples=num_samples)
-    place_text = place_suffix + place_text
-    place_descriptions[place_name] = Place.from_string(place_name, place_text)
-    place_prefixes.append(place_prefix + place_suffix)
+        num_samples=num_samples,
+        on_chunk=on_chunk,
+        stop=STOP_SEQUENCES)
+  if on_chunk is not None:
+    on_chunk('\n\n')
+  return (Place.from_string(place_name, place_suffix + place_text), place_prompt)
 
-  return (place_descriptions, place_prefixes)
 
+async def generate_place_descriptions_async(
+    storyline: str,
+    scenes: Scenes,
+    prefixes: Dict[str, str],
+    client: LanguageAPI,
+    model_filter: Optional[FilterAPI] = None,
+    seed: Optional[int] = None,
+    num_samples: int = 1,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    on_result: Optional[Callable[[str, Place], None]] = None):
+  """Generate a place description given a scene object and a client.
+
+  Places are generated concurrently, or one after the other when streaming
+  through `on_chunk`. `on_result(place_name, place)` is called as soon as
+  each place is described.
+  """
+
+  # Get unique place names from the scenes, in order of appearance.
+  unique_place_names = scenes.place_names()
+
+  async def generate(place_name: str):
+    (place, place_prompt) = await generate_place_description_async(
+        storyline=storyline,
+        place_name=place_name,
+        prefixes=prefixes,
+        client=client,
+        model_filter=model_filter,
+        seed=seed,
+        num_samples=num_samples,
+        on_chunk=on_chunk)
+    if on_result is not None:
+      on_result(place_name, place)
+    return (place, place_prompt)
+
+  if on_chunk is None:
+    results = await asyncio.gather(*[generate(name) for name in unique_place_names])
+  else:
+    results = [await generate(name) for name in unique_place_names]
+
+  place_descriptions = {
+      place_name: place for place_name, (place, _) in zip(unique_place_names, results)}
+  place_prefixes = [prompt for _, prompt in results]
+  return (place_descriptions, place_prefixes)
 
 
 def detect_loop(text: str, max_num_repetitions: int = MAX_NUM_REPETITIONS):
@@ -215,23 +607,24 @@ def detect_loop(text: str, max_num_repetitions: int = MAX_NUM_REPETITIONS):
   for block in blocks:
     num_repetitions = num_unique_blocks[block]
     if num_repetitions > max_num_repetitions:
-      print(f'Detected {num_repetitions} repetitions of block:\n{block}')
+      logger.info(f'Detected {num_repetitions} repetitions of a '
+                  f'{len(block)}-char block')
+      logger.debug(f'Repeated block:\n{block}')
       return True
   return False
 
 
-def generate_dialog(storyline: str,
-                    scenes: List[Scene],
-                    character_descriptions: Dict[str, str],
-                    place_descriptions: Dict[str, Place],
-                    prefixes: Dict[str, str],
-                    max_paragraph_length: int,
-                    client: LanguageAPI,
-                    model_filter: Optional[FilterAPI] = None,
-                    max_num_repetitions: Optional[int] = None,
-                    seed: Optional[int] = None,
-                    num_samples: int = 1):
-  """Generate dialog given a scene object and a client."""
+def build_dialog_prompt(storyline: str,
+                        scenes: List[Scene],
+                        character_descriptions: Dict[str, str],
+                        place_descriptions: Dict[str, Place],
+                        prefixes: Dict[str, str]) -> str:
+  """Return the prompt of the dialog of the last of `scenes`.
+
+  The prompt holds everything the dialog depends on: the place of the scene
+  and its description, the characters mentioned in the beat, the plot
+  element, the previous beat and the beat.
+  """
 
   scene = scenes[-1]
 
@@ -261,15 +654,101 @@ def generate_dialog(storyline: str,
       prefixes['DIALOG_PROMPT'] + place_t + characters_t + plot_element_t +
       summary_t + beat_t)
   dialog_prefix += '\n' + DIALOG_MARKER + '\n'
+  return dialog_prefix
 
-  dialog = generate_text(
-      generation_prompt=dialog_prefix,
-      client=client,
-      model_filter=model_filter,
-      seed=seed,
-      max_paragraph_length=max_paragraph_length,
-      max_num_repetitions=max_num_repetitions,
-      num_samples=num_samples)
+
+async def generate_dialog_async(storyline: str,
+                                scenes: List[Scene],
+                                character_descriptions: Dict[str, str],
+                                place_descriptions: Dict[str, Place],
+                                prefixes: Dict[str, str],
+                                max_paragraph_length: int,
+                                client: LanguageAPI,
+                                model_filter: Optional[FilterAPI] = None,
+                                max_num_repetitions: Optional[int] = None,
+                                seed: Optional[int] = None,
+                                num_samples: int = 1,
+                                on_chunk: Optional[Callable[[str], None]] = None):
+  """Generate dialog given a scene object and a client."""
+
+  dialog_prefix = build_dialog_prompt(
+      storyline, scenes, character_descriptions, place_descriptions, prefixes)
+
+  with generation_level(DIALOG):
+    dialog = await generate_text_async(
+        generation_prompt=dialog_prefix,
+        client=client,
+        model_filter=model_filter,
+        seed=seed,
+        max_paragraph_length=max_paragraph_length,
+        max_num_repetitions=max_num_repetitions,
+        num_samples=num_samples,
+        on_chunk=on_chunk,
+        stop=STOP_SEQUENCES)
 
   return (dialog, dialog_prefix)
 
+
+async def generate_dialogs_async(storyline: str,
+                                 scenes: Scenes,
+                                 character_descriptions: Dict[str, str],
+                                 place_descriptions: Dict[str, Place],
+                                 prefixes: Dict[str, str],
+                                 max_paragraph_length: int,
+                                 client: LanguageAPI,
+                                 model_filter: Optional[FilterAPI] = None,
+                                 max_num_repetitions: Optional[int] = None,
+                                 seed: Optional[int] = None,
+                                 num_samples: int = 1,
+                                 on_chunk: Optional[Callable[[str], None]] = None,
+                                 on_result: Optional[Callable[[int, str], None]] = None
+                                 ) -> Tuple[List[str], List[str]]:
+  """Generate the dialogs of all scenes, returning dialogs and prompts.
+
+  Dialogs are generated concurrently, or one scene after the other when
+  streaming through `on_chunk`. `on_result(k, dialog)` is called as soon
+  as the dialog of scene k is generated.
+  """
+
+  async def generate(k: int):
+    (dialog, dialog_prompt) = await generate_dialog_async(
+        storyline=storyline,
+        scenes=scenes.scenes[:(k + 1)],
+        character_descriptions=character_descriptions,
+        place_descriptions=place_descriptions,
+        prefixes=prefixes,
+        max_paragraph_length=max_paragraph_length,
+        client=client,
+        model_filter=model_filter,
+        max_num_repetitions=max_num_repetitions,
+        seed=seed,
+        num_samples=num_samples,
+        on_chunk=on_chunk)
+    if on_result is not None:
+      on_result(k, dialog)
+    return (dialog, dialog_prompt)
+
+  indices = range(len(scenes.scenes))
+  if on_chunk is None:
+    results = await asyncio.gather(*[generate(k) for k in indices])
+  else:
+    results = [await generate(k) for k in indices]
+  return ([dialog for dialog, _ in results], [prompt for _, prompt in results])
+
+
+# Blocking versions of the generation functions, for scripts. The API awaits
+# the async versions directly.
+generate_text = sync_shim(generate_text_async)
+generate_text_no_loop = sync_shim(generate_text_no_loop_async)
+generate_title = sync_shim(generate_title_async)
+generate_characters = sync_shim(generate_characters_async)
+generate_scenes = sync_shim(generate_scenes_async)
+generate_place_description = sync_shim(generate_place_description_async)
+generate_place_descriptions = sync_shim(generate_place_descriptions_async)
+generate_dialog = sync_shim(generate_dialog_async)
+generate_dialogs = sync_shim(generate_dialogs_async)
+
+
+def generate_text_stream(*args, **kwargs):
+  """Blocking version of generate_text_stream_async, yielding model tokens."""
+  return iterate_sync(generate_text_stream_async(*args, **kwargs))
@@ -1,7 +1,11 @@
-from typing import Dict, List, NamedTuple, Optional, Union
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+from model.retry import RetryPolicy
 
 _MAX_RETRIES = 10
 _TIMEOUT = 120.0
+_ATTEMPT_TIMEOUT = 30.0
 
 
 class LanguageResponse(NamedTuple):
@@ -21,7 +25,8 @@ class LanguageAPI:
                config_sampling: Optional[dict] = None,
                seed: Optional[int] = None,
                max_retries: int = _MAX_RETRIES,
-               timeout: float = _TIMEOUT):
+               timeout: float = _TIMEOUT,
+               attempt_timeout: float = _ATTEMPT_TIMEOUT):
     """Initializer.
 
     Args:
@@ -32,7 +37,8 @@ class LanguageAPI:
       config_sampling: Sampleing parameters.
       seed: Random seed for sampling.
       max_retries: Maximum number of retries for the remote API.
-      timeout: Maximum waiting timeout
+      timeout: Maximum waiting time for a call, retries included.
+      attempt_timeout: Maximum waiting time for a single attempt.
     """
     self._sample_length = sample_length
     self._model = model
@@ -41,6 +47,10 @@ class LanguageAPI:
     self._seed = seed
     self._max_retries = max_retries
     self._timeout = timeout
+    self._retry_policy = RetryPolicy(max_retries=max_retries,
+                                     deadline=timeout,
+                                     attempt_timeout=min(attempt_timeout,
+                                                         timeout))
 
   @property
   def default_sample_length(self):
@@ -66,10 +76,78 @@ class LanguageAPI:
   def config_sampling(self):
     return self._config_sampling
 
+  @property
+  def stats(self) -> Dict[str, Any]:
+    """Counters reported by the client and any wrappers around it."""
+    return {'retry': self._retry_policy.stats}
+
+  def register_prefixes(self, genre: str, prefixes: Dict[str, str]):
+    """Register few-shot prompt prefixes the client may cache provider-side.
+
+    Clients without prompt caching ignore the registration.
+    """
+    return None
+
   def sample(self,
              prompt: str,
              sample_length: Optional[int] = None,
              seed: Optional[int] = None,
-             num_samples: int = 1):
-    """Sample model with provided prompt, optional sample_length and seed."""
+             num_samples: int = 1,
+             stop: Optional[Sequence[str]] = None):
+    """Sample model with provided prompt, optional sample_length and seed.
+
+    Generation stops at the first of the `stop` sequences. Providers drop
+    the matched sequence, so when a generation given stop sequences ends
+    before the length limit, the text is terminated with `stop[0]` for
+    callers to tell a finished generation from a truncated one.
+    """
     raise NotImplementedError('sample method not implemented in generic class')
+
+  async def sample_async(self,
+                         prompt: str,
+                         sample_length: Optional[int] = None,
+                         seed: Optional[int] = None,
+                         num_samples: int = 1,
+                         stop: Optional[Sequence[str]] = None):
+    """Asynchronously sample model with provided prompt.
+
+    Clients whose SDK has no async path fall back to running the blocking
+    `sample` in the event loop's default executor, in the caller's context;
+    native async clients override this method.
+    """
+    return await asyncio.to_thread(self.sample,
+                                   prompt=prompt,
+                                   sample_length=sample_length,
+                                   seed=seed,
+                                   num_samples=num_samples,
+                                   stop=stop)
+
+  def sample_stream(self,
+                    prompt: str,
+                    sample_length: Optional[int] = None,
+                    seed: Optional[int] = None,
+                    stop: Optional[Sequence[str]] = None) -> Iterator[str]:
+    """Stream model response, yielding text chunks as they are generated.
+
+    Clients without a streaming API yield the whole sample as one chunk.
+    """
+    responses = self.sample(prompt=prompt,
+                            sample_length=sample_length,
+                            seed=seed,
+                            stop=stop)
+    if responses and responses[0].text:
+      yield responses[0].text
+
+  async def sample_stream_async(self,
+                                prompt: str,
+                                sample_length: Optional[int] = None,
+                                seed: Optional[int] = None,
+                                stop: Optional[Sequence[str]] = None
+                                ) -> AsyncIterator[str]:
+    """Asynchronously stream model response as text chunks."""
+    responses = await self.sample_async(prompt=prompt,
+                                        sample_length=sample_length,
+                                        seed=seed,
+                                        stop=stop)
+    if responses and responses[0].text:
+      yield responses[0].text
@@ -0,0 +1,131 @@
+import hashlib
+import json
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence
+
+from model.LanguageAPI import LanguageAPI
+
+
+def sampling_key(client: LanguageAPI,
+                 prompt: str,
+                 sample_length: Optional[int] = None,
+                 seed: Optional[int] = None,
+                 num_samples: int = 1,
+                 stop: Optional[Sequence[str]] = None,
+                 **extra: Any) -> str:
+  """Return a digest identifying a sampling request to the given client.
+
+  Two requests with the same key are expected to produce the same response:
+  the key covers the model, system prompt, prompt, sample length, seed, stop
+  sequences and sampling parameters, plus any `extra` request options.
+  """
+  config_sampling = client.config_sampling or {}
+  request = {
+      'model': client.model,
+      'model_param': client.model_param,
+      'prompt': prompt,
+      'sample_length': sample_length or client.default_sample_length,
+      'seed': seed,
+      'num_samples': num_samples,
+      'stop': list(stop) if stop else None,
+      'temp': config_sampling.get('temp'),
+      'prob': config_sampling.get('prob'),
+  }
+  request.update(extra)
+  encoded = json.dumps(request, sort_keys=True, ensure_ascii=False)
+  return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class LanguageAPIWrapper(LanguageAPI):
+  """Base class for decorators adding behaviour around another LanguageAPI.
+
+  Properties, sampling methods and any other attribute are forwarded to the
+  wrapped client, so a stack of wrappers can replace the client it decorates.
+  Subclasses override the sampling methods they change.
+  """
+
+  def __init__(self, client: LanguageAPI):
+    self._client = client
+
+  def __getattr__(self, name: str):
+    if name == '_client':
+      raise AttributeError(name)
+    return getattr(self._client, name)
+
+  @property
+  def client(self) -> LanguageAPI:
+    return self._client
+
+  @property
+  def default_sample_length(self):
+    return self._client.default_sample_length
+
+  @property
+  def model(self):
+    return self._client.model
+
+  @property
+  def model_param(self):
+    return self._client.model_param
+
+  @property
+  def model_metadata(self):
+    return self._client.model_metadata
+
+  @property
+  def seed(self):
+    return self._client.seed
+
+  @property
+  def config_sampling(self):
+    return self._client.config_sampling
+
+  @property
+  def stats(self) -> Dict[str, Any]:
+    return self._client.stats
+
+  def register_prefixes(self, genre: str, prefixes: Dict[str, str]):
+    return self._client.register_prefixes(genre, prefixes)
+
+  def sample(self,
+             prompt: str,
+             sample_length: Optional[int] = None,
+             seed: Optional[int] = None,
+             num_samples: int = 1,
+             stop: Optional[Sequence[str]] = None):
+    return self._client.sample(prompt=prompt,
+                               sample_length=sample_length,
+                               seed=seed,
+                               num_samples=num_samples,
+                               stop=stop)
+
+  async def sample_async(self,
+                         prompt: str,
+                         sample_length: Optional[int] = None,
+                         seed: Optional[int] = None,
+                         num_samples: int = 1,
+                         stop: Optional[Sequence[str]] = None):
+    return await self._client.sample_async(prompt=prompt,
+                                           sample_length=sample_length,
+                                           seed=seed,
+                                           num_samples=num_samples,
+                                           stop=stop)
+
+  def sample_stream(self,
+                    prompt: str,
+                    sample_length: Optional[int] = None,
+                    seed: Optional[int] = None,
+                    stop: Optional[Sequence[str]] = None) -> Iterator[str]:
+    return self._client.sample_stream(prompt=prompt,
+                                      sample_length=sample_length,
+                                      seed=seed,
+                                      stop=stop)
+
+  def sample_stream_async(self,
+                          prompt: str,
+                          sample_length: Optional[int] = None,
+                          seed: Optional[int] = None,
+                          stop: Optional[Sequence[str]] = None) -> AsyncIterator[str]:
+    return self._client.sample_stream_async(prompt=prompt,
+                                            sample_length=sample_length,
+                                            seed=seed,
+                                            stop=stop)
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from model.errors import is_transient_error
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(RuntimeError):
+  """Raised instead of calling a dependency whose circuit is open."""
+
+  def __init__(self, name: str, retry_after: float):
+    super().__init__(f'Circuit {name} is open, retry in {retry_after:.0f}s')
+    self.name = name
+    self.retry_after = retry_after
+
+
+class CircuitBreaker:
+  """Closed / open / half-open circuit breaker for one upstream dependency.
+
+  Outcomes of the calls in the last `window` seconds are kept. A call fails
+  if it raised a transient error or took longer than `slow_call_seconds`.
+  Once `min_calls` are recorded and the failure rate reaches
+  `failure_rate`, the circuit opens and calls are refused for
+  `open_seconds`. It then lets `half_open_calls` probes through: the circuit
+  closes if they all succeed and opens again on the first failure.
+  """
+
+  def __init__(self,
+               name: str,
+               failure_rate: float = 0.5,
+               slow_call_seconds: float = 60.0,
+               min_calls: int = 10,
+               window: float = 60.0,
+               open_seconds: float = 30.0,
+               half_open_calls: int = 2):
+    """Initializer.
+
+    Args:
+      name: Name of the dependency, reported in errors and stats.
+      failure_rate: Failure rate at which the circuit opens.
+      slow_call_seconds: Calls slower than this count as failures.
+      min_calls: Calls in the window required before the circuit can open.
+      window: Length in seconds of the outcome window.
+      open_seconds: Time the circuit stays open before probing.
+      half_open_calls: Successful probes needed to close the circuit.
+    """
+    self.name = name
+    self._failure_rate = failure_rate
+    self._slow_call_seconds = slow_call_seconds
+    self._min_calls = min_calls
+    self._window = window
+    self._open_seconds = open_seconds
+    self._half_open_calls = half_open_calls
+    self._state = CLOSED
+    self._opened_at = 0.0
+    self._probes = 0
+    self._probe_successes = 0
+    self._outcomes: Deque[Tuple[float, bool]] = deque()
+    self._lock = threading.Lock()
+    self._counters = {'rejected': 0, 'opened': 0, 'failures': 0, 'slow_calls': 0}
+
+  @property
+  def state(self) -> str:
+    with self._lock:
+      self._update_state(time.monotonic())
+      return self._state
+
+  @property
+  def stats(self) -> Dict[str, Any]:
+    return {**self._counters, 'state': self.state}
+
+  def _update_state(self, now: float):
+    if self._state == OPEN and now - self._opened_at >= self._open_seconds:
+      self._state = HALF_OPEN
+      self._probes = 0
+      self._probe_successes = 0
+
+  def _open(self, now: float):
+    self._state = OPEN
+    self._opened_at = now
+    self._outcomes.clear()
+    self._counters['opened'] += 1
+
+  def retry_after(self) -> float:
+    """Seconds until the circuit lets probes through."""
+    with self._lock:
+      return max(0.0, self._opened_at + self._open_seconds - time.monotonic())
+
+  def allow(self) -> bool:
+    """Return True if a call may be made now.
+
+    Every allowed call must be followed by `record`.
+    """
+    with self._lock:
+      self._update_state(time.monotonic())
+      if self._state == CLOSED:
+        return True
+      if self._state == HALF_OPEN and self._probes < self._half_open_calls:
+        self._probes += 1
+        return True
+      self._counters['rejected'] += 1
+      return False
+
+  def check(self):
+    """Raise CircuitOpenError unless a call may be made now."""
+    if not self.allow():
+      raise CircuitOpenError(self.name, self.retry_after())
+
+  def record(self, latency: float, error: Optional[BaseException] = None):
+    """Record the outcome of an allowed call.
+
+    Non-transient errors (e.g. invalid requests) say nothing about the
+    health of the dependency and count as successes.
+    """
+    failed = error is not None and is_transient_error(error)
+    if error is None and latency > self._slow_call_seconds:
+      failed = True
+      self._counters['slow_calls'] += 1
+    with self._lock:
+      now = time.monotonic()
+      if failed:
+        self._counters['failures'] += 1
+      if self._state == HALF_OPEN:
+        if failed:
+          self._open(now)
+        else:
+          self._probe_successes += 1
+          if self._probe_successes >= self._half_open_calls:
+            self._state = CLOSED
+        return
+      if self._state == OPEN:
+        return
+      self._outcomes.append((now, failed))
+      while self._outcomes and now - self._outcomes[0][0] > self._window:
+        self._outcomes.popleft()
+      if len(self._outcomes) >= self._min_calls:
+        failures = sum(1 for _, outcome in self._outcomes if outcome)
+        if failures >= self._failure_rate * len(self._outcomes):
+          self._open(now)
+
+
+class CircuitBreakerRegistry:
+  """One circuit breaker per provider/model name, created on first use."""
+
+  def __init__(self, **breaker_kwargs):
+    self._breaker_kwargs = breaker_kwargs
+    self._breakers: Dict[str, CircuitBreaker] = {}
+    self._lock = threading.Lock()
+
+  def get(self, name: str) -> CircuitBreaker:
+    with self._lock:
+      if name not in self._breakers:
+        self._breakers[name] = CircuitBreaker(name, **self._breaker_kwargs)
+      return self._breakers[name]
+
+  @property
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      breakers = list(self._breakers.values())
+    return {breaker.name: breaker.stats for breaker in breakers}
@@ -0,0 +1,40 @@
+from typing import Optional
+
+_HTTP_TOO_MANY_REQUESTS = 429
+_TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+_TRANSIENT_ERROR_NAMES = ('Timeout', 'Connection', 'ServiceUnavailable',
+                          'DeadlineExceeded', 'InternalServerError',
+                          'RateLimit', 'ResourceExhausted')
+
+
+def status_code(error: BaseException) -> Optional[int]:
+  """Return the HTTP status carried by a provider SDK error, if any.
+
+  Google API errors expose it as `code`, OpenAI-style SDKs such as Groq as
+  `status_code`.
+  """
+  for attribute in ('status_code', 'code'):
+    value = getattr(error, attribute, None)
+    try:
+      return int(value)
+    except (TypeError, ValueError):
+      continue
+  return None
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+  """Return True if the error reports an exhausted provider quota."""
+  if status_code(error) == _HTTP_TOO_MANY_REQUESTS:
+    return True
+  name = type(error).__name__
+  return 'RateLimit' in name or 'ResourceExhausted' in name
+
+
+def is_transient_error(error: BaseException) -> bool:
+  """Return True if retrying the call that raised the error may succeed."""
+  if isinstance(error, (TimeoutError, ConnectionError)):
+    return True
+  if status_code(error) in _TRANSIENT_STATUS_CODES:
+    return True
+  name = type(error).__name__
+  return any(part in name for part in _TRANSIENT_ERROR_NAMES)
@@ -0,0 +1,90 @@
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from constants import CHARS_PER_TOKEN
+
+# Key of the length distributions: (genre, level).
+LengthKey = Tuple[Optional[str], Optional[str]]
+
+
+class OutputLengthModel:
+  """Distribution of the output lengths observed per (genre, level).
+
+  The lengths in characters of the last `window` generations of each
+  (genre, level) are kept. Once `min_samples` are known, `sample_length`
+  returns a token budget covering the `quantile` of the observed lengths
+  plus `headroom`, so that most generations finish in a single call that is
+  not much longer than needed.
+  """
+
+  def __init__(self,
+               quantile: float = 0.9,
+               headroom: float = 1.2,
+               min_samples: int = 5,
+               min_tokens: int = 16,
+               window: int = 200):
+    """Initializer.
+
+    Args:
+      quantile: Quantile of the observed lengths the budget must cover.
+      headroom: Factor applied to that quantile.
+      min_samples: Observations of a key before its budget is learned.
+      min_tokens: Lower bound of a learned budget.
+      window: Observations kept per key.
+    """
+    self._quantile = quantile
+    self._headroom = headroom
+    self._min_samples = min_samples
+    self._min_tokens = min_tokens
+    self._window = window
+    self._lengths: Dict[LengthKey, Deque[int]] = {}
+    self._lock = threading.Lock()
+
+  def record(self, genre: Optional[str], level: Optional[str], num_chars: int):
+    """Record the length in characters of a finished generation."""
+    with self._lock:
+      lengths = self._lengths.get((genre, level))
+      if lengths is None:
+        lengths = self._lengths[(genre, level)] = deque(maxlen=self._window)
+      lengths.append(num_chars)
+
+  def _quantile_chars(self, key: LengthKey) -> Optional[int]:
+    with self._lock:
+      lengths = self._lengths.get(key)
+      if lengths is None or len(lengths) < self._min_samples:
+        return None
+      ordered = sorted(lengths)
+    return ordered[min(len(ordered) - 1, int(self._quantile * len(ordered)))]
+
+  def sample_length(self,
+                    genre: Optional[str],
+                    level: Optional[str],
+                    max_paragraph_length: Optional[int] = None
+                    ) -> Optional[int]:
+    """Return the learned token budget of a generation, or None if unknown.
+
+    The budget never exceeds what `max_paragraph_length` characters need.
+    """
+    num_chars = self._quantile_chars((genre, level))
+    if num_chars is None:
+      return None
+    tokens = max(self._min_tokens,
+                 math.ceil(num_chars * self._headroom / CHARS_PER_TOKEN))
+    if max_paragraph_length is not None:
+      tokens = min(tokens, math.ceil(max_paragraph_length / CHARS_PER_TOKEN) + 1)
+    return tokens
+
+  @property
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      keys = list(self._lengths)
+    return {
+        f'{genre or "*"}/{level}': {
+            'samples': len(self._lengths[(genre, level)]),
+            'quantile_chars': self._quantile_chars((genre, level)),
+            'sample_length': self.sample_length(genre, level),
+        }
+        for genre, level in keys
+    }
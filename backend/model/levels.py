@@ -0,0 +1,51 @@
+import contextlib
+import contextvars
+from typing import Iterator, Optional
+
+# Generation levels, as set by the level generators
+TITLE = 'title'
+CHARACTERS = 'characters'
+SCENES = 'scenes'
+PLACE = 'place'
+DIALOG = 'dialog'
+
+_current_level: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'generation_level', default=None)
+
+
+def current_level() -> Optional[str]:
+  """Return the level being generated by the calling code, if any.
+
+  Lets LanguageAPI decorators treat levels differently (hedging, routing
+  affinity) whatever sample length a call asks for.
+  """
+  return _current_level.get()
+
+
+@contextlib.contextmanager
+def generation_level(level: str) -> Iterator[None]:
+  """Mark the model calls made in this context as generating `level`."""
+  token = _current_level.set(level)
+  try:
+    yield
+  finally:
+    _current_level.reset(token)
+
+
+_current_genre: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'generation_genre', default=None)
+
+
+def current_genre() -> Optional[str]:
+  """Return the genre of the story being generated, if any."""
+  return _current_genre.get()
+
+
+@contextlib.contextmanager
+def generation_genre(genre: Optional[str]) -> Iterator[None]:
+  """Mark the generations made in this context as part of a `genre` story."""
+  token = _current_genre.set(genre)
+  try:
+    yield
+  finally:
+    _current_genre.reset(token)
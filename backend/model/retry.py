@@ -0,0 +1,226 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+import time
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, Iterator,
+                    Optional, Tuple, TypeVar)
+
+from model.errors import is_transient_error
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class RetryListener:
+  """Told when a call made in its context backs off before a retry.
+
+  Callers holding a resource for the duration of a call, such as a slot of
+  the model limiter, give it back while the call sleeps, and see the error
+  that caused the retry (a rate limit, for instance) as soon as it occurs.
+  """
+
+  def backing_off(self, error: BaseException):
+    """Called when an attempt failed and the call sleeps before retrying."""
+
+  def resuming(self):
+    """Called from a blocking call before its next attempt."""
+
+  async def resuming_async(self):
+    """Called from an async call before its next attempt."""
+
+
+_listeners: contextvars.ContextVar[Tuple[RetryListener, ...]] = contextvars.ContextVar(
+    'retry_listeners', default=())
+
+
+@contextlib.contextmanager
+def retry_listener(listener: RetryListener) -> Iterator[None]:
+  """Notify `listener` of the retries of the calls made in this context."""
+  token = _listeners.set(_listeners.get() + (listener,))
+  try:
+    yield
+  finally:
+    _listeners.reset(token)
+
+
+def listened_stream(listener: RetryListener, stream: Iterator[T]) -> Iterator[T]:
+  """Iterate `stream`, notifying `listener` of the retries it makes.
+
+  The listener is only in context while the stream computes a chunk, not
+  while the consumer holds it.
+  """
+  try:
+    while True:
+      with retry_listener(listener):
+        try:
+          chunk = next(stream)
+        except StopIteration:
+          return
+      yield chunk
+  finally:
+    close = getattr(stream, 'close', None)
+    if close is not None:
+      close()
+
+
+async def listened_stream_async(listener: RetryListener,
+                                stream: AsyncIterator[T]) -> AsyncIterator[T]:
+  """Async counterpart of `listened_stream`."""
+  try:
+    while True:
+      with retry_listener(listener):
+        try:
+          chunk = await stream.__anext__()
+        except StopAsyncIteration:
+          return
+      yield chunk
+  finally:
+    aclose = getattr(stream, 'aclose', None)
+    if aclose is not None:
+      await aclose()
+
+
+class RetryBudget:
+  """Caps retries to a fraction of recent requests.
+
+  Every request deposits `ratio` tokens and every retry withdraws one, so
+  that during an outage retries add at most `ratio` extra load. A floor of
+  `min_per_second` retries keeps low-traffic clients able to retry.
+  """
+
+  def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0,
+               max_tokens: float = 100.0):
+    self._ratio = ratio
+    self._min_per_second = min_per_second
+    self._max_tokens = max_tokens
+    self._tokens = max_tokens
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def deposit(self):
+    with self._lock:
+      self._tokens = min(self._max_tokens, self._tokens + self._ratio)
+
+  def withdraw(self) -> bool:
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self._max_tokens,
+                         self._tokens + (now - self._updated) * self._min_per_second)
+      self._updated = now
+      if self._tokens < 1.0:
+        return False
+      self._tokens -= 1.0
+      return True
+
+
+class RetryPolicy:
+  """Retry transient errors with capped exponential backoff and full jitter.
+
+  Each attempt gets its own timeout, never exceeding what is left of the
+  overall deadline, so a call is bounded by `deadline` whatever the SDK
+  defaults are. Retries are also limited by a RetryBudget. The
+  RetryListeners in context are told of every backoff, so that a rate
+  limit reaches the model limiter at once and no slot is held while
+  sleeping.
+  """
+
+  def __init__(self,
+               max_retries: int,
+               deadline: float,
+               attempt_timeout: float,
+               base_delay: float = 0.5,
+               max_delay: float = 8.0,
+               budget: Optional[RetryBudget] = None):
+    """Initializer.
+
+    Args:
+      max_retries: Maximum number of retries after the first attempt.
+      deadline: Maximum total time spent on a call, retries included.
+      attempt_timeout: Maximum time for a single attempt.
+      base_delay: Backoff before the first retry (before jitter).
+      max_delay: Cap of the exponential backoff.
+      budget: Retry budget shared by the calls of this policy.
+    """
+    self._max_retries = max_retries
+    self._deadline = deadline
+    self._attempt_timeout = attempt_timeout
+    self._base_delay = base_delay
+    self._max_delay = max_delay
+    self._budget = budget if budget is not None else RetryBudget()
+    self._counters = {'calls': 0, 'retries': 0, 'timeouts': 0,
+                      'failures': 0, 'budget_exhausted': 0}
+
+  @property
+  def stats(self) -> Dict[str, Any]:
+    return dict(self._counters)
+
+  def _backoff(self, retry: int) -> float:
+    return random.uniform(0, min(self._max_delay, self._base_delay * 2 ** retry))
+
+  def _next_delay(self, error: BaseException, retry: int,
+                  end: float) -> Optional[float]:
+    """Return the delay before the next attempt, or None to give up."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+      self._counters['timeouts'] += 1
+    if not is_transient_error(error) or retry >= self._max_retries:
+      return None
+    delay = self._backoff(retry)
+    if time.monotonic() + delay >= end:
+      return None
+    if not self._budget.withdraw():
+      self._counters['budget_exhausted'] += 1
+      return None
+    self._counters['retries'] += 1
+    logger.warning(f'Retrying model call after {type(error).__name__} '
+                   f'(retry {retry + 1}/{self._max_retries}, {delay:.2f}s)')
+    return delay
+
+  def call(self, fn: Callable[[float], T]) -> T:
+    """Call `fn(attempt_timeout)`, retrying transient errors."""
+    self._counters['calls'] += 1
+    self._budget.deposit()
+    end = time.monotonic() + self._deadline
+    retry = 0
+    while True:
+      timeout = max(0.0, min(self._attempt_timeout, end - time.monotonic()))
+      try:
+        return fn(timeout)
+      except Exception as e:
+        delay = self._next_delay(e, retry, end)
+        if delay is None:
+          self._counters['failures'] += 1
+          raise
+        listeners = _listeners.get()
+        for listener in listeners:
+          listener.backing_off(e)
+      time.sleep(delay)
+      for listener in listeners:
+        listener.resuming()
+      retry += 1
+
+  async def call_async(self, fn: Callable[[float], Awaitable[T]]) -> T:
+    """Await `fn(attempt_timeout)`, enforcing the timeout and retrying."""
+    self._counters['calls'] += 1
+    self._budget.deposit()
+    end = time.monotonic() + self._deadline
+    retry = 0
+    while True:
+      timeout = max(0.0, min(self._attempt_timeout, end - time.monotonic()))
+      try:
+        return await asyncio.wait_for(fn(timeout), timeout)
+      except Exception as e:
+        delay = self._next_delay(e, retry, end)
+        if delay is None:
+          self._counters['failures'] += 1
+          raise
+        listeners = _listeners.get()
+        for listener in listeners:
+          listener.backing_off(e)
+      await asyncio.sleep(delay)
+      for listener in listeners:
+        await listener.resuming_async()
+      retry += 1
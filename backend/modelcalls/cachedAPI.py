@@ -0,0 +1,408 @@
+"""Two-tier response cache in front of a LanguageAPI client.
+
+Responses are keyed on the full sampling request and kept in a byte-bounded
+in-memory LRU backed by an SQLite file with TTL and size-based eviction.
+The async paths read the SQLite tier in a worker thread, and its writes are
+applied behind the callers' backs, so the event loop never waits on disk.
+"""
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from model.LanguageAPI import LanguageAPI, LanguageResponse
+from model.LanguageAPIWrapper import LanguageAPIWrapper, sampling_key
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_MEMORY_MB = float(os.getenv("LLM_CACHE_MEMORY_MB", "16"))
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "narrativenest-llm-cache.sqlite3"))
+LLM_CACHE_DISK_MB = float(os.getenv("LLM_CACHE_DISK_MB", "128"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "24"))
+
+
+class MemoryResponseCache:
+    """Thread-safe LRU of response texts bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        """Initialize the in-memory tier.
+
+        Args:
+            max_bytes: Maximum total size of the cached texts
+        """
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(key: str, text: str) -> int:
+        return len(key) + len(text.encode('utf-8'))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def set(self, key: str, text: str):
+        size = self._sizeof(key, text)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= self._sizeof(key, previous)
+            self._entries[key] = text
+            self._size += size
+            while self._size > self._max_bytes:
+                old_key, old_text = self._entries.popitem(last=False)
+                self._size -= self._sizeof(old_key, old_text)
+                self.evictions += 1
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteResponseCache:
+    """On-disk response cache with TTL expiry and least-recently-used eviction.
+
+    Reads are plain SELECTs. Writes and access-time updates are queued and
+    applied by a background writer thread in batches, one commit per batch;
+    expired entries are dropped every `evict_interval` seconds and the
+    least recently used ones whenever a batch takes the cache above its
+    size.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float,
+                 evict_interval: float = 60.0):
+        """Open or create the cache database.
+
+        Args:
+            path: SQLite database file
+            max_bytes: Maximum total size of the cached texts
+            ttl_seconds: Age after which entries are no longer served
+            evict_interval: Seconds between two purges of expired entries
+        """
+        self._max_bytes = max_bytes
+        self._ttl = ttl_seconds
+        self._evict_interval = evict_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at)")
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.evictions = 0
+        self._writes: "queue.Queue[Tuple]" = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="response-cache-writer", daemon=True)
+        self._writer.start()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self._ttl)).fetchone()
+        if row is None:
+            return None
+        self._writes.put(('touch', key, now))
+        return row[0]
+
+    def set(self, key: str, text: str):
+        size = len(key) + len(text.encode('utf-8'))
+        if size > self._max_bytes:
+            return
+        self._writes.put(('set', key, text, size, time.time()))
+
+    def flush(self):
+        """Wait until the queued writes are applied."""
+        self._writes.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    try:
+                        self._apply(batch)
+                    except sqlite3.Error:
+                        self._db.rollback()
+                        self._size = self._db.execute(
+                            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                        raise
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache write failed: {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _apply(self, batch):
+        for write in batch:
+            if write[0] == 'touch':
+                _, key, now = write
+                self._db.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                continue
+            _, key, text, size, now = write
+            previous = self._db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if previous is not None:
+                self._size -= previous[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, now, now))
+            self._size += size
+        self._evict(time.time())
+        self._db.commit()
+
+    def _evict(self, now: float):
+        """Drop expired entries when due, then the least recently used ones above max size."""
+        if now - self._last_purge >= self._evict_interval or self._size > self._max_bytes:
+            self._last_purge = now
+            expired = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses WHERE created_at < ?",
+                (now - self._ttl,)).fetchone()
+            if expired[1]:
+                self._db.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (now - self._ttl,))
+                self._size -= expired[0]
+                self.evictions += expired[1]
+        while self._size > self._max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size <= self._max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+
+class CachedLanguageAPI(LanguageAPIWrapper):
+    """LanguageAPI decorator serving repeated sampling requests from a cache.
+
+    Requests are keyed with `sampling_key`. Lookups try the memory tier, then
+    the disk tier (promoting hits to memory); misses call the wrapped client
+    and store non-empty responses in both tiers. Streams are replayed as one
+    chunk on a hit and only stored when they were consumed to the end.
+    """
+
+    def __init__(
+        self,
+        client: LanguageAPI,
+        memory: MemoryResponseCache,
+        disk: Optional[SQLiteResponseCache] = None
+    ):
+        """Initialize the caching decorator.
+
+        Args:
+            client: The LanguageAPI client to wrap
+            memory: In-memory LRU tier
+            disk: Optional SQLite tier
+        """
+        super().__init__(client)
+        self._memory = memory
+        self._disk = disk
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        lookups = sum(self._counters.values())
+        hits = self._counters['memory_hits'] + self._counters['disk_hits']
+        cache_stats = dict(self._counters)
+        cache_stats.update({
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory.size_bytes,
+            'memory_evictions': self._memory.evictions,
+        })
+        if self._disk is not None:
+            cache_stats['disk_bytes'] = self._disk.size_bytes
+            cache_stats['disk_evictions'] = self._disk.evictions
+        return {**super().stats, 'response_cache': cache_stats}
+
+    def _memory_lookup(self, key: str) -> Optional[str]:
+        text = self._memory.get(key)
+        if text is not None:
+            self._counters['memory_hits'] += 1
+        return text
+
+    def _disk_lookup(self, key: str) -> Optional[str]:
+        text = None
+        if self._disk is not None:
+            try:
+                text = self._disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache read failed: {e}")
+        if text is None:
+            self._counters['misses'] += 1
+            return None
+        self._counters['disk_hits'] += 1
+        self._memory.set(key, text)
+        return text
+
+    def _lookup(self, key: str) -> Optional[str]:
+        text = self._memory_lookup(key)
+        if text is not None:
+            return text
+        return self._disk_lookup(key)
+
+    async def _lookup_async(self, key: str) -> Optional[str]:
+        """Like `_lookup`, reading the disk tier off the event loop."""
+        text = self._memory_lookup(key)
+        if text is not None:
+            return text
+        if self._disk is None:
+            return self._disk_lookup(key)
+        return await asyncio.to_thread(self._disk_lookup, key)
+
+    def _store(self, key: str, text: str):
+        if not text:
+            return
+        self._memory.set(key, text)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, text)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache write failed: {e}")
+
+    @staticmethod
+    def _to_results(prompt: str, text: str):
+        return [LanguageResponse(text=text,
+                                 text_length=len(text),
+                                 prompt=prompt,
+                                 prompt_length=len(prompt))]
+
+    def sample(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample model, serving identical requests from the cache."""
+        key = sampling_key(self, prompt, sample_length, seed, num_samples, stop)
+        text = self._lookup(key)
+        if text is not None:
+            return self._to_results(prompt, text)
+        responses = self._client.sample(
+            prompt=prompt, sample_length=sample_length, seed=seed,
+            num_samples=num_samples, stop=stop)
+        if responses:
+            self._store(key, responses[0].text)
+        return responses
+
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Async sample, serving identical requests from the cache."""
+        key = sampling_key(self, prompt, sample_length, seed, num_samples, stop)
+        text = await self._lookup_async(key)
+        if text is not None:
+            return self._to_results(prompt, text)
+        responses = await self._client.sample_async(
+            prompt=prompt, sample_length=sample_length, seed=seed,
+            num_samples=num_samples, stop=stop)
+        if responses:
+            self._store(key, responses[0].text)
+        return responses
+
+    def sample_stream(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """Stream model response, replaying cached responses as one chunk."""
+        key = sampling_key(self, prompt, sample_length, seed, stop=stop)
+        text = self._lookup(key)
+        if text is not None:
+            yield text
+            return
+        chunks = []
+        for chunk in self._client.sample_stream(
+                prompt=prompt, sample_length=sample_length, seed=seed, stop=stop):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, ''.join(chunks))
+
+    async def sample_stream_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[str]:
+        """Async stream, replaying cached responses as one chunk."""
+        key = sampling_key(self, prompt, sample_length, seed, stop=stop)
+        text = await self._lookup_async(key)
+        if text is not None:
+            yield text
+            return
+        chunks = []
+        async for chunk in self._client.sample_stream_async(
+                prompt=prompt, sample_length=sample_length, seed=seed, stop=stop):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, ''.join(chunks))
+
+
+def cached_client_from_env(client: LanguageAPI) -> LanguageAPI:
+    """Wrap a client in the response cache configured by the LLM_CACHE_* variables."""
+    if not LLM_CACHE:
+        return client
+    memory = MemoryResponseCache(max_bytes=int(LLM_CACHE_MEMORY_MB * 1024 * 1024))
+    disk = None
+    if LLM_CACHE_PATH and LLM_CACHE_DISK_MB > 0:
+        try:
+            disk = SQLiteResponseCache(
+                path=LLM_CACHE_PATH,
+                max_bytes=int(LLM_CACHE_DISK_MB * 1024 * 1024),
+                ttl_seconds=LLM_CACHE_TTL_HOURS * 3600)
+        except sqlite3.Error as e:
+            logger.warning(f"Disk response cache disabled: {e}")
+    return CachedLanguageAPI(client, memory=memory, disk=disk)
@@ -0,0 +1,239 @@
+"""Circuit breakers in front of the model providers.
+
+While the circuit of a provider/model is open, calls fail fast with a
+CircuitOpenError, or are routed to a fallback LanguageAPI if one is
+configured, instead of waiting on a failing upstream. The latency a breaker
+records leaves out the time its provider spent backing off between retries.
+"""
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence
+
+from model.LanguageAPI import LanguageAPI
+from model.LanguageAPIWrapper import LanguageAPIWrapper
+from model.circuit import CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError
+from model.errors import is_transient_error
+from model.retry import RetryListener, listened_stream, listened_stream_async, retry_listener
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker configuration
+CIRCUIT_BREAKER = os.getenv("CIRCUIT_BREAKER", "1") == "1"
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+# Alternate provider used while the primary circuit is open ("groq" or empty)
+CIRCUIT_FALLBACK = os.getenv("CIRCUIT_FALLBACK", "")
+
+# Breakers shared by every caller of a provider/model (text and image)
+circuit_breakers = CircuitBreakerRegistry(
+    failure_rate=CIRCUIT_FAILURE_RATE,
+    slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+    min_calls=CIRCUIT_MIN_CALLS,
+    open_seconds=CIRCUIT_OPEN_SECONDS
+)
+
+
+class _CallClock(RetryListener):
+    """Time of a call, less the time it spent backing off before retries."""
+
+    def __init__(self):
+        self._start = time.monotonic()
+        self._paused = 0.0
+        self._paused_at: Optional[float] = None
+
+    def backing_off(self, error: BaseException):
+        self._paused_at = time.monotonic()
+
+    def resuming(self):
+        if self._paused_at is not None:
+            self._paused += time.monotonic() - self._paused_at
+            self._paused_at = None
+
+    async def resuming_async(self):
+        self.resuming()
+
+    def elapsed(self) -> float:
+        self.resuming()
+        return time.monotonic() - self._start - self._paused
+
+
+class CircuitBreakerAPI(LanguageAPIWrapper):
+    """LanguageAPI decorator guarding the wrapped client with a circuit breaker.
+
+    Calls refused by the breaker, and calls failing with a transient error,
+    go to the fallback client if there is one. Streams only fall back
+    before their first chunk.
+    """
+
+    def __init__(
+        self,
+        client: LanguageAPI,
+        breaker: CircuitBreaker,
+        fallback: Optional[LanguageAPI] = None
+    ):
+        """Initialize the circuit breaker decorator.
+
+        Args:
+            client: The LanguageAPI client to wrap
+            breaker: Circuit breaker of the wrapped provider/model
+            fallback: Client used while the circuit is open
+        """
+        super().__init__(client)
+        self._breaker = breaker
+        self._fallback = fallback
+        self._fallback_calls = 0
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats,
+                'circuit': {**self._breaker.stats, 'fallback_calls': self._fallback_calls}}
+
+    def _fallback_client(self, error: Optional[BaseException] = None) -> LanguageAPI:
+        """Return the client to route a refused or failed call to.
+
+        Raises the error, or CircuitOpenError for a refused call, if there is
+        no fallback or the error is not transient.
+        """
+        if error is not None and not is_transient_error(error):
+            raise error
+        if self._fallback is None:
+            if error is not None:
+                raise error
+            raise CircuitOpenError(self._breaker.name, self._breaker.retry_after())
+        self._fallback_calls += 1
+        logger.warning(f"Routing model call to fallback, circuit {self._breaker.name} "
+                       f"is {self._breaker.state}")
+        return self._fallback
+
+    def sample(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample model, or the fallback while the circuit is open."""
+        kwargs = dict(prompt=prompt, sample_length=sample_length, seed=seed,
+                      num_samples=num_samples, stop=stop)
+        if not self._breaker.allow():
+            return self._fallback_client().sample(**kwargs)
+        clock = _CallClock()
+        try:
+            with retry_listener(clock):
+                result = self._client.sample(**kwargs)
+        except Exception as e:
+            self._breaker.record(clock.elapsed(), e)
+            return self._fallback_client(e).sample(**kwargs)
+        self._breaker.record(clock.elapsed())
+        return result
+
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Async sample, or the fallback while the circuit is open."""
+        kwargs = dict(prompt=prompt, sample_length=sample_length, seed=seed,
+                      num_samples=num_samples, stop=stop)
+        if not self._breaker.allow():
+            return await self._fallback_client().sample_async(**kwargs)
+        clock = _CallClock()
+        try:
+            with retry_listener(clock):
+                result = await self._client.sample_async(**kwargs)
+        except Exception as e:
+            self._breaker.record(clock.elapsed(), e)
+            return await self._fallback_client(e).sample_async(**kwargs)
+        except BaseException:
+            # Cancelled: release a half-open probe without judging the upstream.
+            self._breaker.record(clock.elapsed())
+            raise
+        self._breaker.record(clock.elapsed())
+        return result
+
+    def sample_stream(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """Stream model response, or the fallback's while the circuit is open."""
+        kwargs = dict(prompt=prompt, sample_length=sample_length, seed=seed, stop=stop)
+        if not self._breaker.allow():
+            yield from self._fallback_client().sample_stream(**kwargs)
+            return
+        clock = _CallClock()
+        started = False
+        try:
+            for chunk in listened_stream(clock, self._client.sample_stream(**kwargs)):
+                started = True
+                yield chunk
+        except Exception as e:
+            self._breaker.record(clock.elapsed(), e)
+            if started:
+                raise
+            yield from self._fallback_client(e).sample_stream(**kwargs)
+            return
+        except BaseException:
+            self._breaker.record(clock.elapsed())
+            raise
+        self._breaker.record(clock.elapsed())
+
+    async def sample_stream_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[str]:
+        """Async stream, or the fallback's while the circuit is open."""
+        kwargs = dict(prompt=prompt, sample_length=sample_length, seed=seed, stop=stop)
+        if not self._breaker.allow():
+            async for chunk in self._fallback_client().sample_stream_async(**kwargs):
+                yield chunk
+            return
+        clock = _CallClock()
+        started = False
+        try:
+            async for chunk in listened_stream_async(
+                    clock, self._client.sample_stream_async(**kwargs)):
+                started = True
+                yield chunk
+        except Exception as e:
+            self._breaker.record(clock.elapsed(), e)
+            if started:
+                raise
+            async for chunk in self._fallback_client(e).sample_stream_async(**kwargs):
+                yield chunk
+            return
+        except BaseException:
+            self._breaker.record(clock.elapsed())
+            raise
+        self._breaker.record(clock.elapsed())
+
+
+def _fallback_from_env() -> Optional[LanguageAPI]:
+    """Return the fallback client; it runs within the limiter slot of the call it replaces."""
+    if CIRCUIT_FALLBACK == "groq":
+        if not os.getenv("API_KEY"):
+            logger.warning("CIRCUIT_FALLBACK=groq needs API_KEY, no fallback configured")
+            return None
+        from modelcalls.groqAPI import client as groq_client
+        return groq_client
+    return None
+
+
+def circuit_client_from_env(client: LanguageAPI) -> LanguageAPI:
+    """Wrap a client in a circuit breaker if enabled by the CIRCUIT_* variables."""
+    if not CIRCUIT_BREAKER:
+        return client
+    return CircuitBreakerAPI(
+        client, circuit_breakers.get(client.model), fallback=_fallback_from_env())
@@ -2,16 +2,23 @@
 
 Replaces the Groq API client with Google's Gemini API.
 """
+import asyncio
+import datetime
+import logging
 import os
 import sys
-from typing import Optional
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
 
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import caching
 from dotenv import load_dotenv
 
-from model.LanguageAPI import _MAX_RETRIES, _TIMEOUT, LanguageAPI, LanguageResponse
+from model.LanguageAPI import _ATTEMPT_TIMEOUT, _MAX_RETRIES, _TIMEOUT, LanguageAPI, LanguageResponse
 from constants import (
-    DEFAULT_SEED, MAX_PARAGRAPH_LENGTH, MAX_PARAGRAPH_LENGTH_CHARACTERS,
+    CHARS_PER_TOKEN, DEFAULT_SEED, MAX_PARAGRAPH_LENGTH, MAX_PARAGRAPH_LENGTH_CHARACTERS,
     MAX_PARAGRAPH_LENGTH_SCENES, MAX_RETRIES, SAMPLE_LENGTH, SAMPLING_PROB, SAMPLING_TEMP
 )
 
@@ -31,11 +38,148 @@ GEMINI_SYSTEM_PROMPT = (
     "descriptions and use precise language. Add new original ideas. Finish generation with **END**."
 )
 
+# Provider-side caching of the genre prefixes. Cached content must name an
+# explicit model version, and be at least GEMINI_PREFIX_CACHE_MIN_TOKENS
+# long. Off by default: the shipped genre prefixes are all far below the
+# minimum (about 100 to 1300 tokens), so none of them can be cached.
+GEMINI_PREFIX_CACHE = os.getenv("GEMINI_PREFIX_CACHE", "0") == "1"
+GEMINI_CACHE_MODEL_NAME = os.getenv("GEMINI_CACHE_MODEL_NAME", "models/gemini-2.0-flash-001")
+GEMINI_PREFIX_CACHE_TTL_MINUTES = int(os.getenv("GEMINI_PREFIX_CACHE_TTL_MINUTES", "60"))
+GEMINI_PREFIX_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_PREFIX_CACHE_MIN_TOKENS", "4096"))
+
+logger = logging.getLogger(__name__)
+
 # Configure the Gemini API
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
 
+class _CachedPrefix(NamedTuple):
+    model: genai.GenerativeModel
+    expires_at: float
+
+
+class PrefixCache:
+    """Provider-side cache of the few-shot genre prefixes.
+
+    Each registered (genre, level) prefix is uploaded once as Gemini cached
+    content, together with the system prompt, and prompts starting with it
+    are sent as the remaining suffix only. Entries are recreated when they
+    come within `refresh_margin` of their TTL. Prefixes estimated below
+    `min_tokens` are not registered, and prefixes the API rejects as
+    invalid (such as too small) are never tried again; other failures are
+    retried once one TTL has passed. Calls without a cached prefix send the
+    full prompt.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        system_instruction: Optional[str],
+        generation_config: genai.GenerationConfig,
+        ttl: datetime.timedelta = datetime.timedelta(minutes=60),
+        refresh_margin: datetime.timedelta = datetime.timedelta(minutes=5),
+        min_tokens: int = 0
+    ):
+        """Initialize the prefix cache.
+
+        Args:
+            model_name: Versioned model name the cached content is bound to.
+            system_instruction: System prompt stored with the cached content.
+            generation_config: Default generation config for cached models.
+            ttl: Lifetime of each cached content.
+            refresh_margin: How long before expiry an entry is recreated.
+            min_tokens: Minimum cacheable size of a prefix, in tokens.
+        """
+        self._model_name = model_name
+        self._system_instruction = system_instruction
+        self._generation_config = generation_config
+        self._ttl = ttl
+        self._refresh_margin = refresh_margin.total_seconds()
+        self._min_chars = min_tokens * CHARS_PER_TOKEN
+        # Registered prefix texts, longest first, mapped to (genre, level).
+        self._prefixes: Dict[str, Tuple[str, str]] = {}
+        self._entries: Dict[str, _CachedPrefix] = {}
+        self._failed_until: Dict[str, float] = {}
+        # One lock per prefix, so that creations of different prefixes overlap.
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, genre: str, prefixes: Dict[str, str]):
+        """Register the level prefixes of a genre that are large enough to cache."""
+        with self._lock:
+            registered = dict(self._prefixes)
+            for level, text in prefixes.items():
+                if not text:
+                    continue
+                if len(text) < self._min_chars:
+                    logger.info(f"Prefix {genre}/{level} is below the minimum "
+                                f"cacheable size, not caching it")
+                    continue
+                registered[text] = (genre, level)
+                self._locks.setdefault(text, threading.Lock())
+            # Replaced, not updated, as `split` iterates it without the lock.
+            self._prefixes = dict(sorted(registered.items(), key=lambda item: -len(item[0])))
+
+    def split(self, prompt: str) -> Optional[Tuple[str, str]]:
+        """Return (prefix, suffix) if the prompt starts with a registered prefix."""
+        for prefix in self._prefixes:
+            if prompt.startswith(prefix):
+                return prefix, prompt[len(prefix):]
+        return None
+
+    def lookup(self, prefix: str) -> Optional[genai.GenerativeModel]:
+        """Return the cached model for a prefix if it is fresh, without creating it."""
+        entry = self._entries.get(prefix)
+        if entry is not None and entry.expires_at - time.time() > self._refresh_margin:
+            return entry.model
+        return None
+
+    def needs_refresh(self, prefix: str) -> bool:
+        """Whether `get` would have to create the cached content for a prefix."""
+        if self.lookup(prefix) is not None:
+            return False
+        return self._failed_until.get(prefix, 0.0) <= time.time()
+
+    def get(self, prefix: str) -> Optional[genai.GenerativeModel]:
+        """Return a model bound to the cached prefix, creating it if needed."""
+        model = self.lookup(prefix)
+        if model is not None or not self.needs_refresh(prefix):
+            return model
+        with self._locks[prefix]:
+            model = self.lookup(prefix)
+            if model is not None or not self.needs_refresh(prefix):
+                return model
+            genre, level = self._prefixes[prefix]
+            try:
+                cached_content = caching.CachedContent.create(
+                    model=self._model_name,
+                    display_name=f"narrativenest-{genre}-{level}",
+                    system_instruction=self._system_instruction,
+                    contents=[prefix],
+                    ttl=self._ttl,
+                )
+            except google_exceptions.InvalidArgument as e:
+                # Rejected, e.g. below the minimum size: it will not get better.
+                logger.warning(f"Prefix {genre}/{level} cannot be cached: {e}")
+                self._failed_until[prefix] = float('inf')
+                return None
+            except Exception as e:
+                logger.warning(f"Prefix caching unavailable for {genre}/{level}: {e}")
+                self._failed_until[prefix] = time.time() + self._ttl.total_seconds()
+                return None
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content, generation_config=self._generation_config)
+            self._entries[prefix] = _CachedPrefix(
+                model=model, expires_at=time.time() + self._ttl.total_seconds())
+            logger.info(f"Cached prefix {genre}/{level} as {cached_content.name}")
+            return model
+
+    def invalidate(self, prefix: str):
+        """Drop a cached prefix, e.g. after the provider reports it missing."""
+        self._entries.pop(prefix, None)
+
+
 class GeminiAPI(LanguageAPI):
     """A class wrapping the Google Gemini language model API."""
 
@@ -47,7 +191,9 @@ class GeminiAPI(LanguageAPI):
         config_sampling: Optional[dict] = None,
         seed: Optional[int] = None,
         max_retries: int = _MAX_RETRIES,
-        timeout: float = _TIMEOUT
+        timeout: float = _TIMEOUT,
+        attempt_timeout: float = _ATTEMPT_TIMEOUT,
+        cache_prefixes: bool = False
     ):
         """Initialize the Gemini API client.
 
@@ -58,7 +204,9 @@ class GeminiAPI(LanguageAPI):
             config_sampling: Dict with sampling parameters (temp, prob).
             seed: Random seed for sampling (not directly supported by Gemini).
             max_retries: Maximum number of retries for the API.
-            timeout: Maximum waiting timeout.
+            timeout: Maximum waiting time for a call, retries included.
+            attempt_timeout: Maximum waiting time for a single attempt.
+            cache_prefixes: Cache registered prompt prefixes provider-side.
         """
         super().__init__(
             sample_length=sample_length,
@@ -67,20 +215,33 @@ class GeminiAPI(LanguageAPI):
             config_sampling=config_sampling,
             seed=seed,
             max_retries=max_retries,
-            timeout=timeout
+            timeout=timeout,
+            attempt_timeout=attempt_timeout
+        )
+
+        generation_config = genai.GenerationConfig(
+            max_output_tokens=sample_length,
+            temperature=config_sampling.get('temp', 0.7) if config_sampling else 0.7,
+            top_p=config_sampling.get('prob', 0.9) if config_sampling else 0.9,
         )
 
         # Create the Gemini model with system instruction
         self._client = genai.GenerativeModel(
             model_name=self._model,
             system_instruction=self._model_param,
-            generation_config=genai.GenerationConfig(
-                max_output_tokens=sample_length,
-                temperature=config_sampling.get('temp', 0.7) if config_sampling else 0.7,
-                top_p=config_sampling.get('prob', 0.9) if config_sampling else 0.9,
-            )
+            generation_config=generation_config
         )
 
+        self._prefix_cache = None
+        if cache_prefixes:
+            self._prefix_cache = PrefixCache(
+                model_name=GEMINI_CACHE_MODEL_NAME,
+                system_instruction=self._model_param,
+                generation_config=generation_config,
+                ttl=datetime.timedelta(minutes=GEMINI_PREFIX_CACHE_TTL_MINUTES),
+                min_tokens=GEMINI_PREFIX_CACHE_MIN_TOKENS
+            )
+
     @property
     def client(self):
         """Return the Gemini client."""
@@ -95,12 +256,142 @@ class GeminiAPI(LanguageAPI):
             'max_tokens': self._sample_length
         }
 
+    def _generation_config(
+        self,
+        sample_length: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Return a generation config overriding max tokens or stop sequences.
+
+        Returns None when the model's default configuration applies.
+        """
+        if (sample_length is None or sample_length == self._sample_length) and not stop:
+            return None
+        return genai.GenerationConfig(
+            max_output_tokens=sample_length or self._sample_length,
+            temperature=self._config_sampling.get('temp', 0.7) if self._config_sampling else 0.7,
+            top_p=self._config_sampling.get('prob', 0.9) if self._config_sampling else 0.9,
+            stop_sequences=list(stop) if stop else None,
+        )
+
+    @staticmethod
+    def _response_text(response) -> str:
+        """Extract text from a Gemini response, tolerating blocked candidates."""
+        try:
+            if response.text:
+                return response.text
+        except ValueError:
+            # Handle blocked responses or other issues
+            pass
+        return ''
+
+    @staticmethod
+    def _finished(response) -> bool:
+        """Return True if the model stopped on its own or at a stop sequence."""
+        try:
+            finish_reason = response.candidates[0].finish_reason
+        except (AttributeError, IndexError):
+            return False
+        return getattr(finish_reason, 'name', finish_reason) == 'STOP'
+
+    def _stopped_text(self, response, text: str, stop: Optional[Sequence[str]]) -> str:
+        """Terminate the text of a finished generation with the first stop sequence."""
+        if stop and self._finished(response):
+            return text + stop[0]
+        return text
+
+    @staticmethod
+    def _to_results(prompt: str, response_text: str):
+        """Wrap response text in the LanguageResponse list returned by sample."""
+        return [
+            LanguageResponse(
+                text=response_text,
+                text_length=len(response_text),
+                prompt=prompt,
+                prompt_length=len(prompt)
+            )
+        ]
+
+    def register_prefixes(self, genre: str, prefixes: Dict[str, str]):
+        """Register the genre's level prefixes with the provider-side cache."""
+        if self._prefix_cache is not None:
+            self._prefix_cache.register(genre, prefixes)
+
+    def _split_cached(self, prompt: str) -> Optional[Tuple[str, str]]:
+        """Return (prefix, suffix) when the prompt starts with a registered prefix."""
+        if self._prefix_cache is None:
+            return None
+        split = self._prefix_cache.split(prompt)
+        if split is None or not split[1]:
+            return None
+        return split
+
+    def _generate(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None,
+        stream: bool = False
+    ):
+        """Call generate_content, sending only the suffix after a cached prefix.
+
+        Transient errors are retried by the client's retry policy, with a
+        per-attempt timeout passed to the SDK.
+        """
+        generation_config = self._generation_config(sample_length, stop)
+
+        def call(model, contents):
+            return self._retry_policy.call(lambda timeout: model.generate_content(
+                contents, generation_config=generation_config, stream=stream,
+                request_options={'timeout': timeout}))
+
+        split = self._split_cached(prompt)
+        model = self._prefix_cache.get(split[0]) if split else None
+        if model is not None:
+            try:
+                return call(model, split[1])
+            except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+                # The cached content expired or was evicted upstream.
+                logger.warning(f"Cached prefix unavailable, sending full prompt: {e}")
+                self._prefix_cache.invalidate(split[0])
+        return call(self._client, prompt)
+
+    async def _generate_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None,
+        stream: bool = False
+    ):
+        """Async counterpart of _generate; cache refreshes run off the event loop."""
+        generation_config = self._generation_config(sample_length, stop)
+
+        async def call(model, contents):
+            return await self._retry_policy.call_async(lambda timeout: model.generate_content_async(
+                contents, generation_config=generation_config, stream=stream,
+                request_options={'timeout': timeout}))
+
+        split = self._split_cached(prompt)
+        model = None
+        if split:
+            model = self._prefix_cache.lookup(split[0])
+            if model is None and self._prefix_cache.needs_refresh(split[0]):
+                model = await asyncio.to_thread(self._prefix_cache.get, split[0])
+        if model is not None:
+            try:
+                return await call(model, split[1])
+            except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+                logger.warning(f"Cached prefix unavailable, sending full prompt: {e}")
+                self._prefix_cache.invalidate(split[0])
+        return await call(self._client, prompt)
+
     def sample(
         self,
         prompt: str,
         sample_length: Optional[int] = None,
         seed: Optional[int] = None,
-        num_samples: int = 1
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
     ):
         """Sample model with provided prompt.
 
@@ -109,42 +400,79 @@ class GeminiAPI(LanguageAPI):
             sample_length: Optional override for max tokens.
             seed: Random seed (not directly used by Gemini).
             num_samples: Number of samples (currently only 1 supported).
+            stop: Sequences at which generation stops.
 
         Returns:
             List of LanguageResponse objects.
         """
-        # If sample_length is different, create a new generation config
-        if sample_length is not None and sample_length != self._sample_length:
-            generation_config = genai.GenerationConfig(
-                max_output_tokens=sample_length,
-                temperature=self._config_sampling.get('temp', 0.7) if self._config_sampling else 0.7,
-                top_p=self._config_sampling.get('prob', 0.9) if self._config_sampling else 0.9,
-            )
-            response = self._client.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-        else:
-            response = self._client.generate_content(prompt)
+        response = self._generate(prompt, sample_length, stop)
+        return self._to_results(
+            prompt, self._stopped_text(response, self._response_text(response), stop))
 
-        # Extract text from response
-        response_text = ''
-        try:
-            if response.text:
-                response_text = response.text
-        except ValueError:
-            # Handle blocked responses or other issues
-            response_text = ''
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample model on the SDK's native async path.
 
-        results = [
-            LanguageResponse(
-                text=response_text,
-                text_length=len(response_text),
-                prompt=prompt,
-                prompt_length=len(prompt)
-            )
-        ]
-        return results
+        Awaits `generate_content_async` directly on the running event loop,
+        so concurrent generations cost a coroutine rather than a worker
+        thread each.
+
+        Args:
+            prompt: The text prompt to send to the model.
+            sample_length: Optional override for max tokens.
+            seed: Random seed (not directly used by Gemini).
+            num_samples: Number of samples (currently only 1 supported).
+            stop: Sequences at which generation stops.
+
+        Returns:
+            List of LanguageResponse objects.
+        """
+        response = await self._generate_async(prompt, sample_length, stop)
+        return self._to_results(
+            prompt, self._stopped_text(response, self._response_text(response), stop))
+
+    def sample_stream(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """Stream model response, yielding text chunks as they arrive.
+
+        Closing the generator early stops consuming the upstream stream.
+        """
+        response = self._generate(prompt, sample_length, stop, stream=True)
+        chunk = None
+        for chunk in response:
+            text = self._response_text(chunk)
+            if text:
+                yield text
+        if chunk is not None and stop and self._finished(chunk):
+            yield stop[0]
+
+    async def sample_stream_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[str]:
+        """Asynchronously stream model response on the SDK's async path."""
+        response = await self._generate_async(prompt, sample_length, stop, stream=True)
+        chunk = None
+        async for chunk in response:
+            text = self._response_text(chunk)
+            if text:
+                yield text
+        if chunk is not None and stop and self._finished(chunk):
+            yield stop[0]
 
 
 # Create the config
@@ -170,5 +498,6 @@ client = GeminiAPI(
     seed=DEFAULT_SEED,
     sample_length=config['sample_length'],
     max_retries=config['max_retries'],
-    config_sampling=config['sampling']
+    config_sampling=config['sampling'],
+    cache_prefixes=GEMINI_PREFIX_CACHE and bool(GEMINI_API_KEY)
 )
@@ -1,8 +1,8 @@
 from groq import Groq
 import os
 from dotenv import load_dotenv
-from typing import Dict, List, NamedTuple, Optional, Union, AsyncIterator, Iterator
-from model.LanguageAPI import _MAX_RETRIES, _TIMEOUT, LanguageAPI, LanguageResponse
+from typing import Dict, List, NamedTuple, Optional, Sequence, Union, AsyncIterator, Iterator
+from model.LanguageAPI import _ATTEMPT_TIMEOUT, _MAX_RETRIES, _TIMEOUT, LanguageAPI, LanguageResponse
 from constants import DEFAULT_SEED, MAX_PARAGRAPH_LENGTH, MAX_PARAGRAPH_LENGTH_CHARACTERS, MAX_PARAGRAPH_LENGTH_SCENES, MAX_RETRIES, SAMPLE_LENGTH, SAMPLING_PROB, SAMPLING_TEMP
 import os
 import sys
@@ -37,7 +37,8 @@ class GroqAPI(LanguageAPI):
                config_sampling: Optional[dict] = None,
                seed: Optional[int] = None,
                max_retries: int = _MAX_RETRIES,
-               timeout: float = _TIMEOUT):
+               timeout: float = _TIMEOUT,
+               attempt_timeout: float = _ATTEMPT_TIMEOUT):
     """Initializer.
 
     Args:
@@ -48,7 +49,8 @@ class GroqAPI(LanguageAPI):
       config_sampling: ConfigDict with parameters.
       seed: Random seed for sampling.
       max_retries: Maximum number of retries for the remote API.
-      timeout: Maximum waiting timeout
+      timeout: Maximum waiting time for a call, retries included.
+      attempt_timeout: Maximum waiting time for a single attempt.
     """
     super().__init__(sample_length=sample_length,
                      model=model,
@@ -56,8 +58,10 @@ class GroqAPI(LanguageAPI):
                      config_sampling=config_sampling,
                      seed=seed,
                      max_retries=max_retries,
-                     timeout=timeout)
-    self._client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+                     timeout=timeout,
+                     attempt_timeout=attempt_timeout)
+    # Retries are handled by the client's retry policy, not by the SDK.
+    self._client = Groq(api_key=os.environ.get("GROQ_API_KEY"), max_retries=0)
 
   @property
   def client(self):
@@ -73,23 +77,28 @@ class GroqAPI(LanguageAPI):
              prompt: str,
              sample_length: Optional[int] = None,
              seed: Optional[int] = None,
-             num_samples: int = 1):
+             num_samples: int = 1,
+             stop: Optional[Sequence[str]] = None):
     """Sample model with provided prompt and optional sample_length and seed."""
     if sample_length is None:
       sample_length = self._sample_length
-    response = self._client.chat.completions.create(
-        model=self._model,
-        max_tokens=sample_length,
-        temperature=self._config_sampling['temp'],
-        top_p=self._config_sampling['prob'],
-        messages=[
-          {"role": "system", "content": self._model_param},
-          {"role": "user", "content": prompt}
-        ]
-    )
+    response = self._retry_policy.call(
+        lambda timeout: self._client.chat.completions.create(
+            model=self._model,
+            max_tokens=sample_length,
+            temperature=self._config_sampling['temp'],
+            top_p=self._config_sampling['prob'],
+            messages=[
+              {"role": "system", "content": self._model_param},
+              {"role": "user", "content": prompt}
+            ],
+            stop=list(stop) if stop else None,
+            timeout=timeout))
     response_text = ''
     if len(response.choices) > 0:
-      response_text = response.choices[0].message.content
+      response_text = response.choices[0].message.content or ''
+      if stop and response.choices[0].finish_reason == 'stop':
+        response_text += stop[0]
     results = [LanguageResponse(text=response_text,
                                 text_length=len(response_text),
                                 prompt=prompt,
@@ -99,7 +108,8 @@ class GroqAPI(LanguageAPI):
   def sample_stream(self,
                     prompt: str,
                     sample_length: Optional[int] = None,
-                    seed: Optional[int] = None) -> Iterator[str]:
+                    seed: Optional[int] = None,
+                    stop: Optional[Sequence[str]] = None) -> Iterator[str]:
     """Stream model response with provided prompt.
 
     Yields text chunks as they are generated.
@@ -107,23 +117,29 @@ class GroqAPI(LanguageAPI):
     if sample_length is None:
       sample_length = self._sample_length
 
-    stream = self._client.chat.completions.create(
-        model=self._model,
-        max_tokens=sample_length,
-        temperature=self._config_sampling['temp'],
-        top_p=self._config_sampling['prob'],
-        messages=[
-          {"role": "system", "content": self._model_param},
-          {"role": "user", "content": prompt}
-        ],
-        stream=True
-    )
-
+    stream = self._retry_policy.call(
+        lambda timeout: self._client.chat.completions.create(
+            model=self._model,
+            max_tokens=sample_length,
+            temperature=self._config_sampling['temp'],
+            top_p=self._config_sampling['prob'],
+            messages=[
+              {"role": "system", "content": self._model_param},
+              {"role": "user", "content": prompt}
+            ],
+            stop=list(stop) if stop else None,
+            stream=True,
+            timeout=timeout))
+
+    finish_reason = None
     for chunk in stream:
       if chunk.choices and len(chunk.choices) > 0:
         delta = chunk.choices[0].delta
         if delta and delta.content:
           yield delta.content
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+    if stop and finish_reason == 'stop':
+      yield stop[0]
 
 
 # Create the config.
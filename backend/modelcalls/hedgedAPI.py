@@ -0,0 +1,225 @@
+"""Hedged requests for short generations.
+
+For the generation levels it is configured for, the decorator sends a
+duplicate of a request that has not finished after the observed p95 latency
+of that level, takes whichever response arrives first and cancels the other.
+Hedges are capped to a fraction of the hedgeable requests.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Sequence
+
+from model.LanguageAPI import LanguageAPI
+from model.LanguageAPIWrapper import LanguageAPIWrapper
+from model.levels import PLACE, TITLE, current_level
+
+# Hedging configuration (opt-in)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") == "1"
+LLM_HEDGE_LEVELS = [
+    level.strip() for level in os.getenv("LLM_HEDGE_LEVELS", f"{TITLE},{PLACE}").split(",")
+    if level.strip()
+]
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+
+# Threads running hedged blocking calls (the async path needs none)
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class LatencyWindow:
+    """Rolling window of call latencies with percentile estimates."""
+
+    def __init__(self, size: int = 200):
+        self._latencies: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(quantile * len(ordered)))
+        return ordered[index]
+
+
+class HedgedLanguageAPI(LanguageAPIWrapper):
+    """LanguageAPI decorator hedging slow calls of selected generation levels.
+
+    Streams are never hedged.
+    """
+
+    def __init__(
+        self,
+        client: LanguageAPI,
+        levels: Iterable[str],
+        quantile: float = 0.95,
+        budget_ratio: float = 0.1,
+        min_samples: int = 20,
+        min_delay: float = 0.05
+    ):
+        """Initialize the hedging decorator.
+
+        Args:
+            client: The LanguageAPI client to wrap
+            levels: Generation levels whose calls are hedged
+            quantile: Latency quantile after which a hedge is sent
+            budget_ratio: Maximum hedges per hedgeable request
+            min_samples: Latencies to observe for a level before hedging it
+            min_delay: Lower bound of the hedging delay in seconds
+        """
+        super().__init__(client)
+        self._windows = {level: LatencyWindow() for level in levels}
+        self._quantile = quantile
+        self._budget_ratio = budget_ratio
+        self._min_samples = min_samples
+        self._min_delay = min_delay
+        self._counters = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_denied': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        hedging = dict(self._counters)
+        hedging['delays'] = {level: self._hedge_delay(level) for level in self._windows}
+        return {**super().stats, 'hedging': hedging}
+
+    def _hedge_delay(self, level: Optional[str]) -> Optional[float]:
+        """Return the hedging delay for a level, or None if it is not hedged yet."""
+        window = self._windows.get(level)
+        if window is None or len(window) < max(1, self._min_samples):
+            return None
+        return max(self._min_delay, window.percentile(self._quantile))
+
+    def _allow_hedge(self) -> bool:
+        with self._lock:
+            if self._counters['hedged'] + 1 > self._budget_ratio * self._counters['requests']:
+                self._counters['budget_denied'] += 1
+                return False
+            self._counters['hedged'] += 1
+            return True
+
+    def _timed(self, level: Optional[str], fn: Callable[[], Any]) -> Callable[[], Any]:
+        """Wrap a call so that its latency is recorded for its level.
+
+        The call runs in a copy of the caller's context, so that decorators
+        below still see the level when it runs on a hedging thread.
+        """
+        window = self._windows.get(level)
+        context = contextvars.copy_context()
+
+        def call():
+            start = time.monotonic()
+            result = context.copy().run(fn)
+            if window is not None:
+                window.add(time.monotonic() - start)
+            return result
+        return call
+
+    def sample(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample model, hedging slow calls of the configured levels."""
+        level = current_level()
+        call = self._timed(level, lambda: self._client.sample(
+            prompt=prompt, sample_length=sample_length, seed=seed,
+            num_samples=num_samples, stop=stop))
+        if level not in self._windows:
+            return call()
+        self._counters['requests'] += 1
+        delay = self._hedge_delay(level)
+        if delay is None:
+            return call()
+
+        primary = _hedge_executor.submit(call)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._allow_hedge():
+            return primary.result()
+        hedge = _hedge_executor.submit(call)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # A blocking call cannot be interrupted; its result is dropped.
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        self._counters['hedge_wins'] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Async sample, hedging slow calls and cancelling the losing one."""
+        level = current_level()
+        window = self._windows.get(level)
+
+        async def call():
+            start = time.monotonic()
+            result = await self._client.sample_async(
+                prompt=prompt, sample_length=sample_length, seed=seed,
+                num_samples=num_samples, stop=stop)
+            if window is not None:
+                window.add(time.monotonic() - start)
+            return result
+
+        if window is None:
+            return await call()
+        self._counters['requests'] += 1
+        delay = self._hedge_delay(level)
+        if delay is None:
+            return await call()
+
+        primary = asyncio.ensure_future(call())
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._allow_hedge():
+                return await primary
+            hedge = asyncio.ensure_future(call())
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._counters['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+
+def hedged_client_from_env(client: LanguageAPI) -> LanguageAPI:
+    """Wrap a client in hedging if enabled by the LLM_HEDGE* variables."""
+    if not LLM_HEDGING:
+        return client
+    return HedgedLanguageAPI(
+        client, levels=LLM_HEDGE_LEVELS, budget_ratio=LLM_HEDGE_BUDGET)
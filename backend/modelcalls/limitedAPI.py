@@ -0,0 +1,88 @@
+"""LanguageAPI decorator taking a slot from the global model limiter per call."""
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence
+
+from model.LanguageAPI import LanguageAPI
+from model.LanguageAPIWrapper import LanguageAPIWrapper
+from model.retry import listened_stream, listened_stream_async, retry_listener
+from services.model_limiter import AdaptiveLimiter, estimate_tokens
+
+
+class LimitedLanguageAPI(LanguageAPIWrapper):
+    """Route every call of the wrapped client through an AdaptiveLimiter.
+
+    The slot is held for the whole call, including the consumption of a
+    stream, except while the wrapped client backs off before a retry. The
+    token cost is estimated from the prompt and output budget.
+    """
+
+    def __init__(self, client: LanguageAPI, limiter: AdaptiveLimiter):
+        """Initialize the limiting decorator.
+
+        Args:
+            client: The LanguageAPI client to wrap
+            limiter: Limiter shared by all outbound model calls
+        """
+        super().__init__(client)
+        self._limiter = limiter
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats, 'limiter': self._limiter.stats}
+
+    def _cost(self, prompt: str, sample_length: Optional[int]) -> int:
+        return estimate_tokens(prompt, sample_length or self.default_sample_length)
+
+    def sample(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample model once a limiter slot is granted."""
+        with self._limiter.slot(self._cost(prompt, sample_length)) as slot:
+            with retry_listener(slot):
+                return self._client.sample(
+                    prompt=prompt, sample_length=sample_length, seed=seed,
+                    num_samples=num_samples, stop=stop)
+
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Async sample once a limiter slot is granted."""
+        async with self._limiter.slot_async(self._cost(prompt, sample_length)) as slot:
+            with retry_listener(slot):
+                return await self._client.sample_async(
+                    prompt=prompt, sample_length=sample_length, seed=seed,
+                    num_samples=num_samples, stop=stop)
+
+    def sample_stream(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """Stream model response while holding a limiter slot."""
+        with self._limiter.slot(self._cost(prompt, sample_length)) as slot:
+            yield from listened_stream(slot, self._client.sample_stream(
+                prompt=prompt, sample_length=sample_length, seed=seed, stop=stop))
+
+    async def sample_stream_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[str]:
+        """Async stream while holding a limiter slot."""
+        async with self._limiter.slot_async(self._cost(prompt, sample_length)) as slot:
+            async for chunk in listened_stream_async(slot, self._client.sample_stream_async(
+                    prompt=prompt, sample_length=sample_length, seed=seed, stop=stop)):
+                yield chunk
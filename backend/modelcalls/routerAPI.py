@@ -0,0 +1,311 @@
+"""Latency-aware router over several LanguageAPI backends.
+
+Each call goes to one backend, chosen from an EWMA of its latency per
+output token and of its error rate, scaled by a configured weight. Output
+tokens are estimated from the characters the backend actually returned,
+including those of a stream closed before its end.
+Generation levels may be pinned to preferred backends; the other backends
+are then only used when those fail.
+"""
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from constants import CHARS_PER_TOKEN
+from model.LanguageAPI import LanguageAPI
+from model.circuit import CircuitOpenError
+from model.errors import is_transient_error
+from model.levels import current_level
+
+logger = logging.getLogger(__name__)
+
+# Router configuration, e.g. "gemini:1,groq:0.5" (a single backend disables routing)
+LLM_ROUTER_BACKENDS = os.getenv("LLM_ROUTER_BACKENDS", "gemini")
+# Per-level affinity, e.g. "title=groq;place=groq,gemini"
+LLM_ROUTER_AFFINITY = os.getenv("LLM_ROUTER_AFFINITY", "")
+
+
+class RouteBackend:
+    """A routed client with its weight and EWMA health estimates."""
+
+    def __init__(self, name: str, client: LanguageAPI, weight: float = 1.0):
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+
+    def score(self, error_penalty: float) -> float:
+        """Expected cost of a call, lower is better (0 until first called).
+
+        The latency is inflated by the odds of an error, each of which costs
+        a second call on another backend.
+        """
+        if self.latency is None:
+            return 0.0 if self.calls == 0 else math.inf
+        odds = self.error_rate / (1.0 - self.error_rate + 0.01)
+        return self.latency * (1.0 + error_penalty * odds) / self.weight
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {'weight': self.weight, 'calls': self.calls,
+                'latency_per_token': self.latency, 'error_rate': self.error_rate}
+
+
+class RouterLanguageAPI(LanguageAPI):
+    """LanguageAPI routing each call to one of several backends.
+
+    `sample` spreads load by picking a backend at random with a probability
+    inversely proportional to its score; streams, which are interactive,
+    go to the best scoring backend. A call failing with a transient error
+    (or refused by an open circuit) is retried on the next backend; a
+    stream only before its first chunk.
+    """
+
+    def __init__(
+        self,
+        backends: List[RouteBackend],
+        affinity: Optional[Dict[str, List[str]]] = None,
+        alpha: float = 0.2,
+        error_penalty: float = 4.0,
+        explore: float = 0.05
+    ):
+        """Initialize the router.
+
+        Args:
+            backends: Routed backends, the first one providing the defaults
+            affinity: Preferred backend names per generation level
+            alpha: Smoothing factor of the EWMA estimates
+            error_penalty: Score multiplier per unit of error odds
+            explore: Share of non-interactive calls routed in random order, so
+                that the estimates of unhealthy backends recover
+        """
+        primary = backends[0].client
+        super().__init__(
+            sample_length=primary.default_sample_length,
+            model='+'.join(backend.client.model for backend in backends),
+            model_param=primary.model_param,
+            config_sampling=primary.config_sampling,
+            seed=primary.seed)
+        self._backends = backends
+        self._affinity = affinity or {}
+        self._alpha = alpha
+        self._error_penalty = error_penalty
+        self._explore = explore
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'router': {backend.name: backend.stats for backend in self._backends},
+            'backends': {backend.name: backend.client.stats for backend in self._backends},
+        }
+
+    def register_prefixes(self, genre: str, prefixes: Dict[str, str]):
+        for backend in self._backends:
+            backend.client.register_prefixes(genre, prefixes)
+
+    def _candidates(self, interactive: bool) -> List[RouteBackend]:
+        """Return the backends to try for a call of the current level, in order."""
+        preferred_names = self._affinity.get(current_level(), [])
+        preferred = [b for b in self._backends if b.name in preferred_names]
+        others = [b for b in self._backends if b.name not in preferred_names]
+        with self._lock:
+            return self._order(preferred, interactive) + self._order(others, interactive)
+
+    def _order(self, backends: List[RouteBackend], interactive: bool) -> List[RouteBackend]:
+        ordered = sorted(backends, key=lambda b: b.score(self._error_penalty))
+        if interactive or len(ordered) < 2 or ordered[0].score(self._error_penalty) == 0.0:
+            return ordered
+        if random.random() < self._explore:
+            random.shuffle(ordered)
+            return ordered
+        # Weighted random draw without replacement, favouring low scores.
+        remaining = list(ordered)
+        result = []
+        while remaining:
+            weights = [1.0 / b.score(self._error_penalty) for b in remaining]
+            if not any(weights):
+                result.extend(remaining)
+                break
+            choice = random.choices(remaining, weights=weights)[0]
+            remaining.remove(choice)
+            result.append(choice)
+        return result
+
+    def _record(self, backend: RouteBackend, latency: float, num_chars: int,
+                error: Optional[BaseException] = None):
+        """Update the estimates of `backend` with a call that returned `num_chars`."""
+        with self._lock:
+            backend.calls += 1
+            failed = 1.0 if error is not None else 0.0
+            backend.error_rate += self._alpha * (failed - backend.error_rate)
+            if error is None:
+                num_tokens = max(1, math.ceil(num_chars / CHARS_PER_TOKEN))
+                per_token = latency / num_tokens
+                backend.latency = per_token if backend.latency is None else (
+                    backend.latency + self._alpha * (per_token - backend.latency))
+
+    @staticmethod
+    def _num_chars(responses) -> int:
+        # Samples are generated in parallel, so the longest one sets the latency.
+        return max((len(response.text) for response in responses or []), default=0)
+
+    @staticmethod
+    def _can_reroute(error: BaseException) -> bool:
+        return isinstance(error, CircuitOpenError) or is_transient_error(error)
+
+    def sample(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample the backend chosen for this call."""
+        candidates = self._candidates(interactive=False)
+        for i, backend in enumerate(candidates):
+            start = time.monotonic()
+            try:
+                result = backend.client.sample(
+                    prompt=prompt, sample_length=sample_length, seed=seed,
+                    num_samples=num_samples, stop=stop)
+            except Exception as e:
+                self._record(backend, time.monotonic() - start, 0, e)
+                if i == len(candidates) - 1 or not self._can_reroute(e):
+                    raise
+                logger.warning(f"Rerouting model call from {backend.name}: {type(e).__name__}")
+                continue
+            self._record(backend, time.monotonic() - start, self._num_chars(result))
+            return result
+
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Async sample of the backend chosen for this call."""
+        candidates = self._candidates(interactive=False)
+        for i, backend in enumerate(candidates):
+            start = time.monotonic()
+            try:
+                result = await backend.client.sample_async(
+                    prompt=prompt, sample_length=sample_length, seed=seed,
+                    num_samples=num_samples, stop=stop)
+            except Exception as e:
+                self._record(backend, time.monotonic() - start, 0, e)
+                if i == len(candidates) - 1 or not self._can_reroute(e):
+                    raise
+                logger.warning(f"Rerouting model call from {backend.name}: {type(e).__name__}")
+                continue
+            self._record(backend, time.monotonic() - start, self._num_chars(result))
+            return result
+
+    def sample_stream(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """Stream from the best scoring backend."""
+        candidates = self._candidates(interactive=True)
+        for i, backend in enumerate(candidates):
+            start = time.monotonic()
+            started = completed = False
+            num_chars = 0
+            error = None
+            try:
+                for chunk in backend.client.sample_stream(
+                        prompt=prompt, sample_length=sample_length, seed=seed, stop=stop):
+                    started = True
+                    num_chars += len(chunk)
+                    yield chunk
+                completed = True
+            except Exception as e:
+                error = e
+                if started or i == len(candidates) - 1 or not self._can_reroute(e):
+                    raise
+                logger.warning(f"Rerouting model stream from {backend.name}: {type(e).__name__}")
+                continue
+            finally:
+                # Also reached when the consumer closes the stream early; one
+                # closed before its first chunk says nothing of the backend.
+                if started or completed or error is not None:
+                    self._record(backend, time.monotonic() - start, num_chars, error)
+            return
+
+    async def sample_stream_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        stop: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[str]:
+        """Async stream from the best scoring backend."""
+        candidates = self._candidates(interactive=True)
+        for i, backend in enumerate(candidates):
+            start = time.monotonic()
+            started = completed = False
+            num_chars = 0
+            error = None
+            try:
+                async for chunk in backend.client.sample_stream_async(
+                        prompt=prompt, sample_length=sample_length, seed=seed, stop=stop):
+                    started = True
+                    num_chars += len(chunk)
+                    yield chunk
+                completed = True
+            except Exception as e:
+                error = e
+                if started or i == len(candidates) - 1 or not self._can_reroute(e):
+                    raise
+                logger.warning(f"Rerouting model stream from {backend.name}: {type(e).__name__}")
+                continue
+            finally:
+                # Also reached when the consumer closes the stream early; one
+                # closed before its first chunk says nothing of the backend.
+                if started or completed or error is not None:
+                    self._record(backend, time.monotonic() - start, num_chars, error)
+            return
+
+
+def provider_client(name: str) -> LanguageAPI:
+    """Return the module-level client of a provider, importing it on demand."""
+    if name == "gemini":
+        from modelcalls.geminiAPI import client
+        return client
+    if name == "groq":
+        from modelcalls.groqAPI import client
+        return client
+    raise ValueError(f"Unknown model provider: {name}")
+
+
+def parse_backends(spec: str) -> Dict[str, float]:
+    """Parse "name:weight,..." into weights by provider name."""
+    weights = {}
+    for entry in spec.split(","):
+        if entry.strip():
+            name, _, weight = entry.strip().partition(":")
+            weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+def parse_affinity(spec: str) -> Dict[str, List[str]]:
+    """Parse "level=name,name;..." into preferred provider names per level."""
+    affinity = {}
+    for entry in spec.split(";"):
+        if entry.strip():
+            level, _, names = entry.strip().partition("=")
+            affinity[level.strip()] = [
+                name.strip() for name in names.split(",") if name.strip()]
+    return affinity
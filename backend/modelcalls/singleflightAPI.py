@@ -0,0 +1,126 @@
+"""Single-flight coalescing of identical in-flight sampling requests.
+
+Concurrent calls with the same sampling key share one upstream call and all
+receive its result.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Sequence
+
+from model.LanguageAPI import LanguageAPI
+from model.LanguageAPIWrapper import LanguageAPIWrapper, sampling_key
+
+# Single-flight configuration
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "1") == "1"
+
+
+class _AsyncFlight:
+    """An upstream call shared by the coroutines awaiting it."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlightLanguageAPI(LanguageAPIWrapper):
+    """LanguageAPI decorator coalescing identical concurrent `sample` calls.
+
+    Blocking and async callers are coalesced separately. An async upstream
+    call is cancelled only once every caller waiting on it has been
+    cancelled. Streams are passed through.
+    """
+
+    def __init__(self, client: LanguageAPI):
+        """Initialize the single-flight decorator.
+
+        Args:
+            client: The LanguageAPI client to wrap
+        """
+        super().__init__(client)
+        self._flights: Dict[str, Future] = {}
+        self._async_flights: Dict[str, _AsyncFlight] = {}
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'coalesced': 0}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats, 'single_flight': {
+            **self._counters,
+            'in_flight': len(self._flights) + len(self._async_flights),
+        }}
+
+    def sample(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Sample model, sharing the result of an identical call in flight."""
+        key = sampling_key(self, prompt, sample_length, seed, num_samples, stop)
+        with self._lock:
+            self._counters['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+            else:
+                self._counters['coalesced'] += 1
+        if not leader:
+            return flight.result()
+        try:
+            result = self._client.sample(
+                prompt=prompt, sample_length=sample_length, seed=seed,
+                num_samples=num_samples, stop=stop)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            with self._lock:
+                del self._flights[key]
+        return result
+
+    async def sample_async(
+        self,
+        prompt: str,
+        sample_length: Optional[int] = None,
+        seed: Optional[int] = None,
+        num_samples: int = 1,
+        stop: Optional[Sequence[str]] = None
+    ):
+        """Async sample, sharing the result of an identical call in flight."""
+        key = sampling_key(self, prompt, sample_length, seed, num_samples, stop)
+        self._counters['calls'] += 1
+        flight = self._async_flights.get(key)
+        if flight is None:
+            flight = self._async_flights[key] = _AsyncFlight(asyncio.ensure_future(
+                self._client.sample_async(
+                    prompt=prompt, sample_length=sample_length, seed=seed,
+                    num_samples=num_samples, stop=stop)))
+            flight.task.add_done_callback(
+                lambda _, key=key, flight=flight: self._end_async_flight(key, flight))
+        else:
+            self._counters['coalesced'] += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _end_async_flight(self, key: str, flight: _AsyncFlight):
+        if self._async_flights.get(key) is flight:
+            del self._async_flights[key]
+
+
+def single_flight_client_from_env(client: LanguageAPI) -> LanguageAPI:
+    """Wrap a client in single-flight coalescing if enabled by LLM_SINGLE_FLIGHT."""
+    if not LLM_SINGLE_FLIGHT:
+        return client
+    return SingleFlightLanguageAPI(client)
@@ -0,0 +1,51 @@
+"""Assembly of the LanguageAPI client stack used by the API."""
+from typing import Optional
+
+from model.LanguageAPI import LanguageAPI
+from modelcalls.cachedAPI import cached_client_from_env
+from modelcalls.circuitAPI import circuit_client_from_env
+from modelcalls.hedgedAPI import hedged_client_from_env
+from modelcalls.limitedAPI import LimitedLanguageAPI
+from modelcalls.routerAPI import (
+    LLM_ROUTER_AFFINITY, LLM_ROUTER_BACKENDS, RouteBackend, RouterLanguageAPI,
+    parse_affinity, parse_backends, provider_client)
+from modelcalls.singleflightAPI import single_flight_client_from_env
+from services.model_limiter import model_limiter
+
+
+def build_backend(base: LanguageAPI) -> LanguageAPI:
+    """Wrap one provider client in its circuit breaker and the global limiter.
+
+    The breaker sits directly around the provider, so that waiting for a
+    limiter slot is not mistaken for upstream latency, and its fallback
+    client is called within the limiter slot of the call it replaces.
+    """
+    client = circuit_client_from_env(base)
+    return LimitedLanguageAPI(client, model_limiter)
+
+
+def build_client(base: Optional[LanguageAPI] = None) -> LanguageAPI:
+    """Wrap the provider clients in the decorators configured by environment.
+
+    Args:
+        base: The provider client (e.g. GeminiAPI); by default the providers
+            listed in LLM_ROUTER_BACKENDS, routed if there are several
+
+    Returns:
+        The client stack, outermost decorator first
+    """
+    if base is not None:
+        client = build_backend(base)
+    else:
+        backends = [
+            RouteBackend(name, build_backend(provider_client(name)), weight)
+            for name, weight in parse_backends(LLM_ROUTER_BACKENDS).items()
+        ]
+        if len(backends) == 1:
+            client = backends[0].client
+        else:
+            client = RouterLanguageAPI(backends, affinity=parse_affinity(LLM_ROUTER_AFFINITY))
+    client = hedged_client_from_env(client)
+    client = single_flight_client_from_env(client)
+    client = cached_client_from_env(client)
+    return client
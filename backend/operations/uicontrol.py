@@ -9,6 +9,7 @@ class GenerationHistory:
 
   NEW, CONTINUE or REWRITE. Consecutive REWRITE edits do not add to history.
   """
+  __slots__ = ('_items', '_actions', '_idx', '_locked')
 
   def __init__(self):
     self._items = []
@@ -41,4 +42,15 @@ class GenerationHistory:
     if len(self._items) == 0:
       return None
     self._idx = min(self._idx + 1, len(self._items) - 1)
-    return self._items[self._idx]
\ No newline at end of file
+    return self._items[self._idx]
+
+  def to_state(self):
+    """Return the history as plain lists, for serialization."""
+    return [self._items, self._actions, self._idx]
+
+  @classmethod
+  def from_state(cls, state):
+    """Return the history serialized by to_state."""
+    history = cls()
+    history._items, history._actions, history._idx = state
+    return history
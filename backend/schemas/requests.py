@@ -15,6 +15,7 @@ class GenerateStoryRequest(BaseModel):
     """Request model for story initialization."""
     logline: str = Field(..., min_length=10, max_length=2000, description="Story logline/premise")
     genre_prefix: GenrePrefix = Field(..., description="Story genre template")
+    prefetch: bool = Field(default=False, description="Generate the likely next step in the background")
 
 
 class GenerateTitleRequest(BaseModel):
@@ -22,6 +23,11 @@ class GenerateTitleRequest(BaseModel):
     seed: int = Field(default=1, ge=1, description="Random seed for generation")
 
 
+class GenerateFullStoryRequest(BaseModel):
+    """Request model for generating the whole story at once."""
+    seed: int = Field(default=1, ge=1, description="Random seed for generation")
+
+
 class RewriteTitleRequest(BaseModel):
     """Request model for title rewriting."""
     text: str = Field(..., min_length=1, description="Title text to rewrite")
@@ -2,12 +2,16 @@
 import asyncio
 import base64
 import os
-from concurrent.futures import ThreadPoolExecutor
+import time
 from typing import List, Optional
 
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+from model.circuit import OPEN
+from modelcalls.circuitAPI import circuit_breakers
+from services.model_limiter import model_limiter
+
 load_dotenv()
 
 # Configure Gemini
@@ -15,8 +19,12 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
-# Thread pool for running sync Gemini calls
-_image_executor = ThreadPoolExecutor(max_workers=5)
+IMAGEN_MODEL_NAME = "imagen-3.0-generate-002"
+DESCRIPTION_MODEL_NAME = "gemini-2.0-flash"
+
+# The description fallback shares its breaker with text generation on the same model.
+imagen_breaker = circuit_breakers.get(IMAGEN_MODEL_NAME)
+description_breaker = circuit_breakers.get(DESCRIPTION_MODEL_NAME)
 
 
 async def generate_single_image(prompt: str) -> Optional[str]:
@@ -31,44 +39,60 @@ async def generate_single_image(prompt: str) -> Optional[str]:
     loop = asyncio.get_event_loop()
 
     def _run_imagen():
+        if imagen_breaker.allow():
+            start = time.monotonic()
+            try:
+                # Use Gemini's imagen model for image generation
+                imagen_model = genai.ImageGenerationModel(IMAGEN_MODEL_NAME)
+
+                result = imagen_model.generate_images(
+                    prompt=prompt,
+                    number_of_images=1,
+                    aspect_ratio="16:9",  # Cinematic aspect ratio
+                    safety_filter_level="block_only_high",
+                    person_generation="allow_adult",
+                )
+                imagen_breaker.record(time.monotonic() - start)
+
+                if result.images:
+                    # Return as base64 data URL
+                    image_bytes = result.images[0]._pil_image
+                    import io
+                    buffer = io.BytesIO()
+                    image_bytes.save(buffer, format='PNG')
+                    b64_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                    return f"data:image/png;base64,{b64_data}"
+                return None
+
+            except Exception as e:
+                imagen_breaker.record(time.monotonic() - start, e)
+                print(f"Imagen generation error: {e}")
+
+        # Fallback: Try using Gemini's multimodal model to describe what the image would look like
+        # This is a graceful degradation if Imagen is not available
+        if not description_breaker.allow():
+            return None
+        start = time.monotonic()
         try:
-            # Use Gemini's imagen model for image generation
-            imagen_model = genai.ImageGenerationModel("imagen-3.0-generate-002")
-
-            result = imagen_model.generate_images(
-                prompt=prompt,
-                number_of_images=1,
-                aspect_ratio="16:9",  # Cinematic aspect ratio
-                safety_filter_level="block_only_high",
-                person_generation="allow_adult",
+            model = genai.GenerativeModel(DESCRIPTION_MODEL_NAME)
+            response = model.generate_content(
+                f"Create a detailed visual description for this image prompt: {prompt}"
             )
-
-            if result.images:
-                # Return as base64 data URL
-                image_bytes = result.images[0]._pil_image
-                import io
-                buffer = io.BytesIO()
-                image_bytes.save(buffer, format='PNG')
-                b64_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                return f"data:image/png;base64,{b64_data}"
+            description_breaker.record(time.monotonic() - start)
+            # Return a placeholder indicating text description
+            return f"text-description:{response.text[:500]}"
+        except Exception as fallback_error:
+            description_breaker.record(time.monotonic() - start, fallback_error)
+            print(f"Fallback also failed: {fallback_error}")
             return None
 
-        except Exception as e:
-            print(f"Imagen generation error: {e}")
-            # Fallback: Try using Gemini's multimodal model to describe what the image would look like
-            # This is a graceful degradation if Imagen is not available
-            try:
-                model = genai.GenerativeModel("gemini-2.0-flash")
-                response = model.generate_content(
-                    f"Create a detailed visual description for this image prompt: {prompt}"
-                )
-                # Return a placeholder indicating text description
-                return f"text-description:{response.text[:500]}"
-            except Exception as fallback_error:
-                print(f"Fallback also failed: {fallback_error}")
-                return None
+    # Fail fast without taking a slot when both models are known to be down.
+    if imagen_breaker.state == OPEN and description_breaker.state == OPEN:
+        return None
 
-    return await loop.run_in_executor(_image_executor, _run_imagen)
+    # Image calls share the global model limiter with text generation.
+    async with model_limiter.slot_async():
+        return await loop.run_in_executor(None, _run_imagen)
 
 
 async def generate_images_parallel(prompts: List[str]) -> List[str]:
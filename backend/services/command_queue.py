@@ -0,0 +1,103 @@
+"""Per-session queue of commands, such as "generate the characters".
+
+The commands of a session run one at a time, holding the session lock.
+Submitting a command identical to one queued or running attaches to it
+instead of running it twice, as when a button is double-clicked. A command
+submitted for a slot, such as the title or the dialog of a scene, cancels
+the command queued or running for that slot: cancelling its task cancels
+the model calls it awaits. Callers of the cancelled command receive the
+result of the newer one. A command is also cancelled once none of its
+callers awaits it anymore.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+_counters = {'submitted': 0, 'coalesced': 0, 'superseded': 0}
+
+
+def command_stats() -> Dict[str, Any]:
+    """Return process-wide command counters."""
+    return dict(_counters)
+
+
+class _Command:
+    """A submitted command, and the command that superseded it, if any."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.superseded_by: Optional['_Command'] = None
+        self.waiters = 0
+
+
+class SessionCommandQueue:
+    """Runs the commands of one session one at a time, in submission order."""
+
+    def __init__(self, lock: asyncio.Lock):
+        """Initialize the queue.
+
+        Args:
+            lock: The session lock, also held by other session mutations
+        """
+        self._lock = lock
+        self._commands: Dict[Hashable, _Command] = {}
+        self._slots: Dict[Hashable, _Command] = {}
+
+    async def _run(self, key: Hashable, slot: Optional[Hashable],
+                   run: Callable[[], Awaitable[Any]]):
+        try:
+            async with self._lock:
+                return await run()
+        finally:
+            task = asyncio.current_task()
+            if key in self._commands and self._commands[key].task is task:
+                del self._commands[key]
+            if slot in self._slots and self._slots[slot].task is task:
+                del self._slots[slot]
+
+    async def submit(
+        self,
+        key: Hashable,
+        run: Callable[[], Awaitable[Any]],
+        slot: Optional[Hashable] = None
+    ) -> Any:
+        """Run `run()` after the commands before it, and return its result.
+
+        Args:
+            key: Identifies the command; a command with the same key queued
+                or running is awaited instead of running `run`
+            run: Coroutine function performing the command
+            slot: What the command regenerates; the command queued or
+                running for the same slot is cancelled
+
+        Returns:
+            The result of the command, or of the command superseding it
+        """
+        _counters['submitted'] += 1
+        command = self._commands.get(key)
+        if command is not None:
+            _counters['coalesced'] += 1
+        else:
+            older = self._slots.get(slot) if slot is not None else None
+            command = _Command(asyncio.ensure_future(self._run(key, slot, run)))
+            self._commands[key] = command
+            if slot is not None:
+                self._slots[slot] = command
+            if older is not None and not older.task.done():
+                _counters['superseded'] += 1
+                older.superseded_by = command
+                older.task.cancel()
+        while True:
+            current = command
+            current.waiters += 1
+            try:
+                # A caller going away does not cancel the command of others.
+                return await asyncio.shield(current.task)
+            except asyncio.CancelledError:
+                if not current.task.cancelled() or current.superseded_by is None:
+                    raise
+                command = current.superseded_by
+            finally:
+                current.waiters -= 1
+                if current.waiters == 0 and not current.task.done():
+                    # Nobody awaits the result anymore: its clients went away.
+                    current.task.cancel()
@@ -0,0 +1,238 @@
+"""Key-value stores with per-key expiry, used to share sessions across processes.
+
+`RedisKeyValueStore` is the networked store for deployments running several
+workers or machines. `SQLiteKeyValueStore` is its local stand-in: it shares
+sessions between the workers of one machine through a database file, and
+needs no server for development.
+
+Every value is stored with a version, an opaque token replaced on each
+write. Writes are compare-and-set on the version read, so that a process
+writing back a value another process changed in the meantime fails
+instead of overwriting the change.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _new_version() -> str:
+    return uuid.uuid4().hex
+
+
+class KeyValueStore:
+    """Interface of the key-value stores: versioned bytes values that expire."""
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """Return the value of `key` and its version, or None if missing or expired."""
+        raise NotImplementedError
+
+    async def compare_and_set(
+        self,
+        key: str,
+        value: bytes,
+        ttl_seconds: float,
+        version: Optional[str]
+    ) -> Optional[str]:
+        """Set the value of `key` if its version is still `version`.
+
+        Args:
+            key: The key
+            value: The new value
+            ttl_seconds: Seconds from now after which the value expires
+            version: Version read before, or None if `key` must not exist
+
+        Returns:
+            The new version, or None if the stored version differs
+        """
+        raise NotImplementedError
+
+    async def touch(self, key: str, ttl_seconds: float):
+        """Postpone the expiry of `key` to `ttl_seconds` from now."""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        """Delete `key`, returning whether it existed."""
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        """Return the number of keys that have not expired."""
+        raise NotImplementedError
+
+    async def purge_expired(self) -> int:
+        """Drop the expired keys the store does not drop by itself."""
+        return 0
+
+
+class SQLiteKeyValueStore(KeyValueStore):
+    """Key-value store in an SQLite file, shared by the processes of a machine."""
+
+    def __init__(self, path: str):
+        """Open or create the database.
+
+        Args:
+            path: SQLite database file
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL,"
+            " version TEXT NOT NULL DEFAULT '')")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(kv)")]
+        if "version" not in columns:
+            self._db.execute("ALTER TABLE kv ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+        self._db.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at)")
+        self._db.commit()
+
+    def _execute(self, sql: str, parameters=(), commit: bool = False):
+        with self._lock:
+            cursor = self._db.execute(sql, parameters)
+            rows = cursor.fetchall()
+            if commit:
+                self._db.commit()
+            return rows, cursor.rowcount
+
+    async def _run(self, sql: str, parameters=(), commit: bool = False):
+        return await asyncio.to_thread(self._execute, sql, parameters, commit)
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        rows, _ = await self._run(
+            "SELECT value, version FROM kv WHERE key = ? AND expires_at > ?",
+            (key, time.time()))
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    async def compare_and_set(
+        self,
+        key: str,
+        value: bytes,
+        ttl_seconds: float,
+        version: Optional[str]
+    ) -> Optional[str]:
+        new_version = _new_version()
+        now = time.time()
+        if version is None:
+            # An expired row that was not purged yet counts as missing.
+            _, changed = await self._run(
+                "INSERT INTO kv (key, value, expires_at, version) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET value = excluded.value,"
+                " expires_at = excluded.expires_at, version = excluded.version"
+                " WHERE kv.expires_at <= ?",
+                (key, value, now + ttl_seconds, new_version, now), commit=True)
+        else:
+            _, changed = await self._run(
+                "UPDATE kv SET value = ?, expires_at = ?, version = ?"
+                " WHERE key = ? AND version = ?",
+                (value, now + ttl_seconds, new_version, key, version), commit=True)
+        return new_version if changed > 0 else None
+
+    async def touch(self, key: str, ttl_seconds: float):
+        await self._run(
+            "UPDATE kv SET expires_at = ? WHERE key = ?",
+            (time.time() + ttl_seconds, key), commit=True)
+
+    async def delete(self, key: str) -> bool:
+        _, deleted = await self._run("DELETE FROM kv WHERE key = ?", (key,), commit=True)
+        return deleted > 0
+
+    async def count(self) -> int:
+        rows, _ = await self._run(
+            "SELECT COUNT(*) FROM kv WHERE expires_at > ?", (time.time(),))
+        return rows[0][0]
+
+    async def purge_expired(self) -> int:
+        _, deleted = await self._run(
+            "DELETE FROM kv WHERE expires_at <= ?", (time.time(),), commit=True)
+        return deleted
+
+
+# Sets the value and version of a hash if its version is ARGV[1] ('' if the
+# key must not exist), records its expiry in the sorted set KEYS[2], and
+# returns 1, else 0.
+_REDIS_COMPARE_AND_SET = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if ARGV[1] == '' then
+  if current then return 0 end
+elseif current ~= ARGV[1] then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'value', ARGV[2], 'version', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[5], KEYS[1])
+return 1
+"""
+
+
+class RedisKeyValueStore(KeyValueStore):
+    """Key-value store on a Redis server, shared by every worker and machine.
+
+    Each key is a hash of its value and version, compared and set by a Lua
+    script. Redis expires keys by itself. Keys are namespaced by `prefix`,
+    so that the server can be shared with other data. Their expiry times are
+    also kept in a sorted set, so that `count` costs a trim of the expired
+    entries instead of a scan of every key.
+    """
+
+    def __init__(self, url: str, prefix: str = "session:"):
+        """Connect to the server.
+
+        Args:
+            url: Redis URL, such as redis://localhost:6379/0
+            prefix: Prefix of the keys
+        """
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("The redis session backend requires the redis package") from e
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+        self._expiries = prefix + "~expiries"
+        self._compare_and_set = self._redis.register_script(_REDIS_COMPARE_AND_SET)
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        value, version = await self._redis.hmget(self._prefix + key, "value", "version")
+        if value is None or version is None:
+            return None
+        return value, version.decode()
+
+    async def compare_and_set(
+        self,
+        key: str,
+        value: bytes,
+        ttl_seconds: float,
+        version: Optional[str]
+    ) -> Optional[str]:
+        new_version = _new_version()
+        changed = await self._compare_and_set(
+            keys=[self._prefix + key, self._expiries],
+            args=[version or "", value, new_version, int(ttl_seconds * 1000),
+                  time.time() + ttl_seconds])
+        return new_version if changed else None
+
+    async def touch(self, key: str, ttl_seconds: float):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.pexpire(self._prefix + key, int(ttl_seconds * 1000))
+            # xx: a key missing from the index has expired or been deleted.
+            pipe.zadd(self._expiries, {self._prefix + key: time.time() + ttl_seconds}, xx=True)
+            await pipe.execute()
+
+    async def delete(self, key: str) -> bool:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._prefix + key)
+            pipe.zrem(self._expiries, self._prefix + key)
+            deleted, _ = await pipe.execute()
+        return deleted > 0
+
+    async def count(self) -> int:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self._expiries, "-inf", time.time())
+            pipe.zcard(self._expiries)
+            _, count = await pipe.execute()
+        return count
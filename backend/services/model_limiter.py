@@ -0,0 +1,357 @@
+"""Process-wide, quota-aware concurrency limiter for outbound model calls.
+
+Every model call (text generation and image generation) takes a slot from a
+single limiter. A slot is granted when:
+- the adaptive concurrency limit has room;
+- the requests-per-minute budget has room;
+- the tokens-per-minute budget has room.
+
+Callers that cannot be admitted wait in a FIFO queue instead of failing.
+The concurrency limit follows AIMD: it grows additively while calls succeed
+at normal latency. It is cut multiplicatively on rate-limit errors or when
+latency rises well above its running baseline. A call retried by its
+provider's RetryPolicy gives its slot back while it backs off, reporting the
+error that caused the retry, and waits for a slot again before the next
+attempt.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional
+
+from constants import CHARS_PER_TOKEN
+from model.errors import is_rate_limit_error
+from model.retry import RetryListener
+
+logger = logging.getLogger(__name__)
+
+# Limiter configuration (0 disables a budget)
+MODEL_RPM = float(os.getenv("MODEL_RPM", "1000"))
+MODEL_TPM = float(os.getenv("MODEL_TPM", "1000000"))
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "32"))
+MODEL_MIN_CONCURRENCY = int(os.getenv("MODEL_MIN_CONCURRENCY", "1"))
+MODEL_INITIAL_CONCURRENCY = int(os.getenv("MODEL_INITIAL_CONCURRENCY", "8"))
+
+
+def estimate_tokens(prompt: str, sample_length: int = 0) -> int:
+    """Estimate the token cost of a call from its prompt and output budget."""
+    return len(prompt) // CHARS_PER_TOKEN + sample_length
+
+
+class _TokenBucket:
+    """Token bucket refilled continuously at `per_minute / 60` per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (after a refill)."""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class _Waiter:
+    """A queued acquirer, woken either on a thread event or on its event loop."""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.event = asyncio.Event()
+
+    def notify(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter with requests- and tokens-per-minute budgets.
+
+    Usable from worker threads (`slot`) and from the event loop
+    (`slot_async`); both kinds of callers share one FIFO queue.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        initial_concurrency: Optional[int] = None,
+        latency_factor: float = 2.0,
+        backoff_ratio: float = 0.5,
+        decrease_cooldown: float = 2.0
+    ):
+        """Initialize the limiter.
+
+        Args:
+            requests_per_minute: Request budget, 0 for unlimited
+            tokens_per_minute: Token budget, 0 for unlimited
+            max_concurrency: Upper bound of the adaptive concurrency limit
+            min_concurrency: Lower bound of the adaptive concurrency limit
+            initial_concurrency: Starting concurrency limit
+            latency_factor: Latency above this multiple of the baseline counts
+                as congestion
+            backoff_ratio: Multiplicative decrease applied on rate limits
+            decrease_cooldown: Minimum seconds between two decreases
+        """
+        self._requests = _TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._max = max_concurrency
+        self._min = min_concurrency
+        self._limit = float(min(max_concurrency, initial_concurrency or max_concurrency))
+        self._latency_factor = latency_factor
+        self._backoff_ratio = backoff_ratio
+        self._decrease_cooldown = decrease_cooldown
+        self._last_decrease = 0.0
+        self._latency_baseline: Optional[float] = None
+        self._in_flight = 0
+        self._queue: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._counters = {
+            'granted': 0, 'queued': 0, 'rate_limited': 0, 'congested': 0,
+            'max_queue_length': 0,
+        }
+
+    @property
+    def limit(self) -> int:
+        return max(self._min, int(self._limit))
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            'limit': self.limit,
+            'in_flight': self._in_flight,
+            'queue_length': len(self._queue),
+            'latency_baseline': self._latency_baseline,
+        }
+
+    def has_headroom(self, share: float = 1.0) -> bool:
+        """Return whether nobody waits and under `share` of the limit is in use.
+
+        Optional work, such as prefetching, checks this so that it only runs
+        on capacity that foreground calls leave idle.
+        """
+        with self._lock:
+            return not self._queue and self._in_flight < share * self.limit
+
+    def _try_grant(self, waiter: _Waiter, cost: int) -> Optional[float]:
+        """Grant a slot to the queue head; else return how long to wait.
+
+        A wait of `math.inf` means waiting until another call releases its
+        slot or the waiter reaches the head of the queue.
+        """
+        with self._lock:
+            if self._queue[0] is not waiter or self._in_flight >= self.limit:
+                return math.inf
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests is not None:
+                self._requests.refill(now)
+                wait = max(wait, self._requests.wait_time(1))
+            if self._tokens is not None:
+                self._tokens.refill(now)
+                wait = max(wait, self._tokens.wait_time(cost))
+            if wait > 0:
+                return wait
+            if self._requests is not None:
+                self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= min(cost, self._tokens.capacity)
+            self._in_flight += 1
+            self._counters['granted'] += 1
+            self._queue.popleft()
+            head = self._queue[0] if self._queue else None
+        # The next caller may be admissible too (e.g. after a limit increase).
+        if head is not None:
+            head.notify()
+        return None
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            self._queue.append(waiter)
+            if len(self._queue) > 1 or self._in_flight >= self.limit:
+                self._counters['queued'] += 1
+            self._counters['max_queue_length'] = max(
+                self._counters['max_queue_length'], len(self._queue))
+
+    def _dequeue(self, waiter: _Waiter):
+        """Remove an abandoned waiter and pass the turn on."""
+        with self._lock:
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                return
+            head = self._queue[0] if self._queue else None
+        if head is not None:
+            head.notify()
+
+    def acquire(self, cost: int = 0):
+        """Block the calling thread until a slot is granted."""
+        waiter = _Waiter()
+        self._enqueue(waiter)
+        try:
+            while True:
+                wait = self._try_grant(waiter, cost)
+                if wait is None:
+                    return
+                waiter.event.wait(None if wait == math.inf else wait)
+                waiter.event.clear()
+        except BaseException:
+            self._dequeue(waiter)
+            raise
+
+    async def acquire_async(self, cost: int = 0):
+        """Wait on the event loop until a slot is granted."""
+        waiter = _Waiter(asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            while True:
+                wait = self._try_grant(waiter, cost)
+                if wait is None:
+                    return
+                try:
+                    await asyncio.wait_for(
+                        waiter.event.wait(), None if wait == math.inf else wait)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+        except BaseException:
+            self._dequeue(waiter)
+            raise
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        error: Optional[BaseException] = None,
+        cost: int = 0
+    ):
+        """Return a slot and adapt the concurrency limit to the call outcome.
+
+        Latency is compared per estimated token, so that long generations
+        are not mistaken for congestion next to short ones.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if error is not None and is_rate_limit_error(error):
+                self._counters['rate_limited'] += 1
+                self._decrease(now, self._backoff_ratio)
+            elif error is None and latency is not None:
+                unit_latency = latency / cost if cost > 0 else None
+                baseline = self._latency_baseline
+                if (unit_latency is not None and baseline is not None and
+                        unit_latency > self._latency_factor * baseline):
+                    self._counters['congested'] += 1
+                    self._decrease(now, 0.8)
+                else:
+                    # Additive increase: about +1 per `limit` successful calls.
+                    self._limit = min(float(self._max), self._limit + 1.0 / self._limit)
+                if unit_latency is not None:
+                    self._latency_baseline = unit_latency if baseline is None else (
+                        0.95 * baseline + 0.05 * unit_latency)
+            head = self._queue[0] if self._queue else None
+        if head is not None:
+            head.notify()
+
+    def _decrease(self, now: float, ratio: float):
+        if now - self._last_decrease < self._decrease_cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(float(self._min), self._limit * ratio)
+        logger.info(f"Model concurrency limit decreased to {self.limit}")
+
+    @contextmanager
+    def slot(self, cost: int = 0):
+        """Hold a slot for the duration of a blocking model call."""
+        slot = LimiterSlot(self, cost)
+        slot.acquire()
+        try:
+            yield slot
+        except BaseException as e:
+            slot.release(error=e)
+            raise
+        slot.release()
+
+    @asynccontextmanager
+    async def slot_async(self, cost: int = 0):
+        """Hold a slot for the duration of an async model call."""
+        slot = LimiterSlot(self, cost)
+        await slot.acquire_async()
+        try:
+            yield slot
+        except BaseException as e:
+            slot.release(error=e)
+            raise
+        slot.release()
+
+
+class LimiterSlot(RetryListener):
+    """The slot of one model call, given back while the call backs off.
+
+    As a RetryListener in the context of the call, it releases the slot
+    with the error of each failed attempt, so that rate limits cut the
+    concurrency limit at once, and acquires a slot again, within the
+    limiter's budgets, before the next attempt.
+    """
+
+    def __init__(self, limiter: AdaptiveLimiter, cost: int = 0):
+        self._limiter = limiter
+        self._cost = cost
+        self._held = False
+        self._start = 0.0
+
+    def acquire(self):
+        self._limiter.acquire(self._cost)
+        self._held = True
+        self._start = time.monotonic()
+
+    async def acquire_async(self):
+        await self._limiter.acquire_async(self._cost)
+        self._held = True
+        self._start = time.monotonic()
+
+    def release(self, error: Optional[BaseException] = None):
+        """Release the slot, if held, reporting the outcome of the attempt."""
+        if not self._held:
+            return
+        self._held = False
+        latency = None if error is not None else time.monotonic() - self._start
+        self._limiter.release(latency=latency, error=error, cost=self._cost)
+
+    def backing_off(self, error: BaseException):
+        self.release(error=error)
+
+    def resuming(self):
+        self.acquire()
+
+    async def resuming_async(self):
+        await self.acquire_async()
+
+
+# Global limiter shared by every outbound model call
+model_limiter = AdaptiveLimiter(
+    requests_per_minute=MODEL_RPM,
+    tokens_per_minute=MODEL_TPM,
+    max_concurrency=MODEL_MAX_CONCURRENCY,
+    min_concurrency=MODEL_MIN_CONCURRENCY,
+    initial_concurrency=MODEL_INITIAL_CONCURRENCY
+)
@@ -0,0 +1,117 @@
+"""Per-session background prefetching of the next generation step.
+
+While the user reads a level they just accepted, the level they will most
+likely ask for next (the next level, or the dialogs of the next scenes) is
+generated in the background. When the request for it arrives with the same
+seed and the story has not changed since, the prefetched result is returned
+at once instead of being generated again.
+
+Prefetching is opt-in per session, and only spends idle capacity: a task
+starts only while fewer than PREFETCH_MAX_TASKS prefetches run process-wide
+and the model limiter has headroom. Edits cancel the tasks of a session.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from services.model_limiter import model_limiter
+
+logger = logging.getLogger(__name__)
+
+# Prefetch configuration
+PREFETCH_MAX_TASKS = int(os.getenv("PREFETCH_MAX_TASKS", "8"))
+PREFETCH_LIMITER_SHARE = float(os.getenv("PREFETCH_LIMITER_SHARE", "0.5"))
+
+_running = 0
+_counters = {
+    'started': 0, 'skipped': 0, 'hits': 0, 'misses': 0, 'failed': 0,
+    'cancelled': 0,
+}
+
+
+def prefetch_stats() -> Dict[str, Any]:
+    """Return process-wide prefetch counters."""
+    return {**_counters, 'running': _running}
+
+
+def _has_budget() -> bool:
+    return (_running < PREFETCH_MAX_TASKS
+            and model_limiter.has_headroom(PREFETCH_LIMITER_SHARE))
+
+
+class SessionPrefetcher:
+    """Background generations of one session, keyed by what they compute.
+
+    A key identifies the request a result answers: the level, scene index,
+    seed and the state hash of the story it was generated from. Looking up
+    a result with the key of the current request therefore never returns
+    one generated from other inputs.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def start(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> bool:
+        """Start `factory()` in the background under `key`, budget permitting.
+
+        Returns:
+            True if a task for `key` is running, False if it was skipped
+        """
+        global _running
+        if key in self._tasks:
+            return True
+        if not _has_budget():
+            _counters['skipped'] += 1
+            return False
+        _running += 1
+        _counters['started'] += 1
+        task = asyncio.ensure_future(factory())
+        task.add_done_callback(_task_done)
+        self._tasks[key] = task
+        return True
+
+    async def take(self, key: Hashable) -> Optional[Any]:
+        """Return the result prefetched under `key`, waiting if it is running.
+
+        Returns:
+            The result, or None if nothing was prefetched or it failed
+        """
+        task = self._tasks.pop(key, None)
+        if task is None:
+            _counters['misses'] += 1
+            return None
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            _counters['misses'] += 1
+            return None
+        except Exception:
+            logger.warning("Prefetch %s failed", key, exc_info=True)
+            _counters['failed'] += 1
+            return None
+        _counters['hits'] += 1
+        return result
+
+    def cancel(self, keep: Optional[Callable[[Hashable], bool]] = None):
+        """Cancel the running tasks, except those whose key `keep` accepts."""
+        for key in list(self._tasks):
+            if keep is not None and keep(key):
+                continue
+            task = self._tasks.pop(key)
+            if not task.done():
+                task.cancel()
+                _counters['cancelled'] += 1
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+def _task_done(task: asyncio.Task):
+    global _running
+    _running -= 1
+    # Results that are never taken must not log "exception never retrieved".
+    if not task.cancelled():
+        task.exception()
@@ -1,82 +1,282 @@
-"""Session store for managing user state across requests."""
+"""Session store for managing user state across requests.
+
+`InMemorySessionStore` keeps the live session objects of one process.
+`KeyValueSessionStore` keeps sessions serialized in a shared key-value
+store, so that any worker or machine can serve any session.
+"""
 import asyncio
-from dataclasses import dataclass, field
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import weakref
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, Callable, Tuple
 
+from entities.place import Place
 from operations.uicontrol import GenerationHistory
+from services.command_queue import SessionCommandQueue
+from services.kv_store import KeyValueStore, RedisKeyValueStore, SQLiteKeyValueStore
+from services.prefetch import SessionPrefetcher
+
+logger = logging.getLogger(__name__)
+
+# Session backend configuration: "memory", "sqlite" or "redis"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL_MINUTES = int(os.getenv("SESSION_TTL_MINUTES", "60"))
+SESSION_SQLITE_PATH = os.getenv(
+    "SESSION_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "narrativenest-sessions.sqlite3"))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_LIVE_CACHE = int(os.getenv("SESSION_LIVE_CACHE", "256"))
+
+
+class GenerationData:
+    """Base of the per-level session data, with attributes in __slots__.
+
+    Sessions are kept for every visitor, so their data is held in slotted
+    objects rather than dictionaries.
+    """
+    __slots__ = ()
+
+    def to_state(self) -> Dict:
+        """Return the data as plain JSON types, for serialization."""
+        return {name: _encode_value(getattr(self, name)) for name in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "GenerationData":
+        """Return the data serialized by to_state."""
+        data = cls()
+        for name, value in state.items():
+            setattr(data, name, _decode_value(value))
+        return data
+
+
+class TitleData(GenerationData):
+    """Title level of a session."""
+    __slots__ = ("text", "seed")
+
+    def __init__(self):
+        self.text = ""
+        self.seed = None
+
+
+class LevelData(GenerationData):
+    """Characters or scenes level of a session, with its history."""
+    __slots__ = ("text", "seed", "history")
+
+    def __init__(self):
+        self.text = ""
+        self.seed = None
+        self.history = GenerationHistory()
+
+
+class PlacesData(GenerationData):
+    """Places level of a session."""
+    __slots__ = ("descriptions", "seed")
+
+    def __init__(self):
+        self.descriptions: Dict[str, Place] = {}
+        self.seed = None
+
+
+class SceneHistories:
+    """Histories of the dialogs, indexed by scene, created on first access.
+
+    Only the scenes whose dialog was generated or edited have a history,
+    and there is no limit on the number of scenes.
+    """
+    __slots__ = ("_histories",)
+
+    def __init__(self):
+        self._histories: Optional[Dict[int, GenerationHistory]] = None
+
+    def __getitem__(self, scene_index: int) -> GenerationHistory:
+        if self._histories is None:
+            self._histories = {}
+        history = self._histories.get(scene_index)
+        if history is None:
+            history = self._histories[scene_index] = GenerationHistory()
+        return history
+
+    def __len__(self) -> int:
+        return len(self._histories) if self._histories else 0
+
+    def to_state(self) -> Dict[str, Any]:
+        return {str(k): history.to_state() for k, history in (self._histories or {}).items()}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "SceneHistories":
+        histories = cls()
+        if state:
+            histories._histories = {
+                int(k): GenerationHistory.from_state(history) for k, history in state.items()}
+        return histories
+
+
+class DialogsData(GenerationData):
+    """Dialogs level of a session: the current scene and the histories."""
+    __slots__ = ("seed", "scene", "history")
 
+    def __init__(self):
+        self.seed = None
+        self.scene = 1
+        self.history = SceneHistories()
 
-@dataclass
+
+@dataclass(slots=True)
 class SessionState:
     """State container for a single user session.
 
     Holds all the stateful data that was previously stored in the
     NarrativeNest class instance.
     """
+    session_id: Optional[str] = None
     generator: Optional[Any] = None
     script_text: Optional[str] = None
-    story: Optional[Any] = None
-
-    data_title: Dict = field(default_factory=lambda: {
-        "text": "",
-        "text_area": None,
-        "seed": None
-    })
-
-    data_chars: Dict = field(default_factory=lambda: {
-        "text": "",
-        "text_area": None,
-        "seed": None,
-        "history": GenerationHistory(),
-        "lock": False
-    })
-
-    data_scenes: Dict = field(default_factory=lambda: {
-        "text": None,
-        "text_area": None,
-        "seed": None,
-        "history": GenerationHistory(),
-        "lock": False
-    })
-
-    place_names: List = field(default_factory=list)
-    place_descriptions: Dict = field(default_factory=dict)
-
-    data_places: Dict = field(default_factory=lambda: {
-        "descriptions": {},
-        "text_area": {},
-        "seed": None
-    })
-
-    data_dialogs: Dict = field(default_factory=lambda: {
-        "lock": False,
-        "text_area": None,
-        "seed": None,
-        "history": [GenerationHistory() for _ in range(99)],
-        "scene": 1
-    })
+
+    data_title: TitleData = field(default_factory=TitleData)
+    data_chars: LevelData = field(default_factory=LevelData)
+    data_scenes: LevelData = field(default_factory=LevelData)
+    data_places: PlacesData = field(default_factory=PlacesData)
+    data_dialogs: DialogsData = field(default_factory=DialogsData)
+
+    # Background generations of the next step, if the session opted in
+    prefetcher: Optional[Any] = None
 
     created_at: datetime = field(default_factory=datetime.now)
     last_accessed: datetime = field(default_factory=datetime.now)
 
+    # Version and digest of the stored session this one was loaded from or
+    # saved as, in stores that serialize sessions
+    version: Optional[str] = None
+    digest: Optional[bytes] = None
+
+
+# Served to requests without a stored session, so that reads do not create
+# one. It has no ID, and stores do not save it; endpoints must not mutate it.
+EMPTY_SESSION = SessionState()
+
+
+class SessionConflictError(RuntimeError):
+    """Raised when saving a session another process changed since it was loaded."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} was changed by another request")
+        self.session_id = session_id
+
 
 class SessionStore:
+    """Interface of the session stores.
+
+    Endpoints mutate the SessionState they get, then `save` it so that the
+    other processes serving the session see the changes. Endpoints hold the
+    `session_lock` of the session meanwhile, so that the mutations of one
+    session are serialized in a process while other sessions never wait.
+    Across processes, a mutation starts by `reload`ing the session under
+    the lock, and `save` raises SessionConflictError rather than overwrite
+    the changes another process saved in between.
+    """
+
+    def __init__(self):
+        # A lock lives while a request holds or awaits it, then is dropped.
+        self._session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+            weakref.WeakValueDictionary())
+        self._session_commands: "weakref.WeakValueDictionary[str, SessionCommandQueue]" = (
+            weakref.WeakValueDictionary())
+
+    def session_lock(self, session_id: str) -> asyncio.Lock:
+        """Return the lock serializing the requests of a session."""
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        return lock
+
+    def session_commands(self, session_id: str) -> SessionCommandQueue:
+        """Return the queue running the generation commands of a session.
+
+        Its commands hold the session lock, so they also wait for, and are
+        waited for by, the other mutations of the session.
+        """
+        commands = self._session_commands.get(session_id)
+        if commands is None:
+            commands = SessionCommandQueue(self.session_lock(session_id))
+            self._session_commands[session_id] = commands
+        return commands
+
+    async def get(self, session_id: str) -> Optional[SessionState]:
+        """Get a session by ID, or None if it does not exist or expired."""
+        raise NotImplementedError
+
+    async def create(self, session_id: str) -> SessionState:
+        """Create a new session."""
+        raise NotImplementedError
+
+    async def save(self, session: SessionState):
+        """Persist the changes made to a session.
+
+        A session unchanged since it was loaded or saved is not written.
+        """
+        raise NotImplementedError
+
+    async def reload(self, session: SessionState):
+        """Bring a session up to date with the changes other processes saved.
+
+        The session is updated in place, so that the code holding it sees
+        the changes. Stores shared by a single process have nothing to do.
+        """
+
+    async def delete(self, session_id: str) -> bool:
+        """Delete a session, returning whether it existed."""
+        raise NotImplementedError
+
+    async def cleanup_expired(self) -> int:
+        """Remove expired sessions, returning how many were removed."""
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        """Return the number of active sessions."""
+        raise NotImplementedError
+
+    async def get_or_create(self, session_id: str) -> SessionState:
+        """Get existing session or create new one.
+
+        Args:
+            session_id: The session identifier
+
+        Returns:
+            Existing or new SessionState
+        """
+        session = await self.get(session_id)
+        if session is None:
+            session = await self.create(session_id)
+        return session
+
+
+class InMemorySessionStore(SessionStore):
     """In-memory session store with TTL-based cleanup.
 
-    Manages user sessions for the FastAPI application, providing
-    thread-safe access to session state.
+    Manages user sessions for the FastAPI application. Sessions are lost on
+    restart and invisible to other processes, so the API must run a single
+    worker. Lookups take no lock: they run on the event loop and do not
+    await between reading and updating the dictionary.
     """
 
+    # Sessions scanned by cleanup_expired between two yields to the event loop
+    CLEANUP_BATCH = 1000
+
     def __init__(self, ttl_minutes: int = 60):
         """Initialize the session store.
 
         Args:
             ttl_minutes: Time-to-live for sessions in minutes
         """
+        super().__init__()
         self._sessions: Dict[str, SessionState] = {}
         self._ttl = timedelta(minutes=ttl_minutes)
-        self._lock = asyncio.Lock()
 
     async def get(self, session_id: str) -> Optional[SessionState]:
         """Get a session by ID.
@@ -87,11 +287,10 @@ class SessionStore:
         Returns:
             SessionState if found, None otherwise
         """
-        async with self._lock:
-            session = self._sessions.get(session_id)
-            if session:
-                session.last_accessed = datetime.now()
-            return session
+        session = self._sessions.get(session_id)
+        if session:
+            session.last_accessed = datetime.now()
+        return session
 
     async def create(self, session_id: str) -> SessionState:
         """Create a new session.
@@ -102,25 +301,13 @@ class SessionStore:
         Returns:
             The newly created SessionState
         """
-        async with self._lock:
-            session = SessionState()
-            self._sessions[session_id] = session
-            return session
-
-    async def get_or_create(self, session_id: str) -> SessionState:
-        """Get existing session or create new one.
-
-        Args:
-            session_id: The session identifier
-
-        Returns:
-            Existing or new SessionState
-        """
-        session = await self.get(session_id)
-        if session is None:
-            session = await self.create(session_id)
+        session = SessionState(session_id=session_id)
+        self._sessions[session_id] = session
         return session
 
+    async def save(self, session: SessionState):
+        """Nothing to do: the stored session is the object that changed."""
+
     async def delete(self, session_id: str) -> bool:
         """Delete a session.
 
@@ -130,33 +317,268 @@ class SessionStore:
         Returns:
             True if deleted, False if not found
         """
-        async with self._lock:
-            if session_id in self._sessions:
-                del self._sessions[session_id]
-                return True
-            return False
+        return self._sessions.pop(session_id, None) is not None
 
     async def cleanup_expired(self) -> int:
         """Remove expired sessions.
 
+        The sessions are scanned in batches, yielding to the event loop in
+        between so that requests are not held up by a long scan. Sessions
+        accessed during the scan are kept.
+
         Returns:
             Number of sessions removed
         """
-        async with self._lock:
+        session_ids = list(self._sessions)
+        removed = 0
+        for start in range(0, len(session_ids), self.CLEANUP_BATCH):
             now = datetime.now()
-            expired = [
-                sid for sid, session in self._sessions.items()
-                if now - session.last_accessed > self._ttl
-            ]
-            for sid in expired:
-                del self._sessions[sid]
-            return len(expired)
-
-    @property
-    def session_count(self) -> int:
-        """Get current number of active sessions."""
+            for sid in session_ids[start:start + self.CLEANUP_BATCH]:
+                session = self._sessions.get(sid)
+                if session is not None and now - session.last_accessed > self._ttl:
+                    del self._sessions[sid]
+                    removed += 1
+            await asyncio.sleep(0)
+        return removed
+
+    async def count(self) -> int:
         return len(self._sessions)
 
 
-# Global session store instance
-session_store = SessionStore(ttl_minutes=60)
+# ============================================================================
+# Serialization
+# ============================================================================
+
+# Version of the serialized format, stored as the first byte
+_FORMAT_VERSION = 2
+
+# Per-level data of a session, and its class
+_DATA_FIELDS = {
+    "data_title": TitleData,
+    "data_chars": LevelData,
+    "data_scenes": LevelData,
+    "data_places": PlacesData,
+    "data_dialogs": DialogsData,
+}
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, GenerationHistory):
+        return {"~h": value.to_state()}
+    if isinstance(value, SceneHistories):
+        return {"~s": value.to_state()}
+    if isinstance(value, Place):
+        return {"~p": [value.name, value.description]}
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and "~h" in value:
+            return GenerationHistory.from_state(value["~h"])
+        if len(value) == 1 and "~s" in value:
+            return SceneHistories.from_state(value["~s"])
+        if len(value) == 1 and "~p" in value:
+            return Place(*value["~p"])
+        return {key: _decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    return value
+
+
+def encode_session(session: SessionState) -> bytes:
+    """Serialize a session as zlib-compressed compact JSON.
+
+    The prompts of the generator repeat the genre prefixes at every level,
+    which compression reduces to about one copy. Background prefetches are
+    local to a process: only whether the session opted in is serialized.
+    """
+    state = {
+        "generator": session.generator.to_state() if session.generator else None,
+        "script_text": session.script_text,
+        "prefetch": session.prefetcher is not None,
+        "data": {name: getattr(session, name).to_state() for name in _DATA_FIELDS},
+        "created_at": session.created_at.timestamp(),
+        "last_accessed": session.last_accessed.timestamp(),
+    }
+    data = json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return bytes([_FORMAT_VERSION]) + zlib.compress(data)
+
+
+def decode_session(
+    data: bytes,
+    restore_generator: Callable[[Dict], Any],
+    session_id: Optional[str] = None
+) -> SessionState:
+    """Deserialize a session serialized by encode_session.
+
+    Args:
+        data: Serialized session
+        restore_generator: Returns the StoryGenerator of a generator state
+        session_id: The session identifier
+
+    Returns:
+        The SessionState
+    """
+    if data[0] != _FORMAT_VERSION:
+        raise ValueError(f"Unknown session format version: {data[0]}")
+    state = json.loads(zlib.decompress(data[1:]))
+    session = SessionState(
+        session_id=session_id,
+        generator=restore_generator(state["generator"]) if state["generator"] else None,
+        script_text=state["script_text"],
+        prefetcher=SessionPrefetcher() if state["prefetch"] else None,
+        created_at=datetime.fromtimestamp(state["created_at"]),
+        last_accessed=datetime.fromtimestamp(state["last_accessed"]),
+    )
+    for name, value in state["data"].items():
+        setattr(session, name, _DATA_FIELDS[name].from_state(value))
+    return session
+
+
+class KeyValueSessionStore(SessionStore):
+    """Session store keeping serialized sessions in a shared key-value store.
+
+    Sessions expire in the key-value store `ttl_minutes` after their last
+    access. The live objects of the sessions last served are kept in an LRU
+    of `live_sessions` entries: while the version of the stored session is
+    the one a live object was loaded from or saved as, it is served without
+    deserializing it, and keeps its prefetches. Sessions are only written
+    when they changed, compared by digest, and with compare-and-set on
+    their version.
+    """
+
+    def __init__(
+        self,
+        kv: KeyValueStore,
+        restore_generator: Callable[[Dict], Any],
+        ttl_minutes: int = 60,
+        live_sessions: int = 256
+    ):
+        """Initialize the session store.
+
+        Args:
+            kv: Key-value store holding the sessions
+            restore_generator: Returns the StoryGenerator of a generator state
+            ttl_minutes: Time-to-live for sessions in minutes
+            live_sessions: Live session objects kept in this process
+        """
+        super().__init__()
+        self._kv = kv
+        self._restore_generator = restore_generator
+        self._ttl_seconds = ttl_minutes * 60
+        self._live_sessions = live_sessions
+        self._live: "OrderedDict[str, SessionState]" = OrderedDict()
+
+    @staticmethod
+    def _digest(data: bytes) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def _remember(self, session: SessionState):
+        self._live[session.session_id] = session
+        self._live.move_to_end(session.session_id)
+        while len(self._live) > self._live_sessions:
+            self._live.popitem(last=False)
+
+    async def _load(self, session_id: str) -> Optional[SessionState]:
+        """Return the stored session, reusing its live object if up to date."""
+        stored = await self._kv.get(session_id)
+        if stored is None:
+            self._live.pop(session_id, None)
+            return None
+        data, version = stored
+        live = self._live.get(session_id)
+        if live is not None and live.version == version:
+            self._live.move_to_end(session_id)
+            return live
+        try:
+            session = decode_session(data, self._restore_generator, session_id)
+        except ValueError as e:
+            logger.warning(f"Dropping unreadable session {session_id}: {e}")
+            await self.delete(session_id)
+            return None
+        session.version = version
+        session.digest = self._digest(data)
+        self._remember(session)
+        return session
+
+    async def get(self, session_id: str) -> Optional[SessionState]:
+        session = await self._load(session_id)
+        if session is not None:
+            await self._kv.touch(session_id, self._ttl_seconds)
+        return session
+
+    async def create(self, session_id: str) -> SessionState:
+        session = SessionState(session_id=session_id)
+        try:
+            await self.save(session)
+        except SessionConflictError:
+            # Created concurrently by another process.
+            return await self.get(session_id) or session
+        return session
+
+    async def save(self, session: SessionState):
+        if session.session_id is None:
+            return
+        data = encode_session(session)
+        digest = self._digest(data)
+        if session.version is not None and digest == session.digest:
+            return
+        version = await self._kv.compare_and_set(
+            session.session_id, data, self._ttl_seconds, session.version)
+        if version is None:
+            raise SessionConflictError(session.session_id)
+        session.version = version
+        session.digest = digest
+        self._remember(session)
+
+    async def reload(self, session: SessionState):
+        if session.session_id is None:
+            return
+        stored = await self._kv.get(session.session_id)
+        if stored is None or stored[1] == session.version:
+            return
+        stored = await self._load(session.session_id)
+        if stored is None or stored is session:
+            return
+        if session.prefetcher is not None:
+            session.prefetcher.cancel()
+        for name in (f.name for f in fields(SessionState)):
+            setattr(session, name, getattr(stored, name))
+        self._remember(session)
+
+    async def delete(self, session_id: str) -> bool:
+        self._live.pop(session_id, None)
+        return await self._kv.delete(session_id)
+
+    async def cleanup_expired(self) -> int:
+        return await self._kv.purge_expired()
+
+    async def count(self) -> int:
+        return await self._kv.count()
+
+
+def session_store_from_env(restore_generator: Callable[[Dict], Any]) -> SessionStore:
+    """Return the session store selected by SESSION_BACKEND.
+
+    Args:
+        restore_generator: Returns the StoryGenerator of a generator state,
+            for the backends that serialize sessions
+    """
+    if SESSION_BACKEND == "memory":
+        return InMemorySessionStore(ttl_minutes=SESSION_TTL_MINUTES)
+    if SESSION_BACKEND == "sqlite":
+        kv = SQLiteKeyValueStore(SESSION_SQLITE_PATH)
+    elif SESSION_BACKEND == "redis":
+        kv = RedisKeyValueStore(SESSION_REDIS_URL)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND}")
+    logger.info(f"Sessions are stored in the {SESSION_BACKEND} backend")
+    return KeyValueSessionStore(
+        kv, restore_generator,
+        ttl_minutes=SESSION_TTL_MINUTES,
+        live_sessions=SESSION_LIVE_CACHE)
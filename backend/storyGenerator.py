@@ -1,22 +1,34 @@
-from typing import Dict, List, NamedTuple, Optional, Union
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 from constants import (MAX_NUM_REPETITIONS, 
                        MAX_PARAGRAPH_LENGTH_CHARACTERS, MAX_PARAGRAPH_LENGTH_SCENES, SAMPLE_LENGTH,
                        )
 
 from diffs import diff_prompt_change_dict, diff_prompt_change_scenes, diff_prompt_change_str
 from entities.story import Story
-from generate import generate_characters, generate_dialog, generate_place_descriptions, generate_scenes, generate_text, generate_title
+from generate import (build_dialog_prompt, build_place_prompt, generate_characters_async,
+                      generate_dialog_async, generate_dialogs_async,
+                      generate_place_description_async, generate_place_descriptions_async,
+                      generate_scenes_async, generate_text_async, generate_title_async)
 from model.FilterAPI import FilterAPI
 from model.LanguageAPI import LanguageAPI
+from model.levels import generation_genre
 from entities.character import Characters, get_character_descriptions
 from entities.place import Place
 from entities.scene import Scene, Scenes
 from entities.title import Title
+import asyncio
+import hashlib
 import time
+from utils.run_sync import sync_shim
 from utils.strip_end import strip_remove_end
 
 
 
+def _input_hash(prompt: str) -> str:
+  """Return the content hash of the inputs of a generation, given its prompt."""
+  return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+
 class StoryGenerator:
   """Generate a story from the provided storyline, using the client provided."""
 
@@ -32,8 +44,10 @@ class StoryGenerator:
       max_paragraph_length_scenes: int = (MAX_PARAGRAPH_LENGTH_SCENES),
       num_samples: int = 1,
       client: Optional[LanguageAPI] = None,
-      filter: Optional[FilterAPI] = None):
+      filter: Optional[FilterAPI] = None,
+      genre: Optional[str] = None):
     self._prefixes = prefixes
+    self._genre = genre
     self._max_paragraph_length = max_paragraph_length
     self._max_paragraph_length_characters = max_paragraph_length_characters
     self._max_paragraph_length_scenes = max_paragraph_length_scenes
@@ -61,6 +75,9 @@ class StoryGenerator:
     self.interventions = {}
     self._set_storyline(storyline)
 
+    # Content hashes of the inputs each place and dialog was generated from.
+    self._input_hashes = {'places': {}, 'dialogs': []}
+
   def _set_storyline(self, storyline: str):
     """Set storyline and initialise the outputs of the generator."""
     self._level = 0
@@ -111,143 +128,509 @@ class StoryGenerator:
     """Return the number of scenes."""
     return self._scenes.num_scenes()
 
-  def step(self,
-           level: Optional[int] = None,
-           seed: Optional[int] = None,
-           idx: Optional[int] = None) -> bool:
-    """Step down a level in the hierarchical generation of a story."""
-
+  async def step_async(
+      self,
+      level: Optional[int] = None,
+      seed: Optional[int] = None,
+      idx: Optional[int] = None,
+      on_chunk: Optional[Callable[[str], None]] = None,
+      on_result: Optional[Callable[[Union[str, int], Union[Place, str]], None]] = None
+  ) -> bool:
+    """Step down a level in the hierarchical generation of a story.
+
+    If `on_chunk` is given, model tokens are passed to it as they arrive,
+    and places and dialogs are generated one after the other. Otherwise
+    they are generated concurrently, and `on_result` is called with the
+    place name and Place, or the scene index and dialog, as each completes.
+    """
+    # Output lengths are learned per genre.
+    with generation_genre(self._genre):
+      return await self._step_async(
+          level=level, seed=seed, idx=idx, on_chunk=on_chunk, on_result=on_result)
+
+  async def _step_async(
+      self,
+      level: Optional[int],
+      seed: Optional[int],
+      idx: Optional[int],
+      on_chunk: Optional[Callable[[str], None]],
+      on_result: Optional[Callable[[Union[str, int], Union[Place, str]], None]] = None
+  ) -> bool:
     # Move to the next level of hierarchical generation.
     if level is None:
       level = self._level
     if level < 0 or level >= len(self.level_names):
       raise ValueError('Invalid level encountered on step.')
     level += 1
-    self._level = level
-
-    # Keep track of each step intervention.
-    timestamp = time.time()
-    self.interventions[timestamp] = 'STEP ' + str(level) + '\n'
+    result = await self._generate_level_async(level, seed, idx, on_chunk, on_result)
+    return self._accept_level(level, idx, result)
 
+  async def _generate_level_async(
+      self,
+      level: int,
+      seed: Optional[int],
+      idx: Optional[int],
+      on_chunk: Optional[Callable[[str], None]],
+      on_result: Optional[Callable[[Union[str, int], Union[Place, str]], None]]
+  ) -> tuple:
+    """Generate the outputs of a level and their prompts, leaving the story as is."""
     if level == 1:
       # Step 1: Generate title given a storyline.
-      (title, titles_prefix) = generate_title(
+      return await generate_title_async(
           storyline=self._storyline,
           prefixes=self._prefixes,
           client=self._client,
           model_filter=self._filter,
           num_samples=self._num_samples,
-          seed=seed)
-      self._title = title
-      self.prompts['title'] = titles_prefix
-      self.interventions[timestamp] += title.to_string()
-      success = len(title.title) > 0
-      return success
+          seed=seed,
+          on_chunk=on_chunk)
 
     if level == 2:
       # Step 2: Generate characters given a storyline.
-      (characters, character_prompts) = generate_characters(
+      return await generate_characters_async(
           storyline=self._storyline,
           prefixes=self._prefixes,
           client=self._client,
           model_filter=self._filter,
           num_samples=self._num_samples,
           max_paragraph_length=self._max_paragraph_length_characters,
-          seed=seed)
-      self._characters = characters
-      self.prompts['characters'] = character_prompts
-      self.interventions[timestamp] += characters.to_string()
-      success = len(characters.character_descriptions) > 0
-      return success
+          seed=seed,
+          on_chunk=on_chunk)
 
     if level == 3:
       # Step 3: Generate sequence of scenes given a storyline and characters.
-      characters = self._characters
-      (scenes, scene_prompts) = generate_scenes(
+      return await generate_scenes_async(
           storyline=self._storyline,
-          character_descriptions=get_character_descriptions(characters),
+          character_descriptions=get_character_descriptions(self._characters),
           prefixes=self._prefixes,
           client=self._client,
           model_filter=self._filter,
           num_samples=self._num_samples,
           max_paragraph_length=self._max_paragraph_length_scenes,
-          seed=seed)
-      self._scenes = scenes
-      self.prompts['scenes'] = scene_prompts
-      self.interventions[timestamp] += scenes.to_string()
-      success = len(scenes.scenes) > 0
-      return success
+          seed=seed,
+          on_chunk=on_chunk)
 
     if level == 4:
       # Step 4: For each scene, generate place descriptions given place name.
-      scenes = self._scenes
-      (place_descriptions, place_prompts) = generate_place_descriptions(
+      return await generate_place_descriptions_async(
           storyline=self._storyline,
-          scenes=scenes,
+          scenes=self._scenes,
           prefixes=self._prefixes,
           client=self._client,
           model_filter=self._filter,
           num_samples=self._num_samples,
-          seed=seed)
+          seed=seed,
+          on_chunk=on_chunk,
+          on_result=on_result)
+
+    if level == 5:
+      # Step 5: For each scene, generate dialog from scene information.
+      if idx is None:
+        return await generate_dialogs_async(
+            storyline=self._storyline,
+            scenes=self._scenes,
+            character_descriptions=(self._characters.character_descriptions),
+            place_descriptions=self._places,
+            prefixes=self._prefixes,
+            max_paragraph_length=self._max_paragraph_length,
+            max_num_repetitions=MAX_NUM_REPETITIONS,
+            client=self._client,
+            model_filter=self._filter,
+            num_samples=self._num_samples,
+            seed=seed,
+            on_chunk=on_chunk,
+            on_result=on_result)
+      if idx >= self._scenes.num_scenes() or idx < 0:
+        raise ValueError('Invalid scene index.')
+      return await generate_dialog_async(
+          storyline=self._storyline,
+          scenes=self._scenes.scenes[:(idx + 1)],
+          character_descriptions=(self._characters.character_descriptions),
+          place_descriptions=self._places,
+          prefixes=self._prefixes,
+          max_paragraph_length=self._max_paragraph_length,
+          max_num_repetitions=MAX_NUM_REPETITIONS,
+          client=self._client,
+          model_filter=self._filter,
+          num_samples=self._num_samples,
+          seed=seed,
+          on_chunk=on_chunk)
+
+  def _accept_level(self, level: int, idx: Optional[int], result: tuple) -> bool:
+    """Set the outputs of a level generated by _generate_level_async."""
+    self._level = level
+
+    # Keep track of each step intervention.
+    timestamp = time.time()
+    self.interventions[timestamp] = 'STEP ' + str(level) + '\n'
+
+    if level == 1:
+      (title, titles_prefix) = result
+      self._title = title
+      self.prompts['title'] = titles_prefix
+      self.interventions[timestamp] += title.to_string()
+      success = len(title.title) > 0
+      return success
+
+    if level == 2:
+      (characters, character_prompts) = result
+      self._characters = characters
+      self.prompts['characters'] = character_prompts
+      self.interventions[timestamp] += characters.to_string()
+      success = len(characters.character_descriptions) > 0
+      return success
+
+    if level == 3:
+      (scenes, scene_prompts) = result
+      self._scenes = scenes
+      self.prompts['scenes'] = scene_prompts
+      self.interventions[timestamp] += scenes.to_string()
+      success = len(scenes.scenes) > 0
+      return success
+
+    if level == 4:
+      (place_descriptions, place_prompts) = result
       self._places = place_descriptions
       self.prompts['places'] = place_prompts
+      self._input_hashes['places'] = {
+          place_name: _input_hash(prompt)
+          for place_name, prompt in zip(place_descriptions, place_prompts)}
       for place_name in place_descriptions:
         place = place_descriptions[place_name]
         if place:
           self.interventions[timestamp] += place.to_string()
-      num_places = scenes.num_places()
+      num_places = self._scenes.num_places()
       success = (len(place_descriptions) == num_places) and num_places > 0
       return success
 
     if level == 5:
-      # Step 5: For each scene, generate dialog from scene information.
-      title = self._title
-      characters = self._characters
-      scenes = self._scenes
-      place_descriptions = self._places
       if idx is None:
-        (dialogs, dialog_prompts) = zip(*[
-            generate_dialog(
-                storyline=self._storyline,
-                scenes=scenes.scenes[:(k + 1)],
-                character_descriptions=(characters.character_descriptions),
-                place_descriptions=place_descriptions,
-                prefixes=self._prefixes,
-                max_paragraph_length=self._max_paragraph_length,
-                max_num_repetitions=MAX_NUM_REPETITIONS,
-                client=self._client,
-                model_filter=self._filter,
-                num_samples=self._num_samples,
-                seed=seed) for k in range(len(scenes.scenes))
-        ])
+        (dialogs, dialog_prompts) = result
       else:
         num_scenes = self._scenes.num_scenes()
         while len(self._dialogs) < num_scenes:
           self._dialogs.append('')
         while len(self.prompts['dialogs']) < num_scenes:
           self.prompts['dialogs'].append('')
-        if idx >= num_scenes or idx < 0:
-          raise ValueError('Invalid scene index.')
         dialogs = self._dialogs
         dialog_prompts = self.prompts['dialogs']
-        dialogs[idx], dialog_prompts[idx] = generate_dialog(
-            storyline=self._storyline,
-            scenes=scenes.scenes[:(idx + 1)],
-            character_descriptions=(characters.character_descriptions),
-            place_descriptions=place_descriptions,
-            prefixes=self._prefixes,
-            max_paragraph_length=self._max_paragraph_length,
-            max_num_repetitions=MAX_NUM_REPETITIONS,
-            client=self._client,
-            model_filter=self._filter,
-            num_samples=self._num_samples,
-            seed=seed)
+        dialogs[idx], dialog_prompts[idx] = result
       self._dialogs = dialogs
       self.prompts['dialogs'] = dialog_prompts
+      self._record_dialog_hashes(range(len(dialogs)) if idx is None else [idx])
       for dialog in dialogs:
         self.interventions[timestamp] += str(dialog)
       return True
 
+  # Blocking version of step_async, for scripts.
+  step = sync_shim(step_async)
+
+  def state_hash(self) -> str:
+    """Return the content hash of the story levels that generations start from.
+
+    Title and dialogs are left out, since no other generation reads them.
+    """
+    places = ''.join(place.to_string() for place in self._places.values() if place)
+    return _input_hash('\n'.join((self._storyline, self._characters.to_string(),
+                                  self._scenes.to_string(), places)))
+
+  async def speculate_async(self,
+                            level: int,
+                            seed: Optional[int] = None,
+                            idx: Optional[int] = None) -> tuple:
+    """Generate what step_async(level, seed, idx) would, without using it.
+
+    The story is left as is, so that the result can be discarded, or passed
+    to `accept` while state_hash() has not changed.
+    """
+    if level < 0 or level >= len(self.level_names):
+      raise ValueError('Invalid level encountered on step.')
+    with generation_genre(self._genre):
+      return await self._generate_level_async(level + 1, seed, idx, None, None)
+
+  def accept(self, level: int, result: tuple, idx: Optional[int] = None) -> bool:
+    """Step down a level with a result of speculate_async(level, seed, idx)."""
+    if level < 0 or level >= len(self.level_names):
+      raise ValueError('Invalid level encountered on step.')
+    return self._accept_level(level + 1, idx, result)
+
+  async def generate_story_async(
+      self,
+      seed: Optional[int] = None,
+      on_result: Optional[Callable[[str, Optional[Union[str, int]], str], None]] = None
+  ) -> bool:
+    """Generate the whole story, running each generation once its inputs exist.
+
+    Title and characters only depend on the storyline and are generated
+    concurrently, and the scenes follow the characters. Every place is then
+    described concurrently, and the dialog of a scene starts as soon as the
+    place of the scene is described.
+
+    `on_result(level, key, text)` is called as each result is generated,
+    with the level name ('title', 'characters', 'scenes', 'place' or
+    'dialog'), the place name or scene index (None for the other levels)
+    and the text.
+    """
+
+    def done(level: str, key: Optional[Union[str, int]], text: str):
+      if on_result is not None:
+        on_result(level, key, text)
+
+    async def title():
+      await self._step_async(level=0, seed=seed, idx=None, on_chunk=None)
+      done('title', None, self.title_str())
+
+    async def characters_and_scenes():
+      await self._step_async(level=1, seed=seed, idx=None, on_chunk=None)
+      done('characters', None, strip_remove_end(self._characters.to_string()))
+      await self._step_async(level=2, seed=seed, idx=None, on_chunk=None)
+      done('scenes', None, strip_remove_end(self._scenes.to_string()))
+
+    places = {}
+    place_prompts = {}
+
+    async def place(place_name: str):
+      (places[place_name], place_prompts[place_name]) = (
+          await generate_place_description_async(
+              storyline=self._storyline,
+              place_name=place_name,
+              prefixes=self._prefixes,
+              client=self._client,
+              model_filter=self._filter,
+              seed=seed,
+              num_samples=self._num_samples))
+      done('place', place_name, places[place_name].description)
+
+    async def dialog(k: int, place_task: asyncio.Future):
+      await place_task
+      dialogs[k], dialog_prompts[k] = await generate_dialog_async(
+          storyline=self._storyline,
+          scenes=self._scenes.scenes[:(k + 1)],
+          character_descriptions=self._characters.character_descriptions,
+          place_descriptions=places,
+          prefixes=self._prefixes,
+          max_paragraph_length=self._max_paragraph_length,
+          max_num_repetitions=MAX_NUM_REPETITIONS,
+          client=self._client,
+          model_filter=self._filter,
+          num_samples=self._num_samples,
+          seed=seed)
+      done('dialog', k, strip_remove_end(dialogs[k]))
+
+    # Output lengths are learned per genre.
+    with generation_genre(self._genre):
+      tasks = [asyncio.ensure_future(title())]
+      try:
+        await characters_and_scenes()
+        scenes = self._scenes.scenes
+        dialogs = [''] * len(scenes)
+        dialog_prompts = [''] * len(scenes)
+        place_tasks = {
+            place_name: asyncio.ensure_future(place(place_name))
+            for place_name in self._scenes.place_names()}
+        tasks += place_tasks.values()
+        tasks += [asyncio.ensure_future(dialog(k, place_tasks[scene.place]))
+                  for k, scene in enumerate(scenes)]
+        await asyncio.gather(*tasks)
+      finally:
+        for task in tasks:
+          task.cancel()
+
+    self._level = len(self.level_names) - 1
+    self._places = {name: places[name] for name in place_tasks}
+    self.prompts['places'] = [place_prompts[name] for name in place_tasks]
+    self._input_hashes['places'] = {
+        name: _input_hash(place_prompts[name]) for name in place_tasks}
+    self._dialogs = dialogs
+    self.prompts['dialogs'] = dialog_prompts
+    self._record_dialog_hashes(range(len(dialogs)))
+    timestamp = time.time()
+    self.interventions[timestamp] = 'STEP 4\n'
+    for place_name in self._places:
+      self.interventions[timestamp] += self._places[place_name].to_string()
+    self.interventions[timestamp] += 'STEP 5\n'
+    for dialog_text in dialogs:
+      self.interventions[timestamp] += str(dialog_text)
+    return len(self._title.title) > 0 and len(scenes) > 0
+
+  # Blocking version of generate_story_async, for scripts.
+  generate_story = sync_shim(generate_story_async)
+
+  def _record_dialog_hashes(self, indices):
+    """Record the input hashes of the dialogs of the given scenes."""
+    hashes = self._input_hashes['dialogs']
+    while len(hashes) < len(self.prompts['dialogs']):
+      hashes.append(None)
+    for k in indices:
+      hashes[k] = _input_hash(self.prompts['dialogs'][k])
+
+  def _place_is_stale(self, place_name: str) -> bool:
+    prompt = build_place_prompt(self._storyline, place_name, self._prefixes)
+    return self._input_hashes['places'].get(place_name) != _input_hash(prompt)
+
+  def _dialog_is_stale(self, k: int) -> bool:
+    hashes = self._input_hashes['dialogs']
+    prompt = build_dialog_prompt(
+        self._storyline, self._scenes.scenes[:(k + 1)],
+        self._characters.character_descriptions, self._places, self._prefixes)
+    return k >= len(hashes) or hashes[k] != _input_hash(prompt)
+
+  async def refresh_async(
+      self,
+      seed: Optional[int] = None,
+      on_result: Optional[Callable[[str, Union[str, int], str], None]] = None
+  ) -> Tuple[List[str], List[int]]:
+    """Regenerate the places and dialogs whose inputs changed since generated.
+
+    After rewriting the storyline, characters or scenes, a place is stale if
+    its name or the storyline changed, and a dialog if its prompt changed:
+    the place of the scene or its description, the characters mentioned in
+    the beat, the plot element, the previous beat or the beat. Places and
+    dialogs of new scenes are generated too, unless the level was never
+    generated. A dialog whose place is regenerated waits for it.
+
+    `on_result(level, key, text)` is called as each result is generated, as
+    in generate_story_async.
+
+    Returns:
+      The names of the regenerated places and indices of the regenerated
+      dialogs.
+    """
+    scenes = self._scenes.scenes
+    place_names = self._scenes.place_names()
+    stale_places = []
+    if self._input_hashes['places']:
+      stale_places = [name for name in place_names if self._place_is_stale(name)]
+      self._places = {name: self._places[name] for name in place_names
+                      if name in self._places}
+      self._input_hashes['places'] = {
+          name: self._input_hashes['places'][name] for name in place_names
+          if name in self._input_hashes['places']}
+    refresh_dialogs = any(self._input_hashes['dialogs'])
+    for items in (self._dialogs, self.prompts['dialogs'], self._input_hashes['dialogs']):
+      del items[len(scenes):]
+      items.extend([''] * (len(scenes) - len(items)))
+    refreshed_dialogs = []
+
+    async def place(place_name: str):
+      (self._places[place_name], prompt) = await generate_place_description_async(
+          storyline=self._storyline,
+          place_name=place_name,
+          prefixes=self._prefixes,
+          client=self._client,
+          model_filter=self._filter,
+          seed=seed,
+          num_samples=self._num_samples)
+      self._input_hashes['places'][place_name] = _input_hash(prompt)
+      if on_result is not None:
+        on_result('place', place_name, self._places[place_name].description)
+
+    async def dialog(k: int, place_task: Optional[asyncio.Future]):
+      if place_task is not None:
+        await place_task
+      if not self._dialog_is_stale(k):
+        return
+      self._dialogs[k], self.prompts['dialogs'][k] = await generate_dialog_async(
+          storyline=self._storyline,
+          scenes=scenes[:(k + 1)],
+          character_descriptions=self._characters.character_descriptions,
+          place_descriptions=self._places,
+          prefixes=self._prefixes,
+          max_paragraph_length=self._max_paragraph_length,
+          max_num_repetitions=MAX_NUM_REPETITIONS,
+          client=self._client,
+          model_filter=self._filter,
+          num_samples=self._num_samples,
+          seed=seed)
+      self._record_dialog_hashes([k])
+      refreshed_dialogs.append(k)
+      if on_result is not None:
+        on_result('dialog', k, strip_remove_end(self._dialogs[k]))
+
+    # Output lengths are learned per genre.
+    with generation_genre(self._genre):
+      place_tasks = {name: asyncio.ensure_future(place(name)) for name in stale_places}
+      tasks = list(place_tasks.values())
+      if refresh_dialogs:
+        tasks += [asyncio.ensure_future(dialog(k, place_tasks.get(scene.place)))
+                  for k, scene in enumerate(scenes)]
+      try:
+        await asyncio.gather(*tasks)
+      finally:
+        for task in tasks:
+          task.cancel()
+
+    if self._input_hashes['places']:
+      self.prompts['places'] = [
+          build_place_prompt(self._storyline, name, self._prefixes)
+          for name in self._places]
+    if stale_places or refreshed_dialogs:
+      timestamp = time.time()
+      self.interventions[timestamp] = 'REFRESH\n'
+      for place_name in stale_places:
+        self.interventions[timestamp] += self._places[place_name].to_string()
+      for k in sorted(refreshed_dialogs):
+        self.interventions[timestamp] += str(self._dialogs[k])
+    return (stale_places, sorted(refreshed_dialogs))
+
+  # Blocking version of refresh_async, for scripts.
+  refresh = sync_shim(refresh_async)
+
+  def to_state(self) -> Dict:
+    """Return the state of the generator as plain JSON types.
+
+    Prefixes, client and filter are left out: from_state takes them again,
+    the prefixes being looked up from the genre.
+    """
+    return {
+        'storyline': self._storyline,
+        'genre': self._genre,
+        'max_paragraph_length': self._max_paragraph_length,
+        'max_paragraph_length_characters': self._max_paragraph_length_characters,
+        'max_paragraph_length_scenes': self._max_paragraph_length_scenes,
+        'num_samples': self._num_samples,
+        'level': self._level,
+        'prompts': self.prompts,
+        'title': self._title.title,
+        'characters': self._characters.character_descriptions,
+        'scenes': [list(scene) for scene in self._scenes.scenes],
+        'places': {name: place and place.description
+                   for name, place in self._places.items()},
+        'dialogs': self._dialogs,
+        'interventions': list(self.interventions.items()),
+        'input_hashes': self._input_hashes,
+    }
+
+  @classmethod
+  def from_state(cls,
+                 state: Dict,
+                 prefixes: Dict[str, str],
+                 client: Optional[LanguageAPI] = None,
+                 filter: Optional[FilterAPI] = None) -> 'StoryGenerator':
+    """Return the generator whose state to_state returned."""
+    generator = cls(
+        storyline=state['storyline'],
+        prefixes=prefixes,
+        max_paragraph_length=state['max_paragraph_length'],
+        max_paragraph_length_characters=state['max_paragraph_length_characters'],
+        max_paragraph_length_scenes=state['max_paragraph_length_scenes'],
+        num_samples=state['num_samples'],
+        client=client,
+        filter=filter,
+        genre=state['genre'])
+    generator._level = state['level']
+    generator.prompts = state['prompts']
+    generator._title = Title(state['title'])
+    generator._characters = Characters(state['characters'])
+    generator._scenes = Scenes([Scene(*scene) for scene in state['scenes']])
+    generator._places = {
+        name: description if description is None else Place(name, description)
+        for name, description in state['places'].items()}
+    generator._dialogs = state['dialogs']
+    generator.interventions = dict(state['interventions'])
+    generator._input_hashes = state['input_hashes']
+    return generator
+
   def get_story(self):
     if self._characters is not None:
       character_descriptions = get_character_descriptions(self._characters)
@@ -322,11 +705,11 @@ class StoryGenerator:
         self.interventions[timestamp] += ' ' + str(entity)
       self.interventions[timestamp] += prompt_diff
 
-  def complete(self,
-               level=0,
-               seed=None,
-               entity=None,
-               sample_length=SAMPLE_LENGTH):
+  async def complete_async(self,
+                           level=0,
+                           seed=None,
+                           entity=None,
+                           sample_length=SAMPLE_LENGTH):
     if level < 0 or level >= len(self.level_names):
       raise ValueError('Invalid level encountered on step.')
     prompt_diff = None
@@ -336,7 +719,7 @@ class StoryGenerator:
       text_characters = self._characters.to_string()
       text_characters = strip_remove_end(text_characters)
       prompt = self.prompts['characters'] + text_characters
-      text = generate_text(
+      text = await generate_text_async(
           generation_prompt=prompt,
           client=self._client,
           model_filter=self._filter,
@@ -355,7 +738,7 @@ class StoryGenerator:
       text_scenes = self._scenes.to_string()
       text_scenes = strip_remove_end(text_scenes)
       prompt = self.prompts['scenes'] + text_scenes
-      text = generate_text(
+      text = await generate_text_async(
           generation_prompt=prompt,
           client=self._client,
           model_filter=self._filter,
@@ -378,7 +761,7 @@ class StoryGenerator:
         self.prompts['dialogs'].append('')
       if entity >= 0 and entity < num_scenes:
         prompt = (self.prompts['dialogs'][entity] + self._dialogs[entity])
-        text = generate_text(
+        text = await generate_text_async(
             generation_prompt=prompt,
             client=self._client,
             model_filter=self._filter,
@@ -398,3 +781,5 @@ class StoryGenerator:
         self.interventions[timestamp] += ' ' + str(entity)
       self.interventions[timestamp] += prompt_diff
 
+  # Blocking version of complete_async, for scripts.
+  complete = sync_shim(complete_async)
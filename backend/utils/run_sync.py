@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _engine_loop() -> asyncio.AbstractEventLoop:
+  """Return the event loop running blocking calls, starting it if needed.
+
+  A single long-lived loop keeps the async clients, some of which bind to
+  the first loop they run on, usable from one call to the next.
+  """
+  global _loop
+  with _loop_lock:
+    if _loop is None:
+      _loop = asyncio.new_event_loop()
+      threading.Thread(target=_loop.run_forever, name='engine-loop',
+                       daemon=True).start()
+    return _loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+  """Run a coroutine to completion from blocking code, such as a script.
+
+  The coroutine runs in a copy of the caller's context. Calling this from a
+  running event loop would block it, so coroutines must be awaited there.
+  """
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    pass
+  else:
+    coro.close()
+    raise RuntimeError('run_sync called from a running event loop, await instead')
+  future = asyncio.run_coroutine_threadsafe(coro, _engine_loop())
+  try:
+    return future.result()
+  except BaseException:
+    future.cancel()
+    raise
+
+
+def iterate_sync(iterator: AsyncIterator[T]) -> Iterator[T]:
+  """Iterate over an async iterator from blocking code."""
+  try:
+    while True:
+      try:
+        item = run_sync(iterator.__anext__())
+      except StopAsyncIteration:
+        return
+      yield item
+  finally:
+    aclose = getattr(iterator, 'aclose', None)
+    if aclose is not None:
+      run_sync(aclose())
+
+
+def sync_shim(async_fn: Callable[..., Awaitable[T]]) -> Callable[..., T]:
+  """Return a blocking version of a coroutine function, named without `_async`."""
+
+  @functools.wraps(async_fn)
+  def shim(*args, **kwargs) -> T:
+    return run_sync(async_fn(*args, **kwargs))
+
+  name = async_fn.__name__
+  if name.endswith('_async'):
+    name = name[:-len('_async')]
+  shim.__name__ = name
+  shim.__qualname__ = async_fn.__qualname__[:-len(async_fn.__name__)] + name
+  return shim